@@ -1,6 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, StudentProfile, TeacherProfile
+from .models import (
+    User, StudentProfile, TeacherProfile, BackgroundJob, Exercise, DiagnosticQuestionSet,
+    ConversationTurn, RollingSummary, LLMUsageEvent, LLMUsageRollup,
+)
 
 class StudentProfileInline(admin.StackedInline):
     model = StudentProfile
@@ -17,4 +20,75 @@ class CustomUserAdmin(UserAdmin):
     list_display = ('username', 'email', 'first_name', 'last_name', 'role', 'is_staff')
     list_filter = ('role', 'is_staff', 'is_superuser', 'is_active')
 
-admin.site.register(User, CustomUserAdmin)
\ No newline at end of file
+admin.site.register(User, CustomUserAdmin)
+
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'max_attempts', 'run_after', 'created_at')
+    list_filter = ('status', 'name')
+    search_fields = ('idempotency_key',)
+    readonly_fields = ('created_at', 'finished_at', 'locked_by', 'locked_at')
+
+
+@admin.register(Exercise)
+class ExerciseAdmin(admin.ModelAdmin):
+    list_display = ('id', 'matiere', 'chapitre', 'niveau_difficulte', 'times_served', 'created_at')
+    list_filter = ('matiere', 'niveau_difficulte')
+
+
+@admin.register(DiagnosticQuestionSet)
+class DiagnosticQuestionSetAdmin(admin.ModelAdmin):
+    list_display = ('id', 'matiere', 'class_level', 'version', 'variant', 'is_active', 'times_served')
+    list_filter = ('matiere', 'class_level', 'is_active')
+
+
+@admin.register(ConversationTurn)
+class ConversationTurnAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'user_matter', 'role', 'created_at')
+    list_filter = ('role',)
+    search_fields = ('user__username',)
+
+
+@admin.register(RollingSummary)
+class RollingSummaryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user_matter', 'turns_summarized', 'summarized_through', 'updated_at')
+
+
+@admin.register(LLMUsageRollup)
+class LLMUsageRollupAdmin(admin.ModelAdmin):
+    list_display = (
+        'day', 'user', 'user_matter', 'action', 'model', 'calls', 'upstream_requests', 'failures',
+        'total_tokens', 'average_latency_ms',
+    )
+    list_filter = ('action', 'model', 'day')
+    search_fields = ('user__username', 'user_matter__matiere')
+    date_hierarchy = 'day'
+    ordering = ('-day', '-prompt_tokens')
+    list_select_related = ('user', 'user_matter')
+
+    @admin.display(description='Tokens')
+    def total_tokens(self, obj):
+        return obj.total_tokens
+
+    @admin.display(description='Latence moy. (ms)')
+    def average_latency_ms(self, obj):
+        return obj.latency_ms // obj.calls if obj.calls else 0
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(LLMUsageEvent)
+class LLMUsageEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'created_at', 'user', 'action', 'model', 'prompt_tokens', 'reply_tokens', 'latency_ms', 'upstream_requests', 'succeeded')
+    list_filter = ('action', 'model', 'succeeded')
+    search_fields = ('user__username',)
+    date_hierarchy = 'created_at'
+    list_select_related = ('user',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,183 @@
+"""
+Journal des échanges de tutorat et résumé glissant
+
+Chaque tour (message de l'élève, réponse du tuteur) est enregistré côté
+serveur. Tous les SUMMARY_EVERY tours non résumés, une tâche de fond réécrit
+le résumé glissant de la matière à partir du résumé précédent et des seuls
+nouveaux tours. Le prompt du tuteur contient ce résumé, les RECENT_TURNS
+derniers tours et tous les tours pas encore résumés (au plus
+MAX_PROMPT_TURNS, le temps que la tâche passe) : aucun tour n'est absent à la
+fois du résumé et du prompt, et sa taille ne dépend plus de la longueur de
+la session.
+"""
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from backend.jobs import enqueue
+from backend.rag_service import generate_response
+from backend.usage import usage_context
+from prompts_templates import get_rolling_summary_prompt
+
+from .models import ConversationTurn, RollingSummary, UserMatter
+
+DEFAULT_CONFIG = {
+    'RECENT_TURNS': 8,        # tours repris tels quels dans le prompt du tuteur
+    'SUMMARY_EVERY': 8,       # tours non résumés avant une mise à jour du résumé (<= RECENT_TURNS)
+    'MAX_PROMPT_TURNS': 32,   # plafond des tours non résumés repris si la tâche de résumé est en retard
+    'MAX_TURN_CHARS': 800,    # longueur maximale d'un tour dans un prompt
+    'SUMMARY_MAX_WORDS': 150,
+}
+
+ROLE_LABELS = {
+    ConversationTurn.ROLE_STUDENT: "Élève",
+    ConversationTurn.ROLE_TUTOR: "Tuteur",
+}
+
+
+def get_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'CONVERSATION_MEMORY', {}) or {})
+    if config['RECENT_TURNS'] < config['SUMMARY_EVERY']:
+        # Sinon les plus anciens tours en attente sortiraient du prompt avant d'être résumés
+        raise ImproperlyConfigured(
+            "CONVERSATION_MEMORY: RECENT_TURNS doit être supérieur ou égal à SUMMARY_EVERY"
+        )
+    return config
+
+
+def _clip(text, max_chars):
+    text = " ".join((text or "").split())
+    return text if len(text) <= max_chars else text[:max_chars] + "..."
+
+
+def format_turns(turns, max_chars=None):
+    max_chars = max_chars or get_config()['MAX_TURN_CHARS']
+    return "\n".join(f"{ROLE_LABELS.get(turn.role, turn.role)}: {_clip(turn.content, max_chars)}" for turn in turns)
+
+
+def _summarized_through(user_matter):
+    summary = RollingSummary.objects.filter(user_matter=user_matter).values_list('summarized_through', flat=True).first()
+    return summary or 0
+
+
+def pending_turns(user_matter, after=None):
+    """Tours pas encore intégrés au résumé glissant"""
+    after = _summarized_through(user_matter) if after is None else after
+    return ConversationTurn.objects.filter(user_matter=user_matter, id__gt=after).order_by('id')
+
+
+def record_exchange(user, user_matter, message, reply=None):
+    """Enregistrer le message de l'élève (et la réponse du tuteur) puis planifier le résumé si besoin"""
+    turns = []
+    if message:
+        turns.append(ConversationTurn(user=user, user_matter=user_matter, role=ConversationTurn.ROLE_STUDENT, content=message))
+    if reply:
+        turns.append(ConversationTurn(user=user, user_matter=user_matter, role=ConversationTurn.ROLE_TUTOR, content=reply))
+    if not turns:
+        return
+    with transaction.atomic():
+        for turn in turns:
+            turn.save()
+        schedule_rolling_summary(user_matter)
+
+
+def schedule_rolling_summary(user_matter):
+    """Planifier la mise à jour du résumé une fois SUMMARY_EVERY tours accumulés.
+
+    Si la tâche de ce point de départ a échoué (panne de Gemini), enqueue la
+    remet en file au tour suivant : le résumé ne reste pas bloqué.
+    """
+    after = _summarized_through(user_matter)
+    if pending_turns(user_matter, after).count() < get_config()['SUMMARY_EVERY']:
+        return
+    # Une seule tâche par point de départ du résumé
+    enqueue(
+        "grasss.update_rolling_summary",
+        {"user_matter_id": user_matter.id},
+        idempotency_key=f"rolling-summary:{user_matter.id}:{after}",
+    )
+
+
+def recent_context(user_matter):
+    """Résumé glissant + derniers tours et tours non résumés, prêts à insérer dans le prompt du tuteur"""
+    config = get_config()
+    summary, after = (
+        RollingSummary.objects.filter(user_matter=user_matter)
+        .values_list('summary_text', 'summarized_through').first()
+    ) or ("", 0)
+    limit = max(config['RECENT_TURNS'], config['MAX_PROMPT_TURNS'])
+    latest = ConversationTurn.objects.filter(user_matter=user_matter).order_by('-id')[:limit]
+    # Les RECENT_TURNS derniers, plus les tours que le résumé ne couvre pas encore
+    turns = [turn for index, turn in enumerate(latest) if index < config['RECENT_TURNS'] or turn.id > after]
+    turns.reverse()
+    parts = []
+    if summary:
+        parts.append(f"RÉSUMÉ DES ÉCHANGES PRÉCÉDENTS:\n{summary}")
+    if turns:
+        parts.append(f"DERNIERS ÉCHANGES:\n{format_turns(turns, config['MAX_TURN_CHARS'])}")
+    return "\n\n".join(parts)
+
+
+def history_text(user_matter):
+    """Historique compact côté serveur pour le résumé de session : résumé glissant + tours non résumés"""
+    summary = RollingSummary.objects.filter(user_matter=user_matter).first()
+    after = summary.summarized_through if summary else 0
+    parts = []
+    if summary and summary.summary_text:
+        parts.append(f"Résumé des échanges précédents:\n{summary.summary_text}")
+    # Borné comme le prompt du tuteur si le résumé glissant a pris du retard
+    turns = list(pending_turns(user_matter, after).reverse()[:get_config()['MAX_PROMPT_TURNS']])
+    turns.reverse()
+    if turns:
+        parts.append(format_turns(turns))
+    return "\n\n".join(parts)
+
+
+def update_rolling_summary(user_matter_id):
+    """Intégrer les tours en attente au résumé glissant (appel IA).
+
+    Retourne le nombre de tours intégrés. La mise à jour est conditionnelle :
+    si une autre tâche a avancé le résumé entre-temps, rien n'est écrasé.
+    """
+    from .views_grasss import _get_reply_text
+
+    user_matter = UserMatter.objects.select_related('user').filter(pk=user_matter_id).first()
+    if user_matter is None:
+        return 0
+    config = get_config()
+    summary, _ = RollingSummary.objects.get_or_create(user_matter=user_matter)
+    # Rattraper un gros retard par paquets bornés
+    turns = list(pending_turns(user_matter, summary.summarized_through)[:config['SUMMARY_EVERY'] * 4])
+    if len(turns) < config['SUMMARY_EVERY']:
+        return 0
+
+    user = user_matter.user
+    prompt = get_rolling_summary_prompt(
+        user_name=user.first_name or user.username,
+        matiere=user_matter.matiere,
+        previous_summary=summary.summary_text,
+        new_turns=format_turns(turns, config['MAX_TURN_CHARS']),
+        max_words=config['SUMMARY_MAX_WORDS'],
+    )
+    with usage_context(user, user_matter, enforce_quota=False):
+        raw = generate_response(prompt, action='summary')
+    reply_text = _get_reply_text(raw).strip()
+    if not reply_text or raw.get('degraded'):
+        # Lever une erreur pour que la tâche soit retentée plus tard
+        raise RuntimeError("Mise à jour du résumé glissant indisponible")
+
+    updated = RollingSummary.objects.filter(
+        pk=summary.pk, summarized_through=summary.summarized_through
+    ).update(
+        summary_text=reply_text,
+        summarized_through=turns[-1].id,
+        turns_summarized=summary.turns_summarized + len(turns),
+        updated_at=timezone.now(),
+    )
+    if updated:
+        # Des tours ont pu s'accumuler pendant la génération
+        schedule_rolling_summary(user_matter)
+    return len(turns) if updated else 0
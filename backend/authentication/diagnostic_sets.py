@@ -0,0 +1,165 @@
+"""
+Jeux de questions de diagnostic pré-générés
+
+Les questions du diagnostic initial ne dépendent que de la matière et de la
+classe (3ème ou Terminale D) : elles sont générées une fois par variante
+(commande `generate_diagnostic_sets`, ou au premier élève qui en a besoin),
+versionnées, puis servies en rotation sans appel à l'IA. Le profil élève ne
+garde qu'une référence vers le jeu servi.
+"""
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F, Max
+
+from backend.jobs import enqueue
+from backend.rag_service import generate_response
+from prompts_templates import get_diagnostic_prompt
+
+from .models import DiagnosticQuestionSet
+
+DEFAULT_VARIANTS = 3
+
+
+def variants_per_level():
+    return int(getattr(settings, 'DIAGNOSTIC_SET_VARIANTS', DEFAULT_VARIANTS))
+
+
+def current_version(matiere, class_level):
+    version = DiagnosticQuestionSet.objects.filter(
+        matiere=matiere, class_level=class_level, is_active=True
+    ).aggregate(version=Max('version'))['version']
+    return version or 1
+
+
+def _active_sets(matiere, class_level, version):
+    return DiagnosticQuestionSet.objects.filter(
+        matiere=matiere, class_level=class_level, version=version, is_active=True
+    )
+
+
+def validate_question_set(data):
+    """Retourne le jeu normalisé s'il contient des questions exploitables, sinon None"""
+    if not isinstance(data, dict) or not isinstance(data.get('questions'), list):
+        return None
+    questions = []
+    for i, question in enumerate(data['questions'], start=1):
+        if not isinstance(question, dict) or not str(question.get('text') or '').strip():
+            continue
+        questions.append(dict(question, id=question.get('id', i), text=str(question['text']).strip()))
+    if len(questions) < 3:
+        return None
+    return dict(data, questions=questions)
+
+
+def generate_question_set(matiere, class_level, variant, version=None, activate=True):
+    """Générer (appel IA) et enregistrer une variante. Retourne le jeu ou None."""
+    from .views_grasss import _get_reply_text, _parse_json_from_reply
+
+    if version is None:
+        version = current_version(matiere, class_level)
+        siblings = _active_sets(matiere, class_level, version)
+    else:
+        # Version explicite (ex. publish_new_version) : ses variantes ne sont
+        # pas encore actives mais doivent quand même être évitées
+        siblings = DiagnosticQuestionSet.objects.filter(
+            matiere=matiere, class_level=class_level, version=version
+        )
+    existing = DiagnosticQuestionSet.objects.filter(
+        matiere=matiere, class_level=class_level, version=version, variant=variant
+    ).first()
+    if existing is not None:
+        return existing
+
+    others = siblings.exclude(variant=variant)
+    avoid = [
+        question.get('text')
+        for question_set in others
+        for question in question_set.data.get('questions', [])
+        if isinstance(question, dict)
+    ]
+    prompt = get_diagnostic_prompt(matiere=matiere, niveau_scolaire=class_level)
+    prompt += f"\n\nVariante n°{variant} de ce diagnostic."
+    if avoid:
+        prompt += "\nN'utilise aucune de ces questions déjà posées dans d'autres variantes:\n"
+        prompt += "\n".join(f"- {text}" for text in avoid if text)
+
+    raw = generate_response(prompt, action='diagnostic_set')
+    reply_text = _get_reply_text(raw)
+    if not reply_text or raw.get('degraded'):
+        return None
+    data = validate_question_set(_parse_json_from_reply(reply_text))
+    if data is None:
+        return None
+    try:
+        return DiagnosticQuestionSet.objects.create(
+            matiere=matiere,
+            class_level=class_level,
+            version=version,
+            variant=variant,
+            data=data,
+            is_active=activate,
+        )
+    except IntegrityError:
+        # Générée en parallèle par une autre requête ou un worker
+        return DiagnosticQuestionSet.objects.get(
+            matiere=matiere, class_level=class_level, version=version, variant=variant
+        )
+
+
+def schedule_missing_variants(matiere, class_level, version=None):
+    """Planifier en tâche de fond la génération des variantes manquantes"""
+    version = version or current_version(matiere, class_level)
+    present = set(
+        DiagnosticQuestionSet.objects.filter(
+            matiere=matiere, class_level=class_level, version=version
+        ).values_list('variant', flat=True)
+    )
+    for variant in range(1, variants_per_level() + 1):
+        if variant in present:
+            continue
+        enqueue(
+            "diagnostics.generate_set",
+            {"matiere": matiere, "class_level": class_level, "variant": variant, "version": version},
+            idempotency_key=f"diagnostic-set:{matiere}:{class_level}:v{version}.{variant}",
+        )
+
+
+def get_question_set(matiere, class_level):
+    """Servir le jeu actif le moins servi (rotation entre variantes).
+
+    Au premier besoin pour une matière × classe, une variante est générée
+    immédiatement et les autres sont planifiées en tâche de fond.
+    """
+    version = current_version(matiere, class_level)
+    question_set = _active_sets(matiere, class_level, version).order_by('times_served', 'variant').first()
+    if question_set is None:
+        question_set = generate_question_set(matiere, class_level, variant=1, version=version)
+        if question_set is None:
+            return None
+        schedule_missing_variants(matiere, class_level, version)
+    DiagnosticQuestionSet.objects.filter(pk=question_set.pk).update(times_served=F('times_served') + 1)
+    return question_set
+
+
+def publish_new_version(matiere, class_level, variants=None):
+    """Générer une nouvelle version complète puis désactiver les précédentes.
+
+    Les élèves ayant un diagnostic en cours gardent leur référence vers
+    l'ancienne version. Retourne le nombre de variantes générées.
+    """
+    latest = DiagnosticQuestionSet.objects.filter(
+        matiere=matiere, class_level=class_level
+    ).aggregate(version=Max('version'))['version'] or 0
+    version = latest + 1
+    created = [
+        generate_question_set(matiere, class_level, variant, version=version, activate=False)
+        for variant in range(1, (variants or variants_per_level()) + 1)
+    ]
+    created = [question_set for question_set in created if question_set is not None]
+    if created:
+        DiagnosticQuestionSet.objects.filter(
+            matiere=matiere, class_level=class_level
+        ).exclude(version=version).update(is_active=False)
+        DiagnosticQuestionSet.objects.filter(pk__in=[s.pk for s in created]).update(is_active=True)
+    return len(created)
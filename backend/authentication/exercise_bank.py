@@ -0,0 +1,189 @@
+"""
+Banque d'exercices QCM pré-générés
+
+Les exercices sont générés à l'avance (tâche de fond ou commande
+`refill_exercise_bank`), validés, normalisés puis stockés par
+matière × chapitre × niveau de difficulté. `action=exercise` sert alors un
+exercice jamais vu par l'élève en une lecture SQL ; dès que le stock d'exercices
+inédits pour cet élève passe sous LOW_WATERMARK, une recharge est planifiée.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from backend.jobs import enqueue
+from backend.rag_service import generate_response
+from prompts_templates import get_exercise_prompt
+
+from .models import Exercise, ServedExercise
+
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    'LOW_WATERMARK': 5,   # exercices inédits restants pour l'élève
+    'REFILL_SIZE': 10,    # exercices générés par recharge
+    'REFILL_RETRY_SECONDS': 600,  # une recharge sans effet (échec, doublons) est retentée après ce délai
+}
+
+# Questions existantes rappelées au modèle pour éviter les doublons
+AVOID_RECENT_QUESTIONS = 20
+
+
+def get_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, 'EXERCISE_BANK', {}) or {})
+    return config
+
+
+def _pool(matiere, chapitre, niveau_difficulte):
+    return Exercise.objects.filter(
+        matiere=matiere,
+        chapitre=chapitre or '',
+        niveau_difficulte=niveau_difficulte,
+    )
+
+
+def _content_hash(matiere, chapitre, niveau_difficulte, question):
+    normalized = " ".join((question or '').lower().split())
+    key = f"{matiere}\x00{chapitre or ''}\x00{niveau_difficulte}\x00{normalized}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def validate_exercise(exercise_data):
+    """Retourne l'exercice normalisé s'il est exploitable, sinon None"""
+    from .views_grasss import _normalize_exercise_options
+
+    if not isinstance(exercise_data, dict):
+        return None
+    question = str(exercise_data.get('question') or '').strip()
+    if not question:
+        return None
+    raw_options = exercise_data.get('options')
+    if not isinstance(raw_options, list) or len(raw_options) < 2:
+        return None
+    options = _normalize_exercise_options(exercise_data)
+    if len(options) < 2 or any(not option['text'].strip() for option in options):
+        return None
+    if sum(1 for option in options if option['is_correct']) != 1:
+        return None
+    return dict(exercise_data, question=question, options=options)
+
+
+def available_count(matiere, chapitre, niveau_difficulte):
+    return _pool(matiere, chapitre, niveau_difficulte).count()
+
+
+def unseen_count(user, matiere, chapitre, niveau_difficulte):
+    return _pool(matiere, chapitre, niveau_difficulte).exclude(servings__user=user).count()
+
+
+SERVE_ATTEMPTS = 3
+
+
+def serve_exercise(user, matiere, chapitre, niveau_difficulte):
+    """Servir un exercice jamais vu par l'élève (le moins servi d'abord).
+
+    Retourne (exercice ou None, exercices inédits restants). Le stock restant
+    est exact sous LOW_WATERMARK et vient de la même lecture : pas de COUNT.
+    """
+    limit = get_config()['LOW_WATERMARK'] + SERVE_ATTEMPTS
+    candidates = list(
+        _pool(matiere, chapitre, niveau_difficulte)
+        .exclude(servings__user=user)
+        .order_by('times_served', 'id')[:limit]
+    )
+    # Deux requêtes simultanées du même élève peuvent viser le même exercice
+    for tried, exercise in enumerate(candidates[:SERVE_ATTEMPTS], start=1):
+        try:
+            with transaction.atomic():
+                ServedExercise.objects.create(user=user, exercise=exercise)
+        except IntegrityError:
+            continue
+        Exercise.objects.filter(pk=exercise.pk).update(times_served=F('times_served') + 1)
+        return exercise, len(candidates) - tried
+    return None, max(0, len(candidates) - SERVE_ATTEMPTS)
+
+
+def schedule_refill(user, matiere, chapitre, niveau_difficulte, unseen=None):
+    """Planifier une recharge si le stock inédit de l'élève est sous le seuil"""
+    config = get_config()
+    if unseen is None:
+        unseen = unseen_count(user, matiere, chapitre, niveau_difficulte)
+    if unseen >= config['LOW_WATERMARK']:
+        return False
+    pool_key = hashlib.sha256(
+        f"{matiere}\x00{chapitre or ''}\x00{niveau_difficulte}".encode('utf-8')
+    ).hexdigest()[:16]
+    # Une seule recharge par état de la banque, même si plusieurs élèves la
+    # déclenchent ; la fenêtre de temps permet de retenter une recharge qui
+    # n'a rien ajouté (doublons, réponses invalides) sans attendre que la banque grossisse
+    window = int(time.time() // config['REFILL_RETRY_SECONDS'])
+    enqueue(
+        "exercises.refill_bank",
+        {
+            "matiere": matiere,
+            "chapitre": chapitre or '',
+            "niveau_difficulte": niveau_difficulte,
+            "count": config['REFILL_SIZE'],
+        },
+        idempotency_key=f"exercise-refill:{pool_key}:{available_count(matiere, chapitre, niveau_difficulte)}:{window}",
+    )
+    return True
+
+
+def generate_exercises(matiere, chapitre, niveau_difficulte, count):
+    """Générer `count` exercices (appels IA), les valider et les stocker.
+
+    Retourne le nombre d'exercices ajoutés à la banque.
+    """
+    from .views_grasss import _get_reply_text, _parse_json_from_reply, course_query
+
+    chapitre = chapitre or ''
+    added = 0
+    failures = 0
+    while added < count and failures < count:
+        recent = list(
+            _pool(matiere, chapitre, niveau_difficulte)
+            .order_by('-id')
+            .values_list('data__question', flat=True)[:AVOID_RECENT_QUESTIONS]
+        )
+        avoid = "\n".join(f"- {question}" for question in recent if question)
+        prompt = get_exercise_prompt(
+            matiere=matiere,
+            chapitre=chapitre or 'Général',
+            niveau_difficulte=niveau_difficulte,
+            style_apprentissage='mixed',
+            contexte_pedagogique="Banque d'exercices commune à tous les élèves de ce niveau",
+            rag_context=(
+                f"Questions déjà dans la banque (ne pas les reprendre):\n{avoid}" if avoid
+                else "Aucun exercice existant pour ce chapitre."
+            )
+        )
+        raw = generate_response(prompt, action='exercise_bank', retrieval_query=course_query(matiere, chapitre))
+        reply_text = _get_reply_text(raw)
+        if not reply_text or raw.get('degraded'):
+            if added:
+                break
+            # Rien n'a pu être généré : la tâche sera retentée
+            raise RuntimeError("Génération d'exercices indisponible")
+        exercise_data = validate_exercise(_parse_json_from_reply(reply_text))
+        if exercise_data is None:
+            failures += 1
+            continue
+        _, created = Exercise.objects.get_or_create(
+            content_hash=_content_hash(matiere, chapitre, niveau_difficulte, exercise_data['question']),
+            defaults={
+                'matiere': matiere,
+                'chapitre': chapitre,
+                'niveau_difficulte': niveau_difficulte,
+                'data': exercise_data,
+            }
+        )
+        if created:
+            added += 1
+        else:
+            failures += 1
+    return added
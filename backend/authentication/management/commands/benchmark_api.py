@@ -0,0 +1,252 @@
+"""
+Benchmark de charge et de latence de l'API du tuteur, sans appel à Gemini.
+
+La commande crée une base de test jetable (comme `manage.py test`), une base
+Chroma temporaire avec un petit corpus de démonstration, remplace Gemini par
+le fournisseur local `stub` (latence tirée d'une distribution) puis envoie
+les requêtes de chaque action à concurrence fixée. Rapport : p50/p95/p99,
+requêtes par seconde et nombre de requêtes SQL par appel.
+
+    python manage.py benchmark_api
+    python manage.py benchmark_api --action tutor --action exercise --requests 200 --concurrency 16
+    python manage.py benchmark_api --latency lognormal:0.8,0.4 --output benchmark_api.json
+    python manage.py benchmark_api --same-prompt   # mesure cache + single-flight
+    python manage.py benchmark_api --throttled     # garde débits, quotas et admission (429 attendus)
+
+Sans --throttled, les limites par élève (LLM_THROTTLE), les quotas
+(LLM_USAGE) et le contrôle d'admission (LLM_ADMISSION) sont désactivés :
+sinon le benchmark mesure surtout des réponses 429.
+"""
+
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from authentication import conversation
+from authentication.models import StudentProfile, User, UserMatter
+from backend.benchmarking import QueryCounter, build_fixture_corpus, latency_sampler, summarize_latencies
+from backend.llm import build_provider, set_llm_provider
+from backend.rag_service import CORPUS_COLLECTION
+from backend.throttling import reset_admission_controller
+from rag_grasss_service import rag_service
+
+ACTIONS = ['chat', 'diagnostic', 'exercise', 'tutor', 'remediation', 'summary']
+MATIERES = ['Mathématiques', 'Français', 'SVT', 'Physique-Chimie']
+MESSAGES = [
+    "Je ne comprends pas le théorème de Thalès",
+    "Comment conjuguer un verbe au passé simple ?",
+    "Peux-tu m'expliquer la photosynthèse ?",
+    "Quelle est la différence entre la loi d'Ohm et la puissance ?",
+    "Comment résoudre une équation du premier degré ?",
+    "À quoi sert la dérivée d'une fonction ?",
+]
+
+CHAT_URL = '/api/auth/chat/'
+TUTOR_URL = '/api/auth/tutor/chat/'
+
+
+def _payload(action, index, same_prompt):
+    """(url, corps JSON) de la requête n° index pour action"""
+    message = MESSAGES[index % len(MESSAGES)]
+    if not same_prompt:
+        message = f"{message} (requête {index})"
+    if action == 'chat':
+        return CHAT_URL, {"message": message}
+    payload = {
+        "action": action,
+        "matiere": MATIERES[0] if same_prompt else MATIERES[index % len(MATIERES)],
+        "niveau_difficulte": "moyen",
+    }
+    if action == 'diagnostic':
+        payload["class_level"] = "3ème"
+    elif action in ('tutor', 'remediation'):
+        payload["message"] = message
+    # summary : historique lu dans le journal côté serveur
+    return TUTOR_URL, payload
+
+
+class Command(BaseCommand):
+    help = "Mesure débit et latence des endpoints du tuteur avec un LLM simulé"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--action', action='append', choices=ACTIONS, default=[],
+                            help="Action à mesurer (répétable). Défaut: toutes")
+        parser.add_argument('--requests', type=int, default=50,
+                            help="Requêtes mesurées par action")
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help="Requêtes simultanées")
+        parser.add_argument('--warmup', type=int, default=2,
+                            help="Requêtes non mesurées par action avant la mesure")
+        parser.add_argument('--users', type=int, default=None,
+                            help="Nombre d'élèves simulés (défaut: --concurrency)")
+        parser.add_argument('--latency', default='lognormal:0.4,0.5',
+                            help="Latence du LLM simulé: fixed:S, uniform:A,B, normal:M,SD, lognormal:MEDIANE,SIGMA")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--same-prompt', action='store_true',
+                            help="Toutes les requêtes d'une action identiques (cache de réponses et single-flight)")
+        parser.add_argument('--throttled', action='store_true',
+                            help="Garder les limites de débit, quotas et contrôle d'admission des réglages")
+        parser.add_argument('--eager-jobs', action='store_true',
+                            help="Exécuter les tâches de fond dans la requête (BACKGROUND_JOBS EAGER)")
+        parser.add_argument('--output', default=None,
+                            help="Écrire le rapport JSON dans ce fichier")
+
+    def handle(self, *args, **options):
+        actions = options['action'] or ACTIONS
+        concurrency = max(1, options['concurrency'])
+        try:
+            sampler = latency_sampler(options['latency'], seed=options['seed'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        workdir = tempfile.mkdtemp(prefix='benchmark_api_')
+        if connection.vendor == 'sqlite':
+            # Base fichier : les threads partagent la même base de test
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(workdir, 'benchmark.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        memory_path = rag_service.chroma_db_path
+
+        background_jobs = dict(getattr(settings, 'BACKGROUND_JOBS', {}), EAGER=options['eager_jobs'])
+        limits = {}
+        if not options['throttled']:
+            limits = dict(
+                LLM_THROTTLE={'ENABLED': False},
+                LLM_USAGE=dict(getattr(settings, 'LLM_USAGE', {}), QUOTAS_ENABLED=False),
+                LLM_ADMISSION={'ENABLED': False},
+            )
+        overrides = override_settings(
+            CHROMA_DB_PATH=os.path.join(workdir, 'chroma'),
+            BACKGROUND_JOBS=background_jobs,
+            ALLOWED_HOSTS=['testserver'],
+            **limits,
+        )
+        overrides.enable()
+        reset_admission_controller()
+        try:
+            provider = build_provider('stub')
+            provider.simulated_latency = sampler
+            set_llm_provider(provider)
+            rag_service.reopen(os.path.join(workdir, 'memory'))
+
+            self.stdout.write("Préparation du corpus de démonstration et des élèves...")
+            build_fixture_corpus(settings.CHROMA_DB_PATH, CORPUS_COLLECTION)
+            tokens = self._create_students(options['users'] or concurrency)
+
+            report = {
+                "config": {
+                    "requests": options['requests'],
+                    "concurrency": concurrency,
+                    "latency": options['latency'],
+                    "same_prompt": options['same_prompt'],
+                    "eager_jobs": options['eager_jobs'],
+                    "throttled": options['throttled'],
+                    "database": connection.vendor,
+                },
+                "actions": {},
+            }
+            for action in actions:
+                if options['warmup']:
+                    self._run(action, options['warmup'], concurrency, tokens, options['same_prompt'], offset=-options['warmup'])
+                result = self._run(action, options['requests'], concurrency, tokens, options['same_prompt'])
+                report["actions"][action] = result
+                self._print_row(action, result)
+        finally:
+            overrides.disable()
+            reset_admission_controller()
+            set_llm_provider(None)
+            rag_service.reopen(memory_path)
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Rapport écrit dans {options['output']}")
+        self.stdout.write(self.style.SUCCESS(f"✅ Benchmark terminé ({len(actions)} actions)."))
+
+    def _create_students(self, count):
+        """Élèves de test avec profil, matières et quelques échanges déjà journalisés"""
+        tokens = []
+        for i in range(count):
+            user = User.objects.create_user(username=f"bench_student_{i}", password=None, role=User.IS_STUDENT)
+            StudentProfile.objects.create(user=user, class_level='3ème')
+            for matiere in MATIERES:
+                user_matter = UserMatter.objects.create(user=user, matiere=matiere, chapitre='')
+                conversation.record_exchange(user, user_matter, MESSAGES[0], "Réponse de démonstration.")
+            tokens.append(str(RefreshToken.for_user(user).access_token))
+        return tokens
+
+    def _run(self, action, count, concurrency, tokens, same_prompt, offset=0):
+        """Envoyer count requêtes avec concurrency threads; retourner les mesures"""
+        pending = queue.Queue()
+        for index in range(count):
+            pending.put(offset + index)
+        latencies = []
+        queries = []
+        statuses = {}
+        lock = threading.Lock()
+
+        def worker():
+            client = Client(raise_request_exception=False)
+            try:
+                while True:
+                    try:
+                        index = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    url, body = _payload(action, index, same_prompt)
+                    counter = QueryCounter()
+                    started = time.perf_counter()
+                    with connection.execute_wrapper(counter):
+                        response = client.post(
+                            url,
+                            data=json.dumps(body),
+                            content_type='application/json',
+                            HTTP_AUTHORIZATION=f"Bearer {tokens[index % len(tokens)]}",
+                        )
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+                        queries.append(counter.count)
+                        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(concurrency, count))]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        errors = sum(n for code, n in statuses.items() if code >= 400)
+        result = {
+            "requests": len(latencies),
+            "errors": errors,
+            "status_codes": {str(code): n for code, n in sorted(statuses.items())},
+            "wall_seconds": round(wall, 3),
+            "rps": round(len(latencies) / wall, 2) if wall > 0 else None,
+            "db_queries_mean": round(sum(queries) / len(queries), 1) if queries else None,
+            "db_queries_max": max(queries) if queries else None,
+        }
+        result.update(summarize_latencies(latencies))
+        return result
+
+    def _print_row(self, action, result):
+        self.stdout.write(
+            f"  {action:<12} n={result['requests']:<5} err={result['errors']:<4} "
+            f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms "
+            f"rps={result['rps']} sql/req={result['db_queries_mean']} (max {result['db_queries_max']})"
+        )
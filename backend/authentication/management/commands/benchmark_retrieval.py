@@ -0,0 +1,347 @@
+"""
+Benchmark de la recherche dans le corpus : temps d'embedding, latence de
+recherche et rappel@k, pour une grille de configurations.
+
+Pour chaque modèle d'embedding et chaque taille de chunk, le corpus
+(documents_pedagogiques) est redécoupé et vectorisé une fois, puis une
+collection Chroma temporaire est construite pour chaque couple de paramètres
+HNSW (M, ef de recherche). Chaque requête du jeu étiqueté est cherchée en
+mode vector, lexical (BM25) et/ou hybrid (fusion RRF, comme rag_service).
+
+Le jeu de requêtes est un fichier JSON
+[{"query": "...", "relevant": [{"source": "cours.pdf", "pages": [3, 4]}]}],
+généré à partir du corpus avec --generate, ou le jeu de démonstration avec
+--fixture. La base Chroma de production n'est jamais modifiée.
+
+    python manage.py benchmark_retrieval --fixture
+    python manage.py benchmark_retrieval --generate 100 --save-queries requetes.json
+    python manage.py benchmark_retrieval --queries requetes.json --chunk-tokens 120,200,300 \\
+        --model all-MiniLM-L6-v2 --model paraphrase-multilingual-MiniLM-L12-v2 \\
+        --hnsw-m 16,32 --hnsw-ef 10,50,100 --output rapport_retrieval.md
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.benchmarking import (
+    FIXTURE_CORPUS,
+    fixture_queries,
+    generate_labelled_queries,
+    load_labelled_queries,
+    save_labelled_queries,
+    score_ranking,
+    summarize_latencies,
+)
+from backend.chunking import DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP_TOKENS, Chunker, model_token_counter
+from backend.embeddings import DEFAULT_EMBEDDING_MODEL, embed_texts
+from backend.indexing import DEFAULT_UPSERT_BATCH_SIZE, chunk_pages, extract_pdf_pages, list_pdfs
+from backend.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from backend.rag_service import RETRIEVAL_MODES
+from backend.vector_store import get_vector_store
+
+REPORT_COLUMNS = [
+    ("model", "Modèle"),
+    ("chunk_tokens", "Chunk"),
+    ("chunks", "Chunks"),
+    ("hnsw_m", "M"),
+    ("hnsw_ef", "ef"),
+    ("mode", "Mode"),
+    ("embed_ms_per_chunk", "Embed/chunk (ms)"),
+    ("query_embed_p50_ms", "Embed requête p50 (ms)"),
+    ("index_seconds", "Index (s)"),
+    ("search_p50_ms", "Recherche p50 (ms)"),
+    ("search_p95_ms", "Recherche p95 (ms)"),
+]
+
+
+def _int_list(value):
+    try:
+        return [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise CommandError(f"Liste d'entiers invalide : {value!r}")
+
+
+class Command(BaseCommand):
+    help = "Compare temps d'embedding, latence de recherche et rappel@k selon chunking, modèle et paramètres HNSW"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=settings.RAG_DOCUMENTS_PATH,
+                            help="Dossier des PDF du corpus")
+        parser.add_argument('--max-files', type=int, default=None,
+                            help="N'utiliser que les N premiers PDF")
+        parser.add_argument('--fixture', action='store_true',
+                            help="Corpus et requêtes de démonstration au lieu des PDF")
+        parser.add_argument('--queries', default=None,
+                            help="Fichier JSON des requêtes étiquetées")
+        parser.add_argument('--generate', type=int, default=0,
+                            help="Générer N requêtes à partir du corpus (si --queries n'est pas fourni)")
+        parser.add_argument('--save-queries', default=None,
+                            help="Écrire les requêtes générées dans ce fichier")
+        parser.add_argument('--chunk-tokens', default=str(DEFAULT_MAX_TOKENS),
+                            help="Tailles de chunk en tokens, séparées par des virgules")
+        parser.add_argument('--overlap-tokens', type=int, default=DEFAULT_OVERLAP_TOKENS)
+        parser.add_argument('--model', action='append', default=[],
+                            help=f"Modèle d'embedding (répétable). Défaut: {DEFAULT_EMBEDDING_MODEL}")
+        parser.add_argument('--hnsw-m', default='16',
+                            help="Valeurs de hnsw:M, séparées par des virgules")
+        parser.add_argument('--hnsw-ef', default='10,100',
+                            help="Valeurs de hnsw:search_ef, séparées par des virgules")
+        parser.add_argument('--construction-ef', type=int, default=100,
+                            help="hnsw:construction_ef des collections de test")
+        parser.add_argument('--modes', default='vector,hybrid',
+                            help=f"Modes de recherche parmi {', '.join(RETRIEVAL_MODES)}")
+        parser.add_argument('--k', default='1,3,5,10',
+                            help="Valeurs de k pour le rappel@k")
+        parser.add_argument('--candidates', type=int, default=None,
+                            help="Candidats par ranking en mode hybrid (défaut: RAG_HYBRID_CANDIDATES)")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', default=None,
+                            help="Rapport de comparaison (.md pour un tableau Markdown, sinon JSON)")
+
+    def handle(self, *args, **options):
+        chunk_sizes = _int_list(options['chunk_tokens'])
+        hnsw_ms = _int_list(options['hnsw_m'])
+        hnsw_efs = _int_list(options['hnsw_ef'])
+        ks = sorted(set(_int_list(options['k'])))
+        modes = [mode.strip() for mode in options['modes'].split(',') if mode.strip()]
+        unknown = [mode for mode in modes if mode not in RETRIEVAL_MODES]
+        if unknown or not modes:
+            raise CommandError(f"Mode(s) inconnu(s) : {', '.join(unknown) or '-'}")
+        if not (chunk_sizes and hnsw_ms and hnsw_efs and ks):
+            raise CommandError("--chunk-tokens, --hnsw-m, --hnsw-ef et --k ne peuvent pas être vides")
+        models = options['model'] or [DEFAULT_EMBEDDING_MODEL]
+        candidates = options['candidates'] or int(getattr(settings, 'RAG_HYBRID_CANDIDATES', 20))
+
+        pages_by_file = self._load_corpus(options)
+        queries = self._load_queries(options, pages_by_file)
+        self.stdout.write(
+            f"{len(pages_by_file)} documents, {len(queries)} requêtes, "
+            f"{len(models) * len(chunk_sizes)} découpages x {len(hnsw_ms) * len(hnsw_efs)} index HNSW"
+        )
+
+        rows = []
+        workdir = tempfile.mkdtemp(prefix='benchmark_retrieval_')
+        try:
+            store = get_vector_store(workdir)
+            for model in models:
+                count_tokens = model_token_counter(model)
+                query_vectors, query_embed = self._embed_queries(queries, model)
+                for chunk_tokens in chunk_sizes:
+                    corpus = self._chunk(pages_by_file, chunk_tokens, options['overlap_tokens'], count_tokens)
+                    started = time.perf_counter()
+                    embeddings = embed_texts(corpus['documents'], model_name=model, use_cache=False)
+                    embed_seconds = time.perf_counter() - started
+                    base = {
+                        "model": model,
+                        "chunk_tokens": chunk_tokens,
+                        "chunks": len(corpus['ids']),
+                        "embed_seconds": round(embed_seconds, 3),
+                        "embed_ms_per_chunk": round(embed_seconds * 1000 / max(1, len(corpus['ids'])), 2),
+                        "query_embed_p50_ms": query_embed['p50_ms'],
+                        "query_embed_p95_ms": query_embed['p95_ms'],
+                    }
+                    lexical = LexicalIndex()
+                    lexical.add(corpus['ids'], corpus['documents'])
+
+                    if 'lexical' in modes:
+                        row = dict(base, hnsw_m=None, hnsw_ef=None, mode='lexical', index_seconds=None)
+                        row.update(self._evaluate(queries, ks, corpus['metadatas'],
+                                                  lambda i: [doc_id for doc_id, _ in lexical.search(queries[i]['query'], k=max(ks))]))
+                        rows.append(self._print_row(row, ks))
+
+                    for hnsw_m in hnsw_ms:
+                        for hnsw_ef in hnsw_efs:
+                            rows.extend(self._run_hnsw(
+                                store, base, corpus, embeddings, lexical, queries, query_vectors,
+                                hnsw_m, hnsw_ef, options['construction_ef'], modes, ks, candidates,
+                            ))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        report = {
+            "config": {
+                "documents": len(pages_by_file),
+                "queries": len(queries),
+                "fixture": options['fixture'],
+                "overlap_tokens": options['overlap_tokens'],
+                "construction_ef": options['construction_ef'],
+                "hybrid_candidates": candidates,
+                "k": ks,
+            },
+            "results": rows,
+        }
+        if options['output']:
+            self._write_report(options['output'], report, ks)
+            self.stdout.write(f"Rapport écrit dans {options['output']}")
+        self.stdout.write(self.style.SUCCESS(f"✅ Benchmark de recherche terminé ({len(rows)} configurations)."))
+
+    # ------------------------------------------------------------------
+    # Corpus et requêtes
+    # ------------------------------------------------------------------
+
+    def _load_corpus(self, options):
+        """{nom de fichier: [(page, texte)]}"""
+        if options['fixture']:
+            return {f"{doc_id}.pdf": [(1, text)] for doc_id, text in FIXTURE_CORPUS.items()}
+        source = options['source']
+        if not os.path.isdir(source):
+            raise CommandError(f"Dossier introuvable : {source} (utiliser --fixture pour le corpus de démonstration)")
+        paths = list_pdfs(source)[:options['max_files']] if options['max_files'] else list_pdfs(source)
+        if not paths:
+            raise CommandError(f"Aucun PDF dans {source} (utiliser --fixture pour le corpus de démonstration)")
+        self.stdout.write(f"Extraction de {len(paths)} PDF...")
+        pages_by_file = {os.path.basename(path): extract_pdf_pages(path) for path in paths}
+        return {name: pages for name, pages in pages_by_file.items() if pages}
+
+    def _load_queries(self, options, pages_by_file):
+        if options['queries']:
+            try:
+                queries = load_labelled_queries(options['queries'])
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Jeu de requêtes illisible : {e}")
+        elif options['generate']:
+            # Découpage de référence, indépendant de la grille mesurée
+            corpus = self._chunk(pages_by_file, DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP_TOKENS, None)
+            queries = generate_labelled_queries(
+                zip(corpus['documents'], (corpus['metadatas'][doc_id] for doc_id in corpus['ids'])),
+                options['generate'],
+                seed=options['seed'],
+            )
+        elif options['fixture']:
+            queries = fixture_queries()
+        else:
+            raise CommandError("Fournir --queries FICHIER, --generate N ou --fixture")
+        if not queries:
+            raise CommandError("Aucune requête étiquetée")
+        if options['save_queries']:
+            save_labelled_queries(options['save_queries'], queries)
+            self.stdout.write(f"Requêtes écrites dans {options['save_queries']}")
+        return queries
+
+    def _chunk(self, pages_by_file, max_tokens, overlap_tokens, count_tokens):
+        chunker = Chunker(
+            max_tokens=max_tokens,
+            overlap_tokens=min(overlap_tokens, max_tokens // 2),
+            count_tokens=count_tokens,
+        )
+        corpus = {'ids': [], 'documents': [], 'metadatas': {}}
+        for filename, pages in pages_by_file.items():
+            ids, documents, metadatas = chunk_pages(filename, pages, chunker)
+            corpus['ids'].extend(ids)
+            corpus['documents'].extend(documents)
+            corpus['metadatas'].update(zip(ids, metadatas))
+        return corpus
+
+    def _embed_queries(self, queries, model):
+        """Vecteurs des requêtes, une par une comme en production, et leur latence"""
+        vectors = []
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            vectors.append(embed_texts([query['query']], model_name=model, use_cache=False)[0])
+            latencies.append(time.perf_counter() - started)
+        return vectors, summarize_latencies(latencies)
+
+    # ------------------------------------------------------------------
+    # Mesures
+    # ------------------------------------------------------------------
+
+    def _run_hnsw(self, store, base, corpus, embeddings, lexical, queries, query_vectors,
+                  hnsw_m, hnsw_ef, construction_ef, modes, ks, candidates):
+        name = f"bench_m{hnsw_m}_ef{hnsw_ef}"
+        collection = store.get_collection(name, create=True, metadata={
+            "hnsw:space": "cosine",
+            "hnsw:M": hnsw_m,
+            "hnsw:construction_ef": construction_ef,
+            "hnsw:search_ef": hnsw_ef,
+        })
+        rows = []
+        try:
+            ids = corpus['ids']
+            started = time.perf_counter()
+            for start in range(0, len(ids), DEFAULT_UPSERT_BATCH_SIZE):
+                end = start + DEFAULT_UPSERT_BATCH_SIZE
+                collection.upsert(ids=ids[start:end], documents=corpus['documents'][start:end],
+                                  embeddings=embeddings[start:end])
+            index_seconds = round(time.perf_counter() - started, 3)
+            max_k = max(ks)
+
+            def vector_ids(i, n):
+                result = collection.query(query_embeddings=[query_vectors[i]], n_results=min(n, len(ids)), include=[])
+                return result.get('ids', [[]])[0]
+
+            rankers = {
+                'vector': lambda i: vector_ids(i, max_k),
+                'hybrid': lambda i: reciprocal_rank_fusion(
+                    vector_ids(i, max(max_k, candidates)),
+                    [doc_id for doc_id, _ in lexical.search(queries[i]['query'], k=max(max_k, candidates))],
+                )[:max_k],
+            }
+            for mode in modes:
+                if mode not in rankers:
+                    continue
+                row = dict(base, hnsw_m=hnsw_m, hnsw_ef=hnsw_ef, mode=mode, index_seconds=index_seconds)
+                row.update(self._evaluate(queries, ks, corpus['metadatas'], rankers[mode]))
+                rows.append(self._print_row(row, ks))
+        finally:
+            store.delete_collection(name)
+        return rows
+
+    def _evaluate(self, queries, ks, metadatas, ranker):
+        """Latence de recherche (embedding de la requête exclu), rappel@k et MRR moyens"""
+        latencies = []
+        totals = {}
+        for i, query in enumerate(queries):
+            started = time.perf_counter()
+            ranked = ranker(i)
+            latencies.append(time.perf_counter() - started)
+            scores = score_ranking([metadatas[doc_id] for doc_id in ranked[:max(ks)]], query['relevant'], ks)
+            for key, value in scores.items():
+                totals[key] = totals.get(key, 0.0) + value
+        result = {f"search_{key}": value for key, value in summarize_latencies(latencies).items()}
+        for key, value in totals.items():
+            result["mrr" if key == "rr" else key] = round(value / len(queries), 4)
+        return result
+
+    # ------------------------------------------------------------------
+    # Rapport
+    # ------------------------------------------------------------------
+
+    def _print_row(self, row, ks):
+        hnsw = f"M={row['hnsw_m']} ef={row['hnsw_ef']}" if row['hnsw_m'] is not None else "-"
+        recalls = " ".join(f"R@{k}={row[f'recall@{k}']:.2f}" for k in ks)
+        self.stdout.write(
+            f"  {row['model']} chunk={row['chunk_tokens']} ({row['chunks']}) {hnsw} {row['mode']:<7} "
+            f"{recalls} MRR={row['mrr']:.2f} p50={row['search_p50_ms']}ms p95={row['search_p95_ms']}ms"
+        )
+        return row
+
+    def _write_report(self, path, report, ks):
+        if not path.endswith('.md'):
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            return
+        columns = REPORT_COLUMNS + [(f"recall@{k}", f"R@{k}") for k in ks] + [("mrr", "MRR")]
+        # Meilleur rappel d'abord, puis recherche la plus rapide
+        ordered = sorted(report['results'], key=lambda row: (-row[f"recall@{max(ks)}"], -row['mrr'], row['search_p50_ms'] or 0))
+        config = report['config']
+        lines = [
+            "# Benchmark de recherche",
+            "",
+            f"{config['documents']} documents, {config['queries']} requêtes étiquetées, "
+            f"overlap {config['overlap_tokens']} tokens, construction_ef {config['construction_ef']}, "
+            f"{config['hybrid_candidates']} candidats en mode hybrid.",
+            "",
+            "| " + " | ".join(title for _, title in columns) + " |",
+            "|" + "---|" * len(columns),
+        ]
+        for row in ordered:
+            lines.append("| " + " | ".join("-" if row.get(key) is None else str(row[key]) for key, _ in columns) + " |")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
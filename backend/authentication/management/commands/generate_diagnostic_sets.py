@@ -0,0 +1,61 @@
+"""
+Pré-génération des jeux de questions du diagnostic initial.
+
+    python manage.py generate_diagnostic_sets --matiere "Mathématiques" --matiere "Français"
+    python manage.py generate_diagnostic_sets --class-level "3ème" --variants 5
+    python manage.py generate_diagnostic_sets --new-version
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from authentication import diagnostic_sets
+from authentication.models import DiagnosticQuestionSet, UserMatter
+from authentication.serializers import CLASS_LEVEL_CHOICES
+
+
+class Command(BaseCommand):
+    help = "Génère les variantes de questions de diagnostic par matière × classe"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--matiere', action='append', default=[],
+                            help="Matière (répétable). Défaut: toutes les matières connues")
+        parser.add_argument('--class-level', action='append', default=[], choices=CLASS_LEVEL_CHOICES,
+                            help="Classe (répétable). Défaut: toutes les classes autorisées")
+        parser.add_argument('--variants', type=int, default=None,
+                            help="Nombre de variantes par matière × classe")
+        parser.add_argument('--new-version', action='store_true',
+                            help="Générer une nouvelle version et désactiver les jeux actuels")
+
+    def handle(self, *args, **options):
+        matieres = options['matiere'] or sorted(
+            set(UserMatter.objects.values_list('matiere', flat=True))
+            | set(DiagnosticQuestionSet.objects.values_list('matiere', flat=True))
+        )
+        if not matieres:
+            raise CommandError("Aucune matière connue : précisez --matiere")
+        class_levels = options['class_level'] or CLASS_LEVEL_CHOICES
+        variants = options['variants'] or diagnostic_sets.variants_per_level()
+
+        total = 0
+        for matiere in matieres:
+            for class_level in class_levels:
+                label = f"{matiere} / {class_level}"
+                if options['new_version']:
+                    created = diagnostic_sets.publish_new_version(matiere, class_level, variants)
+                    self.stdout.write(f"{label}: nouvelle version, {created}/{variants} variantes")
+                    total += created
+                    continue
+                version = diagnostic_sets.current_version(matiere, class_level)
+                for variant in range(1, variants + 1):
+                    exists = DiagnosticQuestionSet.objects.filter(
+                        matiere=matiere, class_level=class_level, version=version, variant=variant
+                    ).exists()
+                    if exists:
+                        continue
+                    if diagnostic_sets.generate_question_set(matiere, class_level, variant, version=version):
+                        total += 1
+                        self.stdout.write(f"{label}: variante {variant} (v{version}) générée")
+                    else:
+                        self.stderr.write(f"{label}: échec de la variante {variant}")
+
+        self.stdout.write(self.style.SUCCESS(f"✅ {total} jeux de questions générés."))
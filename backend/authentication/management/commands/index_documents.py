@@ -0,0 +1,119 @@
+"""
+Indexation des PDF pédagogiques dans la collection Chroma du tuteur.
+
+    python manage.py index_documents
+    python manage.py index_documents --source ./documents_pedagogiques --workers 4
+    python manage.py index_documents --incremental
+    python manage.py index_documents --watch --interval 30
+    python manage.py index_documents --benchmark
+    python manage.py index_documents --rebuild-lexical
+"""
+
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.chunking import DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP_TOKENS
+from backend.indexing import (
+    CORPUS_COLLECTION,
+    DEFAULT_EMBED_BATCH_SIZE,
+    DEFAULT_UPSERT_BATCH_SIZE,
+    index_documents,
+    manifest_path,
+    watch_documents,
+)
+from backend.lexical_index import build_from_collection, lexical_index_path
+from backend.vector_store import get_vector_store
+
+
+class Command(BaseCommand):
+    help = "Indexe les PDF de documents_pedagogiques dans ChromaDB (extraction parallèle, embeddings et upserts par lots)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=settings.RAG_DOCUMENTS_PATH,
+                            help="Dossier contenant les PDF")
+        parser.add_argument('--collection', default=CORPUS_COLLECTION)
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Processus d'extraction (défaut: nombre de CPU)")
+        parser.add_argument('--max-tokens', type=int, default=DEFAULT_MAX_TOKENS,
+                            help="Taille maximale d'un morceau, en tokens du modèle d'embedding")
+        parser.add_argument('--overlap-tokens', type=int, default=DEFAULT_OVERLAP_TOKENS,
+                            help="Recouvrement entre morceaux consécutifs, en tokens")
+        parser.add_argument('--embed-batch-size', type=int, default=DEFAULT_EMBED_BATCH_SIZE)
+        parser.add_argument('--upsert-batch-size', type=int, default=DEFAULT_UPSERT_BATCH_SIZE)
+        parser.add_argument('--incremental', action='store_true',
+                            help="Ne traiter que les PDF nouveaux ou modifiés et retirer ceux supprimés")
+        parser.add_argument('--watch', action='store_true',
+                            help="Surveiller le dossier et réindexer (incrémental) à chaque changement")
+        parser.add_argument('--interval', type=float, default=10.0,
+                            help="Intervalle de scrutation en secondes pour --watch")
+        parser.add_argument('--benchmark', action='store_true',
+                            help="Indexer dans une collection temporaire, afficher le débit puis la supprimer")
+        parser.add_argument('--rebuild-lexical', action='store_true',
+                            help="Reconstruire uniquement l'index lexical BM25 depuis la collection existante")
+
+    def handle(self, *args, **options):
+        source = options['source']
+        if not os.path.isdir(source):
+            raise CommandError(f"Dossier introuvable: {source}")
+
+        collection_name = options['collection']
+        if options['rebuild_lexical']:
+            store = get_vector_store(settings.CHROMA_DB_PATH)
+            try:
+                collection = store.get_collection(collection_name)
+            except Exception:
+                raise CommandError(f"Collection introuvable: {collection_name}")
+            lexical = build_from_collection(collection)
+            lexical.save(lexical_index_path(store.path, collection_name))
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ Index lexical reconstruit: {len(lexical)} morceaux de '{collection_name}'."
+            ))
+            return
+
+        if options['benchmark']:
+            collection_name = f"{collection_name}_benchmark"
+
+        pipeline_options = dict(
+            chroma_path=settings.CHROMA_DB_PATH,
+            collection_name=collection_name,
+            workers=options['workers'],
+            max_tokens=options['max_tokens'],
+            overlap_tokens=options['overlap_tokens'],
+            embed_batch_size=options['embed_batch_size'],
+            upsert_batch_size=options['upsert_batch_size'],
+            progress=self.stdout.write,
+        )
+
+        if options['watch']:
+            self.stdout.write(f"Surveillance de {source} (Ctrl+C pour arrêter)...")
+            try:
+                watch_documents(source, interval=options['interval'], **pipeline_options)
+            except KeyboardInterrupt:
+                self.stdout.write("Surveillance arrêtée.")
+            return
+
+        stats = index_documents(
+            source,
+            incremental=options['incremental'] and not options['benchmark'],
+            # Le benchmark mesure le vrai coût des embeddings, sans le cache
+            use_embedding_cache=not options['benchmark'],
+            **pipeline_options
+        )
+
+        report = stats.report()
+        self.stdout.write("")
+        for key, value in report.items():
+            self.stdout.write(f"  {key:<24} {value}")
+
+        if options['benchmark']:
+            store = get_vector_store(settings.CHROMA_DB_PATH)
+            store.delete_collection(collection_name)
+            os.remove(manifest_path(store.path, collection_name))
+            os.remove(lexical_index_path(store.path, collection_name))
+            self.stdout.write(self.style.SUCCESS("Benchmark terminé (collection temporaire supprimée)."))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ {report['chunks']} morceaux indexés dans '{collection_name}' en {report['total_seconds']} s."
+            ))
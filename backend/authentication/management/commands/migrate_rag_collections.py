@@ -0,0 +1,108 @@
+"""
+Migration de la mémoire GRASSS vers les collections partagées.
+
+Copie les anciennes collections ``user_{id}_data`` et
+``user_{id}_matter_{clé}`` dans ``grasss_user_memory`` /
+``grasss_matter_memory`` en complétant les métadonnées de partition
+(user_id, matiere_key). Les ids sont conservés : relancer la commande
+est sans effet sur les documents déjà copiés.
+
+    python manage.py migrate_rag_collections --dry-run
+    python manage.py migrate_rag_collections
+    python manage.py migrate_rag_collections --delete-source
+"""
+
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_grasss_service import (
+    SHARED_MATTER_COLLECTION,
+    SHARED_USER_COLLECTION,
+    RAGGRASSService,
+    STORAGE_SHARED,
+)
+
+USER_COLLECTION = re.compile(r"^user_(\d+)_data$")
+MATTER_COLLECTION = re.compile(r"^user_(\d+)_matter_(.+)$")
+
+
+class Command(BaseCommand):
+    help = "Copie les collections Chroma par utilisateur dans les collections GRASSS partagées"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Documents lus et écrits par lot")
+        parser.add_argument('--delete-source', action='store_true',
+                            help="Supprimer chaque collection source une fois copiée")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Lister les collections à migrer sans rien écrire")
+
+    def handle(self, *args, **options):
+        service = RAGGRASSService(storage_mode=STORAGE_SHARED)
+        if service.store is None:
+            raise CommandError("ChromaDB indisponible : rien à migrer")
+        store = service.store
+
+        sources = []
+        for collection in store.list_collections():
+            name = getattr(collection, "name", collection)
+            match = USER_COLLECTION.match(name)
+            if match:
+                sources.append((name, SHARED_USER_COLLECTION, int(match.group(1)), None))
+                continue
+            match = MATTER_COLLECTION.match(name)
+            if match:
+                sources.append((name, SHARED_MATTER_COLLECTION, int(match.group(1)), match.group(2)))
+
+        if not sources:
+            self.stdout.write("Aucune collection par utilisateur trouvée.")
+            return
+
+        total = 0
+        for source_name, target_name, user_id, matter_key in sources:
+            source = store.get_collection(source_name)
+            count = source.count()
+            if options['dry_run']:
+                self.stdout.write(f"{source_name} -> {target_name}: {count} documents")
+                total += count
+                continue
+
+            target = service.get_or_create_collection(target_name)
+            copied = 0
+            for offset in range(0, count, options['batch_size']):
+                batch = source.get(
+                    limit=options['batch_size'],
+                    offset=offset,
+                    include=["documents", "metadatas", "embeddings"],
+                )
+                ids = batch.get("ids") or []
+                if not ids:
+                    break
+                metadatas = []
+                for metadata in batch.get("metadatas") or [{} for _ in ids]:
+                    metadata = dict(metadata or {})
+                    metadata["user_id"] = user_id
+                    if matter_key is not None:
+                        metadata["matiere_key"] = matter_key
+                        metadata.setdefault("matiere", matter_key.replace("_", " "))
+                    metadatas.append(metadata)
+                kwargs = {"ids": ids, "documents": batch.get("documents"), "metadatas": metadatas}
+                embeddings = batch.get("embeddings")
+                if embeddings is not None and len(embeddings):
+                    kwargs["embeddings"] = [list(vector) for vector in embeddings]
+                target.upsert(**kwargs)
+                copied += len(ids)
+            store.invalidate_count(target_name)
+            total += copied
+
+            if options['delete_source'] and copied == count:
+                store.delete_collection(source_name)
+                self.stdout.write(f"{source_name} -> {target_name}: {copied} documents (source supprimée)")
+            else:
+                self.stdout.write(f"{source_name} -> {target_name}: {copied} documents")
+
+        verb = "à migrer" if options['dry_run'] else "migrés"
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {total} documents {verb} depuis {len(sources)} collections."
+        ))
@@ -0,0 +1,75 @@
+"""
+Pré-génération de la banque d'exercices QCM.
+
+    python manage.py refill_exercise_bank                 # toutes les matières suivies
+    python manage.py refill_exercise_bank --matiere "Mathématiques" --chapitre "Algèbre" --niveau moyen
+    python manage.py refill_exercise_bank --target 30 --enqueue
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from backend.jobs import enqueue
+from authentication import exercise_bank
+from authentication.models import UserMatter
+
+
+class Command(BaseCommand):
+    help = "Remplit la banque d'exercices jusqu'à --target exercices par matière × chapitre × niveau"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--matiere', help="Limiter à une matière")
+        parser.add_argument('--chapitre', default=None, help="Limiter à un chapitre ('' = Général)")
+        parser.add_argument('--niveau', default=None,
+                            choices=[value for value, _ in UserMatter.DIFFICULTY_LEVELS])
+        parser.add_argument('--target', type=int, default=20,
+                            help="Nombre d'exercices visé dans chaque banque")
+        parser.add_argument('--enqueue', action='store_true',
+                            help="Planifier les recharges dans la file de tâches au lieu de générer ici")
+
+    def handle(self, *args, **options):
+        if options['matiere'] and options['niveau']:
+            pools = [(options['matiere'], options['chapitre'] or '', options['niveau'])]
+        else:
+            # Toutes les combinaisons réellement étudiées par les élèves
+            matters = UserMatter.objects.all()
+            if options['matiere']:
+                matters = matters.filter(matiere=options['matiere'])
+            if options['chapitre']:
+                matters = matters.filter(chapitre=options['chapitre'])
+            elif options['chapitre'] is not None:
+                matters = matters.filter(Q(chapitre='') | Q(chapitre__isnull=True))
+            if options['niveau']:
+                matters = matters.filter(niveau_difficulte=options['niveau'])
+            pools = sorted({
+                (matiere, chapitre or '', niveau)
+                for matiere, chapitre, niveau in matters.values_list('matiere', 'chapitre', 'niveau_difficulte')
+            })
+        if not pools:
+            raise CommandError("Aucune matière à traiter")
+
+        total = 0
+        for matiere, chapitre, niveau in pools:
+            label = f"{matiere} / {chapitre or 'Général'} / {niveau}"
+            missing = options['target'] - exercise_bank.available_count(matiere, chapitre, niveau)
+            if missing <= 0:
+                self.stdout.write(f"{label}: banque complète")
+                continue
+            if options['enqueue']:
+                enqueue("exercises.refill_bank", {
+                    "matiere": matiere,
+                    "chapitre": chapitre,
+                    "niveau_difficulte": niveau,
+                    "count": missing,
+                })
+                self.stdout.write(f"{label}: recharge de {missing} exercices planifiée")
+                continue
+            try:
+                added = exercise_bank.generate_exercises(matiere, chapitre, niveau, missing)
+            except RuntimeError as e:
+                self.stderr.write(f"{label}: {e}")
+                continue
+            total += added
+            self.stdout.write(f"{label}: +{added} exercices")
+
+        self.stdout.write(self.style.SUCCESS(f"✅ {total} exercices générés pour {len(pools)} banques."))
@@ -0,0 +1,103 @@
+"""
+Worker de la file de tâches de fond (backend/jobs.py).
+
+    python manage.py run_jobs
+    python manage.py run_jobs --processes 4
+    python manage.py run_jobs --once
+
+Le client Chroma (SQLite, threads natifs) n'est jamais ouvert par le
+processus parent avant le fork : chaque worker ouvre le sien en important
+les tâches.
+"""
+
+import importlib.util
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from backend import jobs
+
+
+CHROMA_REQUIRED = (
+    "Chroma indisponible (index en mémoire) : les écritures des tâches seraient perdues. "
+    "Installez chromadb ou utilisez BACKGROUND_JOBS_EAGER=True."
+)
+
+
+def _check_store():
+    """Ouvre le client Chroma du processus courant ; False avec l'index mémoire de secours"""
+    from rag_grasss_service import rag_service
+    return rag_service.persistent
+
+
+def _worker(poll_interval):
+    # Chaque processus ouvre ses propres connexions à la base
+    connections.close_all()
+    if not _check_store():
+        # Index mémoire propre au processus : les écritures du worker seraient perdues
+        print(CHROMA_REQUIRED)
+        return
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopping.set())
+    try:
+        jobs.work(poll_interval=poll_interval, stop=stopping.is_set)
+    except KeyboardInterrupt:
+        pass
+
+
+def _interrupt(*args):
+    raise KeyboardInterrupt
+
+
+class Command(BaseCommand):
+    help = "Exécute les tâches de fond en attente (résumés, embeddings, écritures Chroma)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1,
+                            help="Nombre de processus workers")
+        parser.add_argument('--interval', type=float, default=None,
+                            help="Attente en secondes quand la file est vide")
+        parser.add_argument('--once', action='store_true',
+                            help="Vider la file une fois puis s'arrêter")
+
+    def handle(self, *args, **options):
+        # Sans importer rag_grasss_service : le parent n'ouvre pas Chroma avant le fork
+        if importlib.util.find_spec("chromadb") is None:
+            raise CommandError(CHROMA_REQUIRED)
+        if options['once']:
+            if not _check_store():
+                raise CommandError(CHROMA_REQUIRED)
+            jobs.autodiscover()
+            done = jobs.run_pending()
+            self.stdout.write(self.style.SUCCESS(f"✅ {done} tâches exécutées."))
+            return
+
+        processes = max(1, options['processes'])
+        self.stdout.write(f"Démarrage de {processes} worker(s) (Ctrl+C pour arrêter)...")
+        if processes == 1:
+            _worker(options['interval'])
+            return
+
+        connections.close_all()
+        # fork : les workers héritent de la configuration Django déjà chargée
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=_worker, args=(options['interval'],), daemon=True)
+            for _ in range(processes)
+        ]
+        for process in workers:
+            process.start()
+        # SIGTERM (arrêt de la plateforme) arrête aussi les workers
+        signal.signal(signal.SIGTERM, _interrupt)
+        try:
+            for process in workers:
+                process.join()
+        except KeyboardInterrupt:
+            for process in workers:
+                process.terminate()
+            for process in workers:
+                process.join()
+        self.stdout.write("Workers arrêtés.")
@@ -0,0 +1,70 @@
+"""
+Consommation du LLM par action, élève et matière (cumuls quotidiens).
+
+    python manage.py usage_report
+    python manage.py usage_report --days 7 --top 20
+    python manage.py usage_report --prune   # supprime les appels détaillés trop anciens
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from authentication.models import LLMUsageRollup
+from backend.usage import get_config, prune_events
+
+
+class Command(BaseCommand):
+    help = "Affiche la consommation du LLM (appels, tokens, latence) par action, élève et matière"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=1,
+                            help="Nombre de jours, aujourd'hui compris")
+        parser.add_argument('--top', type=int, default=10,
+                            help="Nombre d'élèves et de matières affichés")
+        parser.add_argument('--prune', action='store_true',
+                            help="Supprimer les appels plus anciens que EVENT_RETENTION_DAYS (les cumuls sont gardés)")
+
+    def handle(self, *args, **options):
+        since = timezone.localdate() - timedelta(days=max(1, options['days']) - 1)
+        rollups = LLMUsageRollup.objects.filter(day__gte=since)
+        totals = dict(
+            calls=Sum('calls'), failures=Sum('failures'), prompt=Sum('prompt_tokens'),
+            reply=Sum('reply_tokens'), latency=Sum('latency_ms'), requests=Sum('upstream_requests'),
+        )
+
+        self.stdout.write(f"Consommation depuis le {since}:")
+        self.stdout.write("\nPar action:")
+        for row in rollups.values('action', 'model').annotate(**totals).order_by('-prompt'):
+            self._print_row(f"{row['action']} ({row['model']})", row)
+
+        self.stdout.write(f"\nÉlèves les plus consommateurs (top {options['top']}):")
+        by_user = rollups.exclude(user=None).values('user__username').annotate(**totals).order_by('-prompt')
+        for row in by_user[:options['top']]:
+            self._print_row(row['user__username'], row)
+
+        self.stdout.write(f"\nMatières les plus consommatrices (top {options['top']}):")
+        by_matter = (
+            rollups.exclude(user_matter=None)
+            .values('user_matter__matiere')
+            .annotate(students=Count('user', distinct=True), **totals)
+            .order_by('-prompt')
+        )
+        for row in by_matter[:options['top']]:
+            self._print_row(f"{row['user_matter__matiere']} ({row['students']} élèves)", row)
+
+        if options['prune']:
+            deleted = prune_events()
+            self.stdout.write(f"\n{deleted} appels détaillés de plus de {get_config()['EVENT_RETENTION_DAYS']} jours supprimés")
+        self.stdout.write(self.style.SUCCESS("✅ Rapport de consommation terminé."))
+
+    def _print_row(self, label, row):
+        calls = row['calls'] or 0
+        latency = (row['latency'] or 0) // calls if calls else 0
+        self.stdout.write(
+            f"  {label:<40} appels={calls:<6} requêtes={row['requests'] or 0:<6} échecs={row['failures'] or 0:<4} "
+            f"tokens={(row['prompt'] or 0) + (row['reply'] or 0):<9} "
+            f"(prompt {row['prompt'] or 0}, réponse {row['reply'] or 0}) latence moy.={latency}ms"
+        )
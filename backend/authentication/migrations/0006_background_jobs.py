@@ -0,0 +1,45 @@
+# Generated by Django 6.0.2 on 2026-10-17 10:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0005_add_diagnostic_questions_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationsummary',
+            name='status',
+            field=models.CharField(choices=[('pending', 'En cours de génération'), ('ready', 'Prêt'), ('failed', 'Échec')], default='ready', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='conversationsummary',
+            name='summary_text',
+            field=models.TextField(blank=True),
+        ),
+        migrations.CreateModel(
+            name='BackgroundJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('payload', models.JSONField(default=dict)),
+                ('idempotency_key', models.CharField(blank=True, max_length=255, null=True, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'En attente'), ('running', 'En cours'), ('done', 'Terminée'), ('failed', 'Échouée')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=5)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after'], name='authenticat_status_d1b1d5_idx')],
+            },
+        ),
+    ]
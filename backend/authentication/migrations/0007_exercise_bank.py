@@ -0,0 +1,43 @@
+# Generated by Django 6.0.2 on 2026-10-17 11:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0006_background_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Exercise',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('matiere', models.CharField(max_length=100)),
+                ('chapitre', models.CharField(blank=True, default='', max_length=200)),
+                ('niveau_difficulte', models.CharField(choices=[('facile', 'Facile'), ('moyen', 'Moyen'), ('difficile', 'Difficile'), ('expert', 'Expert')], max_length=20)),
+                ('data', models.JSONField()),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('times_served', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['matiere', 'chapitre', 'niveau_difficulte', 'times_served'], name='authenticat_matiere_ff0c0b_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ServedExercise',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('served_at', models.DateTimeField(auto_now_add=True)),
+                ('exercise', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='servings', to='authentication.exercise')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='served_exercises', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'exercise')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.2 on 2026-10-17 12:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0007_exercise_bank'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiagnosticQuestionSet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('matiere', models.CharField(max_length=100)),
+                ('class_level', models.CharField(max_length=20)),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('variant', models.PositiveIntegerField(default=1)),
+                ('data', models.JSONField()),
+                ('is_active', models.BooleanField(default=True)),
+                ('times_served', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('matiere', 'class_level', 'version', 'variant')},
+            },
+        ),
+        migrations.AddField(
+            model_name='studentprofile',
+            name='pending_diagnostic_set',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='authentication.diagnosticquestionset'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 6.0.2 on 2026-10-17 13:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0008_diagnostic_question_sets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollingSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('summary_text', models.TextField(blank=True)),
+                ('summarized_through', models.PositiveBigIntegerField(default=0)),
+                ('turns_summarized', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user_matter', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rolling_summary', to='authentication.usermatter')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ConversationTurn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('student', 'Élève'), ('tutor', 'Tuteur')], max_length=10)),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_turns', to=settings.AUTH_USER_MODEL)),
+                ('user_matter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_turns', to='authentication.usermatter')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user_matter', 'id'], name='authenticat_user_ma_06401c_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 6.0.2 on 2026-10-17 15:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0009_conversation_turns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMUsageEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(max_length=30)),
+                ('model', models.CharField(max_length=100)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('reply_tokens', models.PositiveIntegerField(default=0)),
+                ('latency_ms', models.PositiveIntegerField(default=0)),
+                ('upstream_requests', models.PositiveSmallIntegerField(default=1)),
+                ('succeeded', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_usage_events', to=settings.AUTH_USER_MODEL)),
+                ('user_matter', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='authentication.usermatter')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'created_at'], name='authenticat_user_id_811f5a_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LLMUsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('scope', models.CharField(default='', max_length=50)),
+                ('action', models.CharField(max_length=30)),
+                ('model', models.CharField(max_length=100)),
+                ('calls', models.PositiveIntegerField(default=0)),
+                ('failures', models.PositiveIntegerField(default=0)),
+                ('prompt_tokens', models.PositiveBigIntegerField(default=0)),
+                ('reply_tokens', models.PositiveBigIntegerField(default=0)),
+                ('latency_ms', models.PositiveBigIntegerField(default=0)),
+                ('upstream_requests', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='llm_usage_rollups', to=settings.AUTH_USER_MODEL)),
+                ('user_matter', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='authentication.usermatter')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'day'], name='authenticat_user_id_8d3483_idx')],
+                'constraints': [models.UniqueConstraint(fields=('day', 'scope', 'action', 'model'), name='llm_usage_rollup_unique_key')],
+            },
+        ),
+    ]
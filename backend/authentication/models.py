@@ -42,7 +42,12 @@ class StudentProfile(models.Model):
     # État du diagnostic initial
     diagnostic_completed = models.BooleanField(default=False)
     diagnostic_date = models.DateTimeField(null=True, blank=True)
-    diagnostic_questions_json = models.JSONField(null=True, blank=True)  # questions en attente de réponses
+    # Questions en attente de réponses : référence vers un jeu pré-généré...
+    pending_diagnostic_set = models.ForeignKey(
+        'DiagnosticQuestionSet', on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    # ...ou copie complète quand aucun jeu valide n'a pu être produit
+    diagnostic_questions_json = models.JSONField(null=True, blank=True)
 
     def __str__(self):
         return f"Profil Élève de {self.user.username}"
@@ -77,11 +82,21 @@ class UserMatter(models.Model):
 
 # Modèle pour les résumés de conversations
 class ConversationSummary(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'En cours de génération'),
+        (STATUS_READY, 'Prêt'),
+        (STATUS_FAILED, 'Échec'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_summaries')
     user_matter = models.ForeignKey(UserMatter, on_delete=models.CASCADE, null=True, blank=True)
     
     # Contenu du résumé
-    summary_text = models.TextField()  # Texte du résumé de la conversation
+    summary_text = models.TextField(blank=True)  # Texte du résumé de la conversation
     key_concepts = models.JSONField(default=list)  # Liste des concepts clés couverts
     
     # Métadonnées
@@ -91,10 +106,101 @@ class ConversationSummary(models.Model):
     # Stockage vectoriel (id du document Chroma)
     chroma_doc_id = models.CharField(max_length=255, null=True, blank=True)
 
+    # Le résumé est généré en tâche de fond (voir authentication/tasks.py)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_READY)
+
     def __str__(self):
         return f"Résumé - {self.user.username} ({self.created_at.strftime('%Y-%m-%d')})"
 
 
+# Journal des échanges de tutorat (authentication/conversation.py)
+class ConversationTurn(models.Model):
+    ROLE_STUDENT = 'student'
+    ROLE_TUTOR = 'tutor'
+
+    ROLE_CHOICES = [
+        (ROLE_STUDENT, 'Élève'),
+        (ROLE_TUTOR, 'Tuteur'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_turns')
+    user_matter = models.ForeignKey(UserMatter, on_delete=models.CASCADE, related_name='conversation_turns')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    content = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user_matter', 'id'])]
+
+    def __str__(self):
+        return f"{self.get_role_display()} - {self.user.username} ({self.created_at.strftime('%Y-%m-%d %H:%M')})"
+
+
+# Résumé glissant des échanges d'une matière, mis à jour tous les N tours
+class RollingSummary(models.Model):
+    user_matter = models.OneToOneField(UserMatter, on_delete=models.CASCADE, related_name='rolling_summary')
+    summary_text = models.TextField(blank=True)
+    # Id du dernier ConversationTurn intégré au résumé
+    summarized_through = models.PositiveBigIntegerField(default=0)
+    turns_summarized = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Résumé glissant - {self.user_matter}"
+
+
+# Jeux de questions de diagnostic pré-générés (authentication/diagnostic_sets.py)
+class DiagnosticQuestionSet(models.Model):
+    matiere = models.CharField(max_length=100)
+    class_level = models.CharField(max_length=20)  # 3ème, Terminale D
+    version = models.PositiveIntegerField(default=1)  # nouvelle version = nouveaux jeux
+    variant = models.PositiveIntegerField(default=1)  # variantes servies en rotation
+
+    data = models.JSONField()  # {"questions": [...], "evaluation_criteria": [...]}
+    is_active = models.BooleanField(default=True)
+    times_served = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('matiere', 'class_level', 'version', 'variant')
+
+    def __str__(self):
+        return f"Diagnostic {self.matiere} {self.class_level} v{self.version}.{self.variant}"
+
+
+# Banque d'exercices QCM pré-générés (authentication/exercise_bank.py)
+class Exercise(models.Model):
+    matiere = models.CharField(max_length=100)
+    chapitre = models.CharField(max_length=200, blank=True, default='')  # '' = Général
+    niveau_difficulte = models.CharField(max_length=20, choices=UserMatter.DIFFICULTY_LEVELS)
+
+    data = models.JSONField()  # question, options normalisées, hint, competencies...
+    content_hash = models.CharField(max_length=64, unique=True)  # évite les doublons
+    times_served = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['matiere', 'chapitre', 'niveau_difficulte', 'times_served']),
+        ]
+
+    def __str__(self):
+        return f"{self.matiere} / {self.chapitre or 'Général'} ({self.niveau_difficulte}) #{self.pk}"
+
+
+# Exercices déjà servis à un élève (pas de répétition)
+class ServedExercise(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='served_exercises')
+    exercise = models.ForeignKey(Exercise, on_delete=models.CASCADE, related_name='servings')
+    served_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'exercise')
+
+    def __str__(self):
+        return f"{self.user.username} - exercice #{self.exercise_id}"
+
+
 # Profil pour les Enseignants
 class TeacherProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='teacher_profile')
@@ -102,3 +208,98 @@ class TeacherProfile(models.Model):
 
     def __str__(self):
         return f"Profil Professeur de {self.user.username}"
+
+
+# File de tâches de fond (backend/jobs.py, exécutées par `manage.py run_jobs`)
+class BackgroundJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'En attente'),
+        (STATUS_RUNNING, 'En cours'),
+        (STATUS_DONE, 'Terminée'),
+        (STATUS_FAILED, 'Échouée'),
+    ]
+
+    name = models.CharField(max_length=100)  # nom de la tâche enregistrée
+    payload = models.JSONField(default=dict)
+    # Une même clé n'est mise en file qu'une fois (rejeu d'une requête, double clic...)
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+
+# Journal des appels au LLM (backend/usage.py) : un enregistrement par appel
+class LLMUsageEvent(models.Model):
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='llm_usage_events')
+    user_matter = models.ForeignKey(UserMatter, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    action = models.CharField(max_length=30)
+    model = models.CharField(max_length=100)  # fournisseur:modèle
+    prompt_tokens = models.PositiveIntegerField(default=0)  # rapporté par Gemini, sinon estimé
+    reply_tokens = models.PositiveIntegerField(default=0)
+    latency_ms = models.PositiveIntegerField(default=0)
+    # Requêtes facturées par le fournisseur : tentatives, relances et requêtes de couverture (hedging)
+    upstream_requests = models.PositiveSmallIntegerField(default=1)
+    succeeded = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'created_at'])]
+
+    def __str__(self):
+        return f"{self.action} - {self.user.username if self.user else 'système'} ({self.created_at.strftime('%Y-%m-%d %H:%M')})"
+
+
+# Cumul quotidien des appels par élève, matière, action et modèle (quotas, admin)
+class LLMUsageRollup(models.Model):
+    day = models.DateField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='llm_usage_rollups')
+    user_matter = models.ForeignKey(UserMatter, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    # "<user_id>:<user_matter_id>", "-" pour NULL : clé d'unicité non nulle
+    # (deux NULL ne sont jamais égaux dans un index unique)
+    scope = models.CharField(max_length=50, default='')
+    action = models.CharField(max_length=30)
+    model = models.CharField(max_length=100)
+    calls = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    reply_tokens = models.PositiveBigIntegerField(default=0)
+    latency_ms = models.PositiveBigIntegerField(default=0)  # total, moyenne = latency_ms / calls
+    upstream_requests = models.PositiveIntegerField(default=0)  # >= calls avec relances et hedging
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'scope', 'action', 'model'], name='llm_usage_rollup_unique_key'),
+        ]
+        indexes = [models.Index(fields=['user', 'day'])]
+
+    @staticmethod
+    def scope_for(user_id, user_matter_id):
+        return f"{user_id if user_id is not None else '-'}:{user_matter_id if user_matter_id is not None else '-'}"
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.reply_tokens
+
+    def __str__(self):
+        return f"{self.day} {self.action} - {self.user.username if self.user else 'système'} ({self.calls} appels)"
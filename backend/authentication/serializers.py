@@ -102,8 +102,8 @@ class ConversationSummarySerializer(serializers.ModelSerializer):
     
     class Meta:
         model = ConversationSummary  # À importer
-        fields = ['id', 'summary_text', 'key_concepts', 'matter_details', 'created_at']
-        read_only_fields = ['created_at']
+        fields = ['id', 'summary_text', 'key_concepts', 'matter_details', 'status', 'created_at']
+        read_only_fields = ['status', 'created_at']
 
 
 class DiagnosticResponseSerializer(serializers.Serializer):
@@ -0,0 +1,103 @@
+"""
+Tâches de fond GRASSS (exécutées par `manage.py run_jobs`, voir backend/jobs.py)
+
+Chaque tâche peut être rejouée sans effet de bord : les documents Chroma ont
+un id fixe et un résumé déjà généré n'est pas régénéré.
+"""
+
+from backend.jobs import enqueue, job
+from backend.rag_service import generate_response
+from backend.usage import usage_context
+from prompts_templates import get_summary_prompt
+from rag_grasss_service import rag_service
+
+from . import conversation, diagnostic_sets, exercise_bank
+from .models import ConversationSummary
+
+
+@job("grasss.store_user_diagnostic")
+def store_user_diagnostic(user_id, diagnostic_data, doc_id):
+    """Embedding + écriture Chroma d'un diagnostic"""
+    rag_service.store_user_diagnostic(user_id, diagnostic_data, doc_id=doc_id)
+
+
+def _mark_summary_failed(payload, error):
+    ConversationSummary.objects.filter(
+        pk=payload.get("summary_id"), status=ConversationSummary.STATUS_PENDING
+    ).update(status=ConversationSummary.STATUS_FAILED)
+
+
+@job("grasss.generate_conversation_summary", on_failure=_mark_summary_failed)
+def generate_conversation_summary(summary_id, conversation_history):
+    """Générer le résumé par l'IA, le sauvegarder puis planifier l'écriture vectorielle"""
+    from .views_grasss import _get_reply_text, _parse_json_from_reply
+
+    summary = ConversationSummary.objects.select_related('user', 'user_matter').filter(pk=summary_id).first()
+    if summary is None or summary.status == ConversationSummary.STATUS_READY:
+        return
+    user = summary.user
+    user_matter = summary.user_matter
+
+    prompt = get_summary_prompt(
+        user_name=user.first_name or user.username,
+        matiere=user_matter.matiere,
+        date=str(user_matter.updated_at.date()),
+        conversation_history=conversation_history
+    )
+    # Consommation attribuée à l'élève, sans lui opposer son quota
+    with usage_context(user, user_matter, enforce_quota=False):
+        raw = generate_response(prompt, action='summary')
+    reply_text = _get_reply_text(raw)
+    if not reply_text or raw.get('degraded'):
+        # Lever une erreur pour que la tâche soit retentée plus tard
+        raise RuntimeError("Génération du résumé indisponible")
+    summary_data = _parse_json_from_reply(reply_text)
+    if not isinstance(summary_data, dict):
+        summary_data = {"resume": reply_text, "resume_court": reply_text[:500]}
+
+    summary.summary_text = summary_data.get('resume_court', summary_data.get('resume', reply_text[:500]))
+    summary.key_concepts = summary_data.get('concepts_couverts', [])
+    summary.status = ConversationSummary.STATUS_READY
+    summary.save(update_fields=['summary_text', 'key_concepts', 'status'])
+
+    enqueue(
+        "grasss.store_conversation_summary",
+        {"summary_id": summary.id, "summary_data": summary_data},
+        idempotency_key=f"summary-vector:{summary.id}",
+    )
+
+
+@job("grasss.store_conversation_summary")
+def store_conversation_summary(summary_id, summary_data):
+    """Embedding + écriture Chroma d'un résumé de conversation"""
+    summary = ConversationSummary.objects.select_related('user_matter').filter(pk=summary_id).first()
+    if summary is None or summary.chroma_doc_id:
+        return
+    chroma_id = rag_service.store_conversation_summary(
+        summary.user_id,
+        summary.user_matter.matiere,
+        summary_data,
+        doc_id=f"summary_{summary.id}"
+    )
+    summary.chroma_doc_id = chroma_id
+    summary.save(update_fields=['chroma_doc_id'])
+
+
+@job("grasss.update_rolling_summary", max_attempts=3)
+def update_rolling_summary(user_matter_id):
+    """Intégrer les derniers tours de tutorat au résumé glissant d'une matière"""
+    conversation.update_rolling_summary(user_matter_id)
+
+
+@job("exercises.refill_bank", max_attempts=3)
+def refill_exercise_bank(matiere, chapitre, niveau_difficulte, count):
+    """Recharger la banque d'exercices d'un couple chapitre × niveau"""
+    added = exercise_bank.generate_exercises(matiere, chapitre, niveau_difficulte, count)
+    print(f"Banque d'exercices {matiere}/{chapitre or 'Général'}/{niveau_difficulte}: +{added}")
+
+
+@job("diagnostics.generate_set", max_attempts=3)
+def generate_diagnostic_set(matiere, class_level, variant, version):
+    """Générer une variante de jeu de questions de diagnostic"""
+    if diagnostic_sets.generate_question_set(matiere, class_level, variant, version=version) is None:
+        raise RuntimeError(f"Jeu de diagnostic {matiere} {class_level} v{version}.{variant} non généré")
@@ -30,6 +30,7 @@ from .views_grasss import (
     get_user_learning_progress,
     get_conversation_history
 )
+from .views_stream import tutor_chat_stream
 from rest_framework.routers import DefaultRouter
 
 router = DefaultRouter()
@@ -41,6 +42,7 @@ urlpatterns += [
     
     # Tutoring endpoints
     path('tutor/chat/', TutorChatView.as_view(), name='tutor_chat'),
+    path('tutor/chat/stream/', tutor_chat_stream, name='tutor_chat_stream'),
     path('learning/progress/', get_user_learning_progress, name='learning_progress'),
     path('learning/history/', get_conversation_history, name='conversation_history'),
 ]
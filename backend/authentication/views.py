@@ -1,12 +1,16 @@
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.exceptions import Throttled
 from .serializers import UserSerializer, RegisterSerializer
 from .models import User
 from .serializers import ChangePasswordSerializer
 from django.conf import settings
 from backend.rag_service import get_ai_response
+from backend.tracing import annotate
+from backend.throttling import ChatRateThrottle
+from backend.usage import usage_context
 
 # Vue pour l'inscription
 class RegisterView(generics.CreateAPIView):
@@ -36,13 +40,18 @@ class ChangePasswordView(APIView):
 # Chat avec le tuteur IA (temporaire en attendant ChromaDB)
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
+@throttle_classes([ChatRateThrottle])
 def chat_with_tutor(request):
     user_message = request.data.get('message')
     if not user_message:
         return Response({'error': 'Message vide'}, status=400)
     # Appel au service RAG
     try:
-        result = get_ai_response(user_message)
+        annotate(action='chat')
+        with usage_context(request.user):
+            result = get_ai_response(user_message, action='chat')
         return Response(result)
+    except Throttled:
+        raise
     except Exception as e:
         return Response({'error': 'Erreur interne lors de la génération de la réponse'}, status=500)
\ No newline at end of file
@@ -3,14 +3,17 @@ Views API pour le système GRASSS
 Endpoints pour le tutorat IA avec RAG
 """
 
+import hashlib
 import json
 from django.utils import timezone
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import Throttled
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from .models import User, UserMatter, ConversationSummary, StudentProfile
+from . import conversation, diagnostic_sets, exercise_bank
 from .serializers import (
     UserMatterSerializer,
     ConversationSummarySerializer,
@@ -18,18 +21,22 @@ from .serializers import (
     TutorResponseSerializer
 )
 from rag_grasss_service import rag_service
+from backend.context_packing import context_budget
+from backend.jobs import enqueue
+from backend.tracing import annotate, span
+from backend.throttling import LLMRateThrottle
+from backend.usage import usage_context
 from prompts_templates import (
     get_diagnostic_prompt,
     get_exercise_prompt,
     get_tutor_prompt,
-    get_summary_prompt,
     EVALUATION_ANALYSIS_PROMPT,
 )
-from backend.rag_service import get_ai_response  # Service IA existant (retourne {"reply": str, "sources": list})
+from backend.rag_service import generate_response  # Service IA (retourne {"reply": str, "sources": list})
 
 
 def _get_reply_text(ai_result):
-    """Extrait le texte de réponse du retour get_ai_response (dict ou str)."""
+    """Extrait le texte de réponse du retour generate_response (dict ou str)."""
     if isinstance(ai_result, dict):
         return ai_result.get('reply', '') or ''
     return str(ai_result)
@@ -55,6 +62,11 @@ def _parse_json_from_reply(reply_text):
         return None
 
 
+def _student_private_terms(user):
+    """Termes propres à l'élève : une réponse qui les contient n'est jamais mise en cache."""
+    return [t for t in (user.first_name, user.last_name, user.username) if t]
+
+
 def _normalize_exercise_options(exercise_data):
     """Garantit que exercise a une liste options utilisable par le frontend."""
     options = exercise_data.get('options') if isinstance(exercise_data, dict) else None
@@ -79,6 +91,51 @@ def _normalize_exercise_options(exercise_data):
     ]
 
 
+# Message de l'élève, ajouté après les extraits du cours (voir generate_response)
+STUDENT_MESSAGE = "\n\nÉlève: {message}"
+
+
+def build_tutor_prompt(user, student_profile, user_matter, message):
+    """Construire le prompt de tutorat (mémoire de l'élève), sans son message.
+
+    Le message est passé séparément en suffixe (STUDENT_MESSAGE) et sert
+    seul de requête pour les extraits du cours. Partagé par TutorChatView et
+    la variante streaming (views_stream).
+    """
+    # Récupérer le contexte du RAG
+    rag_context = rag_service.get_matter_context(
+        user_id=user.id,
+        matiere=user_matter.matiere,
+        query=message,
+        max_tokens=context_budget('tutor')['memory']
+    )
+
+    return get_tutor_prompt(
+        user_name=user.first_name or user.username,
+        matiere=user_matter.matiere,
+        chapitre=user_matter.chapitre or 'Général',
+        niveau_global=student_profile.niveau_global,
+        style_apprentissage=student_profile.style_apprentissage,
+        progression=user_matter.progression,
+        rag_context=rag_context
+    )
+
+
+def build_tutor_suffix(user_matter, message):
+    """Fin du prompt de tutorat : résumé glissant + derniers échanges + message de l'élève.
+
+    Taille bornée quelle que soit la longueur de la session (voir conversation.py).
+    """
+    with span("conversation.recent"):
+        history = conversation.recent_context(user_matter)
+    return (f"\n\n{history}" if history else "") + STUDENT_MESSAGE.format(message=message)
+
+
+def course_query(matiere, chapitre='', *extra):
+    """Requête courte pour les extraits du cours (jamais le prompt complet)"""
+    return " ".join(part for part in (matiere, chapitre, *extra) if part)
+
+
 class UserMatterViewSet(viewsets.ModelViewSet):
     """ViewSet pour gérer les matières scolaires de l'utilisateur"""
     serializer_class = UserMatterSerializer
@@ -96,6 +153,8 @@ class UserMatterViewSet(viewsets.ModelViewSet):
 class TutorChatView(APIView):
     """Endpoint principal du tuteur IA avec système RAG"""
     permission_classes = [permissions.IsAuthenticated]
+    # Seau de jetons par élève et par action (LLM_THROTTLE)
+    throttle_classes = [LLMRateThrottle]
 
     def post(self, request):
         """
@@ -130,6 +189,7 @@ class TutorChatView(APIView):
         chapitre = serializer.validated_data.get('chapitre', '')
         action = serializer.validated_data.get('action', 'tutor')
         message = serializer.validated_data.get('message', '')
+        annotate(action=action)
 
         # Créer ou récupérer la matière
         user_matter, created = UserMatter.objects.get_or_create(
@@ -141,21 +201,25 @@ class TutorChatView(APIView):
 
         try:
             validated = serializer.validated_data
-            if action == 'diagnostic' and not student_profile.diagnostic_completed:
-                return self._handle_diagnostic(request, user, student_profile, matiere, user_matter, validated)
-            
-            elif action == 'exercise':
-                return self._handle_exercise(user, student_profile, user_matter, message)
-            
-            elif action == 'remediation':
-                return self._handle_remediation(user, student_profile, user_matter, message)
-            
-            elif action == 'summary':
-                return self._handle_summary(user, user_matter, message)
-            
-            else:  # action == 'tutor' (par défaut)
-                return self._handle_tutor(user, student_profile, user_matter, message)
+            with span("handler", action=action), usage_context(user, user_matter):
+                if action == 'diagnostic' and not student_profile.diagnostic_completed:
+                    return self._handle_diagnostic(request, user, student_profile, matiere, user_matter, validated)
+
+                elif action == 'exercise':
+                    return self._handle_exercise(user, student_profile, user_matter, message)
 
+                elif action == 'remediation':
+                    return self._handle_remediation(user, student_profile, user_matter, message)
+
+                elif action == 'summary':
+                    return self._handle_summary(user, user_matter, message)
+
+                else:  # action == 'tutor' (par défaut)
+                    return self._handle_tutor(user, student_profile, user_matter, message)
+
+        except Throttled:
+            # Quota, débit ou surcharge : 429 + Retry-After (gestionnaire d'exceptions DRF)
+            raise
         except Exception as e:
             return Response(
                 {"error": f"Erreur du serveur: {str(e)}"},
@@ -178,7 +242,10 @@ class TutorChatView(APIView):
 
         # Étape 2: réponses envoyées → analyser et terminer
         if student_answers is not None and isinstance(student_answers, dict):
-            stored = student_profile.diagnostic_questions_json
+            if student_profile.pending_diagnostic_set is not None:
+                stored = student_profile.pending_diagnostic_set.data
+            else:
+                stored = student_profile.diagnostic_questions_json
             questions = stored.get('questions', []) if isinstance(stored, dict) else []
             if not questions:
                 return Response(
@@ -190,7 +257,7 @@ class TutorChatView(APIView):
                 student_answers=json.dumps(student_answers, ensure_ascii=False),
                 questions=json.dumps(questions, ensure_ascii=False)
             )
-            raw = get_ai_response(prompt)
+            raw = generate_response(prompt, action='diagnostic_analysis')
             reply_text = _get_reply_text(raw)
             analysis = _parse_json_from_reply(reply_text)
             if isinstance(analysis, dict):
@@ -200,12 +267,23 @@ class TutorChatView(APIView):
                     student_profile.style_apprentissage = analysis['style_apprentissage_probable']
             student_profile.diagnostic_completed = True
             student_profile.diagnostic_date = timezone.now()
+            student_profile.pending_diagnostic_set = None
             student_profile.diagnostic_questions_json = None
             student_profile.save(update_fields=[
                 'niveau_global', 'style_apprentissage', 'diagnostic_completed',
-                'diagnostic_date', 'diagnostic_questions_json'
+                'diagnostic_date', 'pending_diagnostic_set', 'diagnostic_questions_json'
             ])
-            rag_service.store_user_diagnostic(user.id, analysis or {"raw": reply_text})
+            # Embedding + écriture Chroma en tâche de fond : le profil est déjà sauvegardé
+            stamp = int(student_profile.diagnostic_date.timestamp())
+            enqueue(
+                "grasss.store_user_diagnostic",
+                {
+                    "user_id": user.id,
+                    "diagnostic_data": analysis if isinstance(analysis, dict) else {"raw": reply_text},
+                    "doc_id": f"diagnostic_{user.id}_{stamp}",
+                },
+                idempotency_key=f"diagnostic-analysis:{user.id}:{stamp}",
+            )
             return Response({
                 "status": "diagnostic_completed",
                 "message": "Diagnostic terminé. Votre profil a été mis à jour.",
@@ -219,18 +297,40 @@ class TutorChatView(APIView):
                 {"error": "Choisissez votre classe (3ème ou Terminale D) avant de lancer l'évaluation."},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        prompt = get_diagnostic_prompt(matiere=matiere, niveau_scolaire=niveau_scolaire)
-        raw = get_ai_response(prompt)
-        reply_text = _get_reply_text(raw)
-        diagnostic_data = _parse_json_from_reply(reply_text)
-        if not isinstance(diagnostic_data, dict):
-            diagnostic_data = {"raw_response": reply_text, "questions": []}
-        questions = diagnostic_data.get('questions', [])
-        if not questions and isinstance(diagnostic_data.get('raw_response'), str):
-            questions = [{"id": 1, "text": diagnostic_data["raw_response"], "type": "open"}]
-        student_profile.diagnostic_questions_json = diagnostic_data
-        student_profile.save(update_fields=['diagnostic_questions_json'])
-        rag_service.store_user_diagnostic(user.id, diagnostic_data)
+        # Jeu pré-généré (rotation entre variantes) : pas d'appel IA
+        question_set = diagnostic_sets.get_question_set(matiere, niveau_scolaire)
+        if question_set is not None:
+            diagnostic_data = question_set.data
+            questions = diagnostic_data.get('questions', [])
+            student_profile.pending_diagnostic_set = question_set
+            student_profile.diagnostic_questions_json = None
+            reference = f"set{question_set.id}"
+        else:
+            # Aucun jeu valide disponible : génération directe, copie gardée sur le profil
+            prompt = get_diagnostic_prompt(matiere=matiere, niveau_scolaire=niveau_scolaire)
+            raw = generate_response(prompt, action='diagnostic')
+            reply_text = _get_reply_text(raw)
+            diagnostic_data = _parse_json_from_reply(reply_text)
+            if not isinstance(diagnostic_data, dict):
+                diagnostic_data = {"raw_response": reply_text, "questions": []}
+            questions = diagnostic_data.get('questions', [])
+            if not questions and isinstance(diagnostic_data.get('raw_response'), str):
+                questions = [{"id": 1, "text": diagnostic_data["raw_response"], "type": "open"}]
+            student_profile.pending_diagnostic_set = None
+            student_profile.diagnostic_questions_json = diagnostic_data
+            reference = hashlib.sha256(
+                json.dumps(diagnostic_data, sort_keys=True, ensure_ascii=False).encode('utf-8')
+            ).hexdigest()[:16]
+        student_profile.save(update_fields=['pending_diagnostic_set', 'diagnostic_questions_json'])
+        enqueue(
+            "grasss.store_user_diagnostic",
+            {
+                "user_id": user.id,
+                "diagnostic_data": diagnostic_data,
+                "doc_id": f"diagnostic_{user.id}_{reference}",
+            },
+            idempotency_key=f"diagnostic-questions:{user.id}:{reference}",
+        )
         return Response({
             "status": "diagnostic_questions_posed",
             "questions": questions,
@@ -238,13 +338,26 @@ class TutorChatView(APIView):
         }, status=status.HTTP_200_OK)
 
     def _handle_exercise(self, user, student_profile, user_matter, message):
-        """Générer et retourner un exercice QCM"""
+        """Servir un exercice QCM de la banque, ou le générer si elle est vide"""
+        
+        if exercise_bank.get_config()['ENABLED']:
+            with span("exercise_bank.serve") as s:
+                exercise, unseen = exercise_bank.serve_exercise(
+                    user, user_matter.matiere, user_matter.chapitre, user_matter.niveau_difficulte
+                )
+                s.set(hit=exercise is not None)
+            exercise_bank.schedule_refill(
+                user, user_matter.matiere, user_matter.chapitre, user_matter.niveau_difficulte, unseen=unseen
+            )
+            if exercise is not None:
+                return self._exercise_response(user_matter, exercise.data, source="bank", exercise_id=exercise.id)
         
         # Récupérer le contexte du RAG
         rag_context = rag_service.get_matter_context(
             user_id=user.id,
             matiere=user_matter.matiere,
-            query="exercice précédent lacunes"
+            query="exercice précédent lacunes",
+            max_tokens=context_budget('exercise')['memory']
         )
         
         prompt = get_exercise_prompt(
@@ -256,50 +369,52 @@ class TutorChatView(APIView):
             rag_context=rag_context
         )
         
-        # Appeler l'IA (retourne {"reply": str, "sources": list})
-        raw = get_ai_response(prompt)
+        # Appeler l'IA (retourne {"reply": str, "sources": list}) avec les
+        # extraits du cours du chapitre
+        raw = generate_response(
+            prompt,
+            action='exercise',
+            retrieval_query=course_query(user_matter.matiere, user_matter.chapitre)
+        )
         reply_text = _get_reply_text(raw)
         exercise_data = _parse_json_from_reply(reply_text)
         if not isinstance(exercise_data, dict):
             exercise_data = {"question": reply_text or "Exercice généré"}
         exercise_data["options"] = _normalize_exercise_options(exercise_data)
         
+        return self._exercise_response(user_matter, exercise_data, source="generated")
+
+    def _exercise_response(self, user_matter, exercise_data, source, exercise_id=None):
         return Response({
             "status": "exercise_generated",
             "exercise": exercise_data,
             "metadata": {
                 "matiere": user_matter.matiere,
                 "chapitre": user_matter.chapitre,
-                "difficulty": user_matter.niveau_difficulte
+                "difficulty": user_matter.niveau_difficulte,
+                "source": source,
+                "exercise_id": exercise_id
             }
         }, status=status.HTTP_200_OK)
 
     def _handle_tutor(self, user, student_profile, user_matter, message):
         """Gérer une conversation de tutorat normal"""
         
-        # Récupérer le contexte du RAG
-        rag_context = rag_service.get_matter_context(
-            user_id=user.id,
-            matiere=user_matter.matiere,
-            query=message
-        )
+        final_prompt = build_tutor_prompt(user, student_profile, user_matter, message)
         
-        prompt = get_tutor_prompt(
-            user_name=user.first_name or user.username,
-            matiere=user_matter.matiere,
-            chapitre=user_matter.chapitre or 'Général',
-            niveau_global=student_profile.niveau_global,
-            style_apprentissage=student_profile.style_apprentissage,
-            progression=user_matter.progression,
-            rag_context=rag_context
+        # Appeler l'IA (retourne {"reply": str, "sources": list}) : les
+        # extraits du cours sont récupérés sur le seul message de l'élève
+        raw = generate_response(
+            final_prompt,
+            action='tutor',
+            retrieval_query=message,
+            suffix=build_tutor_suffix(user_matter, message),
+            private_terms=_student_private_terms(user)
         )
-        
-        # Ajouter le message de l'utilisateur au prompt
-        final_prompt = prompt + f"\n\nÉlève: {message}"
-        
-        # Appeler l'IA (retourne {"reply": str, "sources": list})
-        raw = get_ai_response(final_prompt)
         content = _get_reply_text(raw)
+        # Journal côté serveur (une réponse de secours n'est pas conservée)
+        with span("conversation.record"):
+            conversation.record_exchange(user, user_matter, message, None if raw.get('degraded') else content)
         return Response({
             "status": "tutor_response",
             "content": content,
@@ -315,7 +430,8 @@ class TutorChatView(APIView):
         rag_context = rag_service.get_matter_context(
             user_id=user.id,
             matiere=user_matter.matiere,
-            query="récentes erreurs lacunes"
+            query="récentes erreurs lacunes",
+            max_tokens=context_budget('remediation')['memory']
         )
         
         from prompts_templates import REMEDIATION_PROMPT
@@ -328,7 +444,12 @@ class TutorChatView(APIView):
             rag_context=rag_context
         )
         
-        raw = get_ai_response(prompt)
+        raw = generate_response(
+            prompt,
+            action='remediation',
+            retrieval_query=course_query(user_matter.matiere, user_matter.chapitre, message),
+            private_terms=_student_private_terms(user)
+        )
         reply_text = _get_reply_text(raw)
         remediation_data = _parse_json_from_reply(reply_text)
         if not isinstance(remediation_data, dict):
@@ -343,46 +464,39 @@ class TutorChatView(APIView):
         }, status=status.HTTP_200_OK)
 
     def _handle_summary(self, user, user_matter, conversation_history):
-        """Générer et sauvegarder un résumé de conversation"""
-        
-        prompt = get_summary_prompt(
-            user_name=user.first_name or user.username,
-            matiere=user_matter.matiere,
-            date=str(user_matter.updated_at.date()),
-            conversation_history=conversation_history
-        )
-        
-        raw = get_ai_response(prompt)
-        reply_text = _get_reply_text(raw)
-        summary_data = _parse_json_from_reply(reply_text)
-        if not isinstance(summary_data, dict):
-            summary_data = {"resume": reply_text, "resume_court": (reply_text or '')[:500]}
-        
-        # Sauvegarder le résumé dans la BD
+        """Enregistrer un résumé en attente et déléguer sa génération à la file de tâches
+
+        Sans `message`, l'historique vient du journal côté serveur (résumé
+        glissant + échanges non résumés). Le client suit l'état via
+        l'historique (status: pending -> ready/failed).
+        """
+        conversation_history = conversation_history or conversation.history_text(user_matter)
+        if not conversation_history:
+            return Response(
+                {"error": "Aucun échange enregistré à résumer pour cette matière."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         conversation_summary = ConversationSummary.objects.create(
             user=user,
             user_matter=user_matter,
-            summary_text=summary_data.get('resume_court', summary_data.get('resume', reply_text[:500])),
-            key_concepts=summary_data.get('concepts_couverts', [])
+            summary_text='',
+            status=ConversationSummary.STATUS_PENDING
         )
-        
-        # Sauvegarder dans le RAG
-        chroma_id = rag_service.store_conversation_summary(
-            user.id,
-            user_matter.matiere,
-            summary_data
+        enqueue(
+            "grasss.generate_conversation_summary",
+            {"summary_id": conversation_summary.id, "conversation_history": conversation_history},
+            idempotency_key=f"summary:{conversation_summary.id}",
         )
-        conversation_summary.chroma_doc_id = chroma_id
-        conversation_summary.save()
         
         return Response({
-            "status": "summary_saved",
-            "summary": summary_data,
+            "status": "summary_pending",
+            "summary": None,
             "metadata": {
                 "id": conversation_summary.id,
+                "status": conversation_summary.status,
                 "saved_at": conversation_summary.created_at
             }
-        }, status=status.HTTP_201_CREATED)
+        }, status=status.HTTP_202_ACCEPTED)
 
 
 @api_view(['GET'])
@@ -0,0 +1,162 @@
+"""
+Variante ASGI du tuteur IA (action "tutor")
+La réponse de Gemini est diffusée au fil de l'eau en Server-Sent Events :
+le worker n'est pas bloqué pendant la génération et le premier token
+arrive dès qu'il est produit.
+"""
+
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .models import UserMatter, StudentProfile
+from .serializers import TutorRequestSerializer
+from . import conversation
+from .views_grasss import build_tutor_prompt, build_tutor_suffix
+from backend.rag_service import build_generation_prompt, degraded_reply, stream_generated_text
+from backend.throttling import Overloaded, RateLimited, get_admission_controller, take_token
+from backend.tracing import annotate
+from backend.usage import QuotaExceeded, UsageContext, check_quota
+
+
+class _SlotStreamingResponse(StreamingHttpResponse):
+    """Rend la place d'admission quand la réponse est fermée (même si le client part avant le début)"""
+
+    def __init__(self, *args, slot=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._slot = slot
+
+    def close(self):
+        if self._slot is not None:
+            self._slot.release()
+        super().close()
+
+
+def _too_many(detail, wait):
+    return JsonResponse({"error": str(detail)}, status=429, headers={"Retry-After": str(wait)})
+
+
+def _sse(event, data):
+    """Formater un évènement Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _authenticate(request):
+    """Authentifier la requête avec le même JWT que l'API REST"""
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def _prepare_tutor_turn(user, validated):
+    """Partie synchrone (ORM + Chroma) : construire le prompt final du tour"""
+    try:
+        student_profile = user.student_profile
+    except StudentProfile.DoesNotExist:
+        return None, None, None
+    user_matter, created = UserMatter.objects.get_or_create(
+        user=user,
+        matiere=validated.get('matiere'),
+        chapitre=validated.get('chapitre', ''),
+        defaults={'niveau_difficulte': validated.get('niveau_difficulte', 'moyen')}
+    )
+    message = validated.get('message', '')
+    final_prompt = build_tutor_prompt(user, student_profile, user_matter, message)
+    built = build_generation_prompt(
+        final_prompt,
+        retrieval_query=message,
+        suffix=build_tutor_suffix(user_matter, message),
+        action="tutor",
+    )
+    return student_profile, user_matter, built
+
+
+@csrf_exempt
+@require_POST
+async def tutor_chat_stream(request):
+    """
+    Endpoint POST (ASGI) : même payload que TutorChatView avec action "tutor".
+
+    Évènements émis:
+        event: token -> {"content": "..."}  (morceau de réponse)
+        event: done  -> {"status": "tutor_response", "content": "...", "metadata": {...}}
+        event: error -> {"error": "..."}
+    """
+    user = await sync_to_async(_authenticate)(request)
+    if user is None or not user.is_active:
+        return JsonResponse({"error": "Authentification requise."}, status=401)
+
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({"error": "JSON invalide."}, status=400)
+
+    serializer = TutorRequestSerializer(data=payload)
+    if not serializer.is_valid():
+        return JsonResponse({"error": serializer.errors}, status=400)
+    validated = serializer.validated_data
+    annotate(action="tutor", streamed=True, user_id=user.pk)
+    if validated.get('action', 'tutor') != 'tutor':
+        return JsonResponse(
+            {"error": "Le streaming ne concerne que l'action 'tutor'. Utilisez /api/auth/tutor/chat/."},
+            status=400
+        )
+
+    # Même seau de jetons que TutorChatView (utilisateur, "tutor")
+    wait = await sync_to_async(take_token)(user.pk, "tutor")
+    if wait is not None:
+        limited = RateLimited(wait=wait)
+        return _too_many(limited.detail, limited.wait)
+
+    student_profile, user_matter, built = await sync_to_async(_prepare_tutor_turn)(user, validated)
+    if student_profile is None:
+        return JsonResponse(
+            {"error": "Profil élève requis. Seuls les comptes élèves peuvent utiliser le tuteur."},
+            status=403
+        )
+
+    usage = UsageContext(user, user_matter)
+    try:
+        await sync_to_async(check_quota)("tutor", usage)
+    except QuotaExceeded as e:
+        return _too_many(e.detail, e.wait)
+
+    # Place chez Gemini, gardée jusqu'à la fin du flux ; 429 si la file est pleine
+    try:
+        slot = await sync_to_async(get_admission_controller().acquire, thread_sensitive=False)()
+    except Overloaded as e:
+        return _too_many(e.detail, e.wait)
+
+    metadata = {
+        "matiere": user_matter.matiere,
+        "progression": user_matter.progression
+    }
+
+    async def event_stream():
+        parts = []
+        try:
+            async for text in stream_generated_text(built["prompt"], action="tutor", usage=usage):
+                parts.append(text)
+                yield _sse("token", {"content": text})
+        except Exception as e:
+            yield _sse("error", {"error": f"Erreur du serveur: {str(e)}"})
+            return
+        finally:
+            slot.release()
+        reply = "".join(parts)
+        await sync_to_async(conversation.record_exchange)(user, user_matter, validated.get('message', ''), reply)
+        content = reply or degraded_reply(built, action="tutor")
+        yield _sse("done", {"status": "tutor_response", "content": content, "metadata": metadata})
+
+    response = _SlotStreamingResponse(event_stream(), content_type="text/event-stream", slot=slot)
+    response["Cache-Control"] = "no-cache"
+    # Désactiver le buffering des proxys (nginx / Railway)
+    response["X-Accel-Buffering"] = "no"
+    return response
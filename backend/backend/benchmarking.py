@@ -0,0 +1,326 @@
+"""
+Shared pieces of the benchmark commands (``manage.py benchmark_api`` and
+``manage.py benchmark_retrieval``).
+
+- latency samplers for the stub LLM provider ("fixed:0.2",
+  "uniform:0.1,0.6", "normal:0.4,0.1", "lognormal:0.4,0.5");
+- percentile summaries of latency samples;
+- a per-thread SQL query counter (connection.execute_wrapper);
+- a small fixture corpus written to a throwaway Chroma directory, so
+  retrieval runs against real collections without the production index;
+- labelled retrieval queries (loaded, generated from the corpus or the
+  fixture set) and their recall@k / reciprocal-rank scoring.
+"""
+
+import json
+import math
+import random
+import threading
+
+from backend.chunking import split_sentences
+from backend.lexical_index import LexicalIndex, lexical_index_path
+
+# Curriculum-style passages (3ème / Terminale D) used as the fixture corpus
+FIXTURE_CORPUS = {
+    "fixture_maths_thales": (
+        "Théorème de Thalès. Si deux droites sécantes sont coupées par deux droites parallèles, "
+        "alors les longueurs des segments découpés sont proportionnelles. On l'utilise pour "
+        "calculer une longueur inconnue dans une configuration de triangles emboîtés."
+    ),
+    "fixture_maths_thales_reciproque": (
+        "Réciproque du théorème de Thalès. Si les rapports des longueurs sont égaux et que les "
+        "points sont alignés dans le même ordre, alors les droites sont parallèles. Elle sert à "
+        "démontrer un parallélisme."
+    ),
+    "fixture_maths_pythagore": (
+        "Théorème de Pythagore. Dans un triangle rectangle, le carré de l'hypoténuse est égal à la "
+        "somme des carrés des deux autres côtés. La réciproque permet de prouver qu'un triangle est "
+        "rectangle."
+    ),
+    "fixture_maths_equations": (
+        "Équations du premier degré. Pour résoudre ax + b = 0, on isole l'inconnue : on soustrait b "
+        "aux deux membres puis on divise par a, à condition que a soit non nul."
+    ),
+    "fixture_maths_fonctions_affines": (
+        "Fonctions affines. Une fonction affine s'écrit f(x) = ax + b ; sa représentation graphique "
+        "est une droite de coefficient directeur a et d'ordonnée à l'origine b."
+    ),
+    "fixture_maths_derivees": (
+        "Dérivation. La dérivée d'une fonction en un point est le coefficient directeur de la "
+        "tangente à la courbe en ce point. Le signe de la dérivée donne les variations de la fonction."
+    ),
+    "fixture_maths_probabilites": (
+        "Probabilités conditionnelles. La probabilité de A sachant B vaut P(A ∩ B) / P(B). Un arbre "
+        "pondéré permet de calculer des probabilités totales."
+    ),
+    "fixture_francais_passe_simple": (
+        "Conjugaison du passé simple. Les verbes du premier groupe prennent les terminaisons -ai, "
+        "-as, -a, -âmes, -âtes, -èrent. Le passé simple exprime une action achevée dans le récit."
+    ),
+    "fixture_francais_imparfait": (
+        "L'imparfait de l'indicatif exprime une action en cours dans le passé ou une habitude. "
+        "Terminaisons : -ais, -ais, -ait, -ions, -iez, -aient."
+    ),
+    "fixture_francais_argumentation": (
+        "Le texte argumentatif défend une thèse à l'aide d'arguments et d'exemples. Les connecteurs "
+        "logiques (donc, cependant, en effet) structurent le raisonnement."
+    ),
+    "fixture_svt_photosynthese": (
+        "La photosynthèse permet aux végétaux chlorophylliens de produire de la matière organique à "
+        "partir de dioxyde de carbone, d'eau et d'énergie lumineuse, en rejetant du dioxygène."
+    ),
+    "fixture_svt_genetique": (
+        "Génétique. Un gène est une portion d'ADN qui code une protéine. Les allèles sont des "
+        "versions différentes d'un même gène ; la méiose assure le brassage génétique."
+    ),
+    "fixture_physique_ohm": (
+        "Loi d'Ohm. La tension aux bornes d'un conducteur ohmique est proportionnelle à l'intensité "
+        "du courant qui le traverse : U = R × I, avec R la résistance en ohms."
+    ),
+    "fixture_physique_vitesse": (
+        "Mouvement et vitesse. La vitesse moyenne est le quotient de la distance parcourue par la "
+        "durée du parcours : v = d / t, exprimée en mètres par seconde."
+    ),
+    "fixture_chimie_atomes": (
+        "Un atome est constitué d'un noyau, formé de protons et de neutrons, autour duquel se "
+        "déplacent des électrons. Il est électriquement neutre."
+    ),
+}
+
+# Paraphrased student questions over FIXTURE_CORPUS, labelled with their source
+FIXTURE_QUERIES = [
+    ("Comment calculer une longueur avec des droites parallèles dans deux triangles ?", "fixture_maths_thales"),
+    ("Comment prouver que deux droites sont parallèles avec des rapports de longueurs ?", "fixture_maths_thales_reciproque"),
+    ("Comment savoir si un triangle est rectangle ?", "fixture_maths_pythagore"),
+    ("Comment trouver x dans 3x + 6 = 0 ?", "fixture_maths_equations"),
+    ("Que représentent a et b dans f(x) = ax + b ?", "fixture_maths_fonctions_affines"),
+    ("À quoi sert le signe de la dérivée ?", "fixture_maths_derivees"),
+    ("Comment calculer une probabilité sachant qu'un événement est réalisé ?", "fixture_maths_probabilites"),
+    ("Quelles sont les terminaisons des verbes en -er au passé simple ?", "fixture_francais_passe_simple"),
+    ("Quand utiliser l'imparfait dans un récit ?", "fixture_francais_imparfait"),
+    ("Comment construire un argument pour défendre une thèse ?", "fixture_francais_argumentation"),
+    ("Comment les plantes fabriquent-elles leur matière organique ?", "fixture_svt_photosynthese"),
+    ("Quelle est la différence entre un gène et un allèle ?", "fixture_svt_genetique"),
+    ("Quelle relation relie la tension, l'intensité et la résistance ?", "fixture_physique_ohm"),
+    ("Comment calculer une vitesse moyenne ?", "fixture_physique_vitesse"),
+    ("De quoi est composé un atome ?", "fixture_chimie_atomes"),
+]
+
+
+# ============================================================================
+# LATENCY DISTRIBUTIONS
+# ============================================================================
+
+def latency_sampler(spec: str, seed: int = None):
+    """Return a thread-safe callable drawing latencies in seconds from spec.
+
+    spec is "<kind>:<params>" with kind in fixed, uniform, normal, lognormal
+    (lognormal takes the median and sigma); a bare number means fixed.
+    """
+    kind, _, params = spec.partition(":")
+    if not params:
+        kind, params = "fixed", kind
+    try:
+        values = [float(value) for value in params.split(",")]
+    except ValueError:
+        raise ValueError(f"Invalid latency spec: {spec!r}")
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    if kind == "fixed" and len(values) == 1:
+        draw = lambda: values[0]
+    elif kind == "uniform" and len(values) == 2:
+        draw = lambda: rng.uniform(values[0], values[1])
+    elif kind == "normal" and len(values) == 2:
+        draw = lambda: rng.gauss(values[0], values[1])
+    elif kind == "lognormal" and len(values) == 2 and values[0] > 0:
+        mu = math.log(values[0])
+        draw = lambda: rng.lognormvariate(mu, values[1])
+    else:
+        raise ValueError(f"Invalid latency spec: {spec!r}")
+
+    def sample():
+        with lock:
+            return max(0.0, draw())
+    return sample
+
+
+# ============================================================================
+# MEASUREMENTS
+# ============================================================================
+
+def percentile(sorted_samples, q: float):
+    """Nearest-rank q-quantile of already sorted samples (None if empty)."""
+    if not sorted_samples:
+        return None
+    rank = max(1, math.ceil(q * len(sorted_samples)))
+    return sorted_samples[min(rank, len(sorted_samples)) - 1]
+
+
+def summarize_latencies(samples) -> dict:
+    """p50/p95/p99/mean/max in milliseconds."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "mean_ms": None, "max_ms": None}
+
+    def ms(value):
+        return round(value * 1000, 1)
+    return {
+        "p50_ms": ms(percentile(ordered, 0.50)),
+        "p95_ms": ms(percentile(ordered, 0.95)),
+        "p99_ms": ms(percentile(ordered, 0.99)),
+        "mean_ms": ms(sum(ordered) / len(ordered)),
+        "max_ms": ms(ordered[-1]),
+    }
+
+
+class QueryCounter:
+    """Count SQL queries run on this thread's connection while installed.
+
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            ...
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+# ============================================================================
+# FIXTURE CORPUS
+# ============================================================================
+
+def build_fixture_corpus(chroma_path: str, collection_name: str, corpus: dict = None, embed=None):
+    """Write corpus ({id: text}) to a Chroma collection plus its BM25 index.
+
+    ``embed`` maps a list of texts to vectors (default: the local
+    sentence-transformers model, see backend.embeddings).
+    """
+    from backend.embeddings import embed_texts
+    from backend.vector_store import get_vector_store, mark_index_updated
+
+    corpus = corpus or FIXTURE_CORPUS
+    ids = list(corpus)
+    documents = [corpus[doc_id] for doc_id in ids]
+    metadatas = [{"source": f"{doc_id}.pdf", "partie": 0} for doc_id in ids]
+    store = get_vector_store(chroma_path)
+    collection = store.get_collection(collection_name, create=True, metadata={"hnsw:space": "cosine"})
+    collection.upsert(
+        ids=ids,
+        documents=documents,
+        metadatas=metadatas,
+        embeddings=(embed or embed_texts)(documents),
+    )
+    lexical = LexicalIndex()
+    lexical.add(ids, documents)
+    lexical.save(lexical_index_path(store.path, collection_name))
+    mark_index_updated(store.path)
+    return collection
+
+
+# ============================================================================
+# LABELLED RETRIEVAL QUERIES
+# ============================================================================
+# A labelled query is {"query": str, "relevant": [{"source": str, "pages": [first, last]}]}.
+# Labels name a source file (and optionally a page range) rather than chunk
+# ids, so one query set scores every chunking of the corpus.
+
+def fixture_queries() -> list:
+    return [
+        {"query": query, "relevant": [{"source": f"{doc_id}.pdf"}]}
+        for query, doc_id in FIXTURE_QUERIES
+    ]
+
+
+def _normalize_label(label):
+    if isinstance(label, str):
+        return {"source": label}
+    pages = label.get("pages")
+    normalized = {"source": label["source"]}
+    if pages:
+        normalized["pages"] = [int(pages[0]), int(pages[-1])]
+    return normalized
+
+
+def load_labelled_queries(path: str) -> list:
+    """Read a JSON list of labelled queries; a label may be a bare source name."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    queries = []
+    for entry in data:
+        relevant = [_normalize_label(label) for label in entry.get("relevant") or []]
+        if entry.get("query") and relevant:
+            queries.append({"query": entry["query"], "relevant": relevant})
+    if not queries:
+        raise ValueError(f"No labelled query in {path}")
+    return queries
+
+
+def save_labelled_queries(path: str, queries) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(list(queries), f, ensure_ascii=False, indent=2)
+
+
+def generate_labelled_queries(chunks, count: int, seed: int = None, min_words: int = 6, max_words: int = 25) -> list:
+    """Known-item queries drawn from chunks ((text, metadata) pairs).
+
+    The query is the chunk's heading the first time it is seen, otherwise one
+    of its sentences; the label is the chunk's source and page range. Such
+    queries share words with their passage and flatter lexical retrieval:
+    a hand-labelled set of real student questions is the better reference.
+    """
+    rng = random.Random(seed)
+    pool = list(chunks)
+    rng.shuffle(pool)
+    queries = []
+    seen = set()
+    for text, metadata in pool:
+        if len(queries) >= count:
+            break
+        heading = (metadata.get("heading") or "").strip()
+        candidates = [heading] if heading and heading not in seen else []
+        candidates += [
+            sentence for sentence in split_sentences(" ".join(text.split()))
+            if min_words <= len(sentence.split()) <= max_words
+        ]
+        candidates = [candidate for candidate in candidates if candidate not in seen]
+        if not candidates:
+            continue
+        query = candidates[0] if candidates[0] == heading else rng.choice(candidates)
+        seen.add(query)
+        label = {"source": metadata["source"]}
+        if metadata.get("page_start"):
+            label["pages"] = [metadata["page_start"], metadata.get("page_end") or metadata["page_start"]]
+        queries.append({"query": query, "relevant": [label]})
+    return queries
+
+
+def is_relevant(metadata: dict, label: dict) -> bool:
+    """A chunk matches a label with the same source and an overlapping page range."""
+    if metadata.get("source") != label["source"]:
+        return False
+    pages = label.get("pages")
+    if not pages or not metadata.get("page_start"):
+        return True
+    start = metadata["page_start"]
+    end = metadata.get("page_end") or start
+    return start <= pages[1] and pages[0] <= end
+
+
+def score_ranking(metadatas, relevant, ks) -> dict:
+    """recall@k for each k (share of labels hit in the top k) and reciprocal rank."""
+    first_hit = {}
+    for rank, metadata in enumerate(metadatas, start=1):
+        for i, label in enumerate(relevant):
+            if i not in first_hit and is_relevant(metadata, label):
+                first_hit[i] = rank
+    scores = {
+        f"recall@{k}": sum(1 for rank in first_hit.values() if rank <= k) / len(relevant)
+        for k in ks
+    }
+    scores["rr"] = 1.0 / min(first_hit.values()) if first_hit else 0.0
+    return scores
@@ -0,0 +1,177 @@
+"""
+Structure-aware chunking of extracted PDF text.
+
+Text is cut into headings, paragraphs and sentences, then sentences are
+packed into chunks under a token budget measured with the embedding model's
+own tokenizer (MiniLM truncates anything beyond its max sequence length, so a
+character budget silently loses the end of long chunks). Consecutive chunks
+share a configurable overlap of trailing sentences, a heading change starts a
+new chunk, and each chunk records the pages it spans.
+"""
+
+import re
+
+DEFAULT_MAX_TOKENS = 200
+DEFAULT_OVERLAP_TOKENS = 40
+# Chunks smaller than this are merged forward instead of being emitted alone
+DEFAULT_MIN_TOKENS = 30
+
+_HYPHENATED_BREAK = re.compile(r"(\w)-\n(\w)")
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+(?=[«\"(\[]?[A-ZÀ-ÖØ-Ý0-9])")
+_HEADING = re.compile(
+    r"^(?:"
+    r"(?i:chapitre|partie|leçon|lecon|section|unité|unite|module|annexe)\b.*"
+    r"|(?:[IVXLC]+|\d+(?:\.\d+)*)[.)]\s+[A-ZÀ-ÖØ-Ý].*"
+    r"|[A-ZÀ-ÖØ-Ý0-9][A-ZÀ-ÖØ-Ý0-9 '’,:()-]{3,}"
+    r")$"
+)
+_WORDS = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def approximate_token_count(text: str) -> int:
+    """Tokenizer-free estimate: words and punctuation marks."""
+    return len(_WORDS.findall(text))
+
+
+def model_token_counter(model_name: str = None):
+    """Return a token counter backed by the embedding model's tokenizer.
+
+    Falls back to approximate_token_count when the model cannot be loaded.
+    token_counter_label() tells the two apart.
+    """
+    try:
+        from backend.embeddings import DEFAULT_EMBEDDING_MODEL, get_embedding_model
+        tokenizer = get_embedding_model(model_name).tokenizer
+    except Exception:
+        return approximate_token_count
+
+    def count(text: str) -> int:
+        return len(tokenizer(text, add_special_tokens=False)["input_ids"])
+    count.label = f"tokenizer:{model_name or DEFAULT_EMBEDDING_MODEL}"
+    return count
+
+
+def token_counter_label(count_tokens) -> str:
+    """'tokenizer:<model>' for model_token_counter(), 'approximate' for the fallback."""
+    return getattr(count_tokens, 'label', 'approximate')
+
+
+def _is_heading(line: str) -> bool:
+    if len(line) > 90 or line.endswith((".", ",", ";")):
+        return False
+    return bool(_HEADING.match(line))
+
+
+def iter_blocks(pages):
+    """Yield (kind, text, page) with kind in {"heading", "paragraph"}."""
+    for page_number, raw in pages:
+        text = _HYPHENATED_BREAK.sub(r"\1\2", raw.replace("\r", ""))
+        paragraph = []
+        for line in text.split("\n"):
+            line = " ".join(line.split())
+            if not line:
+                if paragraph:
+                    yield "paragraph", " ".join(paragraph), page_number
+                    paragraph = []
+                continue
+            if _is_heading(line):
+                if paragraph:
+                    yield "paragraph", " ".join(paragraph), page_number
+                    paragraph = []
+                yield "heading", line, page_number
+                continue
+            paragraph.append(line)
+            # PDF extraction rarely keeps blank lines: a line ending a sentence
+            # is treated as the end of a paragraph.
+            if line.endswith((".", "!", "?", ":")):
+                yield "paragraph", " ".join(paragraph), page_number
+                paragraph = []
+        if paragraph:
+            yield "paragraph", " ".join(paragraph), page_number
+
+
+def split_sentences(paragraph: str):
+    return [s for s in _SENTENCE_END.split(paragraph) if s.strip()]
+
+
+class Chunk:
+    __slots__ = ("text", "page_start", "page_end", "heading", "tokens")
+
+    def __init__(self, text, page_start, page_end, heading, tokens):
+        self.text = text
+        self.page_start = page_start
+        self.page_end = page_end
+        self.heading = heading
+        self.tokens = tokens
+
+
+class Chunker:
+    """Packs sentences into token-budgeted, overlapping chunks."""
+
+    def __init__(self, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS,
+                 min_tokens=DEFAULT_MIN_TOKENS, count_tokens=None):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = min_tokens
+        self.count_tokens = count_tokens or approximate_token_count
+
+    def _pieces(self, sentence):
+        """Split a sentence longer than the budget into word windows."""
+        tokens = self.count_tokens(sentence)
+        if tokens <= self.max_tokens:
+            return [(sentence, tokens)]
+        words = sentence.split()
+        size = max(1, int(len(words) * self.max_tokens / tokens))
+        pieces = []
+        for i in range(0, len(words), size):
+            piece = " ".join(words[i:i + size])
+            pieces.append((piece, self.count_tokens(piece)))
+        return pieces
+
+    def chunk_pages(self, pages):
+        """pages: iterable of (page_number, text). Return a list of Chunk."""
+        chunks = []
+        current = []  # [(sentence, tokens, page)]
+        current_tokens = 0
+        carried = 0  # leading items of `current` repeated from the previous chunk
+        heading = ""
+        heading_tokens = 0
+
+        def emit(keep_overlap=True):
+            nonlocal current, current_tokens, carried
+            if len(current) > carried:
+                body = " ".join(s for s, _, _ in current)
+                text = f"{heading}\n{body}" if heading else body
+                chunks.append(Chunk(text, current[0][2], current[-1][2], heading, current_tokens + heading_tokens))
+            overlap, overlap_tokens = [], 0
+            if keep_overlap:
+                for item in reversed(current[1:]):
+                    if overlap_tokens + item[1] > self.overlap_tokens:
+                        break
+                    overlap.insert(0, item)
+                    overlap_tokens += item[1]
+            current, current_tokens, carried = overlap, overlap_tokens, len(overlap)
+
+        for kind, text, page in iter_blocks(pages):
+            if kind == "heading":
+                # New section: close the previous one unless it is too small to stand alone
+                if current_tokens >= self.min_tokens:
+                    emit(keep_overlap=False)
+                heading = text
+                heading_tokens = self.count_tokens(heading)
+                continue
+            budget = max(self.max_tokens - heading_tokens, self.overlap_tokens + 1)
+            for sentence in split_sentences(text):
+                for piece, tokens in self._pieces(sentence):
+                    if current and current_tokens + tokens > budget:
+                        if len(current) > carried:
+                            emit()
+                        if current_tokens + tokens > budget:
+                            # The overlap alone leaves no room: drop it
+                            current, current_tokens, carried = [], 0, 0
+                    current.append((piece, tokens, page))
+                    current_tokens += tokens
+        emit(keep_overlap=False)
+        return chunks
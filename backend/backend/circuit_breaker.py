@@ -0,0 +1,145 @@
+"""
+Circuit breakers for remote and local AI backends.
+
+Without a breaker, a Gemini outage makes every request wait for its own
+failed attempts (and retries) before falling back. A breaker counts
+consecutive failures per backend; past ``failure_threshold`` it opens and
+callers skip the backend immediately for ``cooldown`` seconds. After the
+cooldown one trial call is let through (half-open): success closes the
+breaker, failure re-opens it for another cooldown.
+
+Breakers are per process and named after the path they guard:
+``gemini.generate``, ``gemini.embed`` and ``local.embed``.
+"""
+
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+DEFAULT_CONFIG = {
+    'FAILURE_THRESHOLD': 3,
+    'COOLDOWN_SECONDS': 30,
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised by CircuitBreaker.call while the breaker is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 3, cooldown: float = 30.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._stats = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and self._clock() - self._opened_at >= self.cooldown:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """True if a call may go through now (one trial call when half-open)."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and self._clock() - self._opened_at >= self.cooldown:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._stats['successes'] += 1
+            self._failures = 0
+            self._state = CLOSED
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._stats['failures'] += 1
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self._stats['opened'] += 1
+                    print(f"Circuit {self.name} opened for {self.cooldown:.0f}s")
+                self._state = OPEN
+                self._opened_at = self._clock()
+
+    def release_trial(self) -> None:
+        """Forget an allowed call that ended without a verdict (e.g. cancelled)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn through the breaker; raise CircuitOpenError when open."""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit open")
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def metrics(self) -> dict:
+        state = self.state
+        with self._lock:
+            return dict(self._stats, state=state, consecutive_failures=self._failures)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def _config():
+    config = dict(DEFAULT_CONFIG)
+    try:
+        from django.conf import settings
+        config.update(getattr(settings, 'CIRCUIT_BREAKER', {}) or {})
+    except Exception:
+        pass
+    return config
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Process-wide breaker for ``name``, created on first use."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                config = _config()
+                breaker = _breakers[name] = CircuitBreaker(
+                    name,
+                    failure_threshold=int(config['FAILURE_THRESHOLD']),
+                    cooldown=float(config['COOLDOWN_SECONDS']),
+                )
+    return breaker
+
+
+def all_breakers() -> dict:
+    with _breakers_lock:
+        return dict(_breakers)
@@ -0,0 +1,175 @@
+"""
+Context assembly by token budget.
+
+Retrieved text used to be concatenated and cut at a character count, often
+mid-chunk, while the GRASSS handlers added the whole student memory on top.
+This stage takes scored passages (corpus chunks or student memory),
+drops near-duplicates and the overlap shared by consecutive chunks, ranks
+them by score and packs them into the token budget of the action. A passage
+that does not fit is cut at a sentence boundary, never mid-sentence.
+
+Budgets are counted with chunking.approximate_token_count (words and
+punctuation marks), a close, tokenizer-free upper estimate for Gemini.
+"""
+
+import re
+
+from backend.chunking import approximate_token_count, split_sentences
+
+# Tokens per action for student memory and for corpus passages
+DEFAULT_BUDGETS = {
+    'default': {'memory': 200, 'corpus': 400},
+    'chat': {'memory': 0, 'corpus': 400},
+    'tutor': {'memory': 250, 'corpus': 450},
+    'exercise': {'memory': 200, 'corpus': 300},
+    'remediation': {'memory': 300, 'corpus': 300},
+    'diagnostic': {'memory': 0, 'corpus': 300},
+    'diagnostic_set': {'memory': 0, 'corpus': 300},
+    'exercise_bank': {'memory': 0, 'corpus': 300},
+}
+
+# Below this many tokens left, a passage is not worth cutting to fit
+MIN_PASSAGE_TOKENS = 30
+# Shared word 5-grams above which the lower-ranked passage is a duplicate
+DUPLICATE_CONTAINMENT = 0.8
+# Shortest run of words treated as the overlap between consecutive chunks
+MIN_OVERLAP_WORDS = 8
+MAX_OVERLAP_WORDS = 120
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class Passage:
+    __slots__ = ("text", "score", "source", "kind")
+
+    def __init__(self, text, score=0.0, source=None, kind="corpus"):
+        self.text = text
+        self.score = score
+        self.source = source
+        self.kind = kind
+
+    def replace(self, text):
+        return Passage(text, self.score, self.source, self.kind)
+
+    def __repr__(self):
+        return f"Passage({self.kind}, score={self.score:.3f}, {self.text[:40]!r})"
+
+
+def context_budget(action: str = None) -> dict:
+    """{'memory': tokens, 'corpus': tokens} for action (RAG_CONTEXT_BUDGETS overrides)."""
+    budgets = {key: dict(value) for key, value in DEFAULT_BUDGETS.items()}
+    try:
+        from django.conf import settings
+        for key, value in (getattr(settings, 'RAG_CONTEXT_BUDGETS', {}) or {}).items():
+            budgets.setdefault(key, {}).update(value)
+    except Exception:
+        pass
+    return dict(budgets['default'], **budgets.get(action or 'chat', {}))
+
+
+def _shingles(words, size=5):
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _overlap(head, tail):
+    """Length of the longest run ending ``head`` and starting ``tail`` (0 if short)."""
+    for k in range(min(len(head), len(tail), MAX_OVERLAP_WORDS), MIN_OVERLAP_WORDS - 1, -1):
+        if head[-k:] == tail[:k]:
+            return k
+    return 0
+
+
+def _drop_leading_words(text, count):
+    """Remove the first ``count`` words of text, keeping the rest verbatim."""
+    matches = list(_WORD_RE.finditer(text))
+    if count >= len(matches):
+        return ""
+    return text[matches[count].start():]
+
+
+def _drop_trailing_words(text, count):
+    matches = list(_WORD_RE.finditer(text))
+    if count >= len(matches):
+        return ""
+    return text[:matches[len(matches) - count - 1].end()]
+
+
+def rank(passages) -> list:
+    """Highest score first; ties keep their retrieval order."""
+    return sorted((p for p in passages if p.text and p.text.strip()), key=lambda p: -p.score)
+
+
+def dedupe(passages) -> list:
+    """Drop near-duplicates and trim the overlap between consecutive chunks.
+
+    ``passages`` must be ranked: of two duplicates the first one is kept, and
+    a later passage loses the words it shares with the edge of a kept one.
+    """
+    kept = []
+    kept_words = []
+    for passage in passages:
+        words = _WORD_RE.findall(passage.text.lower())
+        shingles = _shingles(words)
+        duplicate = False
+        trimmed = False
+        text = passage.text
+        for other, other_shingles in kept_words:
+            common = len(shingles & other_shingles)
+            if common and common / min(len(shingles), len(other_shingles)) >= DUPLICATE_CONTAINMENT:
+                duplicate = True
+                break
+            # Chunker overlap: the end of one chunk repeats at the start of the next
+            leading = _overlap(other, words)
+            if leading:
+                text = _drop_leading_words(text, leading)
+                words = words[leading:]
+                trimmed = True
+            trailing = _overlap(words, other)
+            if trailing:
+                text = _drop_trailing_words(text, trailing)
+                words = words[:-trailing]
+                trimmed = True
+        # A passage reduced to a few words by trimming adds nothing
+        if duplicate or not words or (trimmed and len(words) < MIN_OVERLAP_WORDS):
+            continue
+        kept.append(passage.replace(text.strip()))
+        kept_words.append((words, _shingles(words)))
+    return kept
+
+
+def _truncate(text, max_tokens, count_tokens):
+    """Longest prefix of whole sentences within max_tokens ('' if none fits)."""
+    parts = []
+    used = 0
+    for sentence in split_sentences(" ".join(text.split())):
+        tokens = count_tokens(sentence)
+        if used + tokens > max_tokens:
+            break
+        parts.append(sentence)
+        used += tokens
+    return " ".join(parts)
+
+
+def pack(passages, max_tokens: int, count_tokens=approximate_token_count) -> list:
+    """Rank, dedupe and keep the passages that fit in max_tokens."""
+    packed = []
+    remaining = max_tokens
+    for passage in dedupe(rank(passages)):
+        if remaining < MIN_PASSAGE_TOKENS:
+            break
+        tokens = count_tokens(passage.text)
+        if tokens <= remaining:
+            packed.append(passage)
+            remaining -= tokens
+            continue
+        text = _truncate(passage.text, remaining, count_tokens)
+        if text:
+            packed.append(passage.replace(text))
+            remaining -= count_tokens(text)
+    return packed
+
+
+def join_passages(passages, separator="\n\n") -> str:
+    return separator.join(passage.text for passage in passages)
@@ -0,0 +1,243 @@
+"""
+Content-addressed cache of embedding vectors.
+
+Vectors are keyed by SHA-256 of (model name, text), so a text already seen by
+any worker costs a lookup instead of a forward pass or a remote call.
+
+Two tiers:
+- an in-memory LRU per process;
+- an append-only on-disk store per model, shared by every process:
+  ``vectors.f32`` holds contiguous float32 rows (read through mmap) and
+  ``index.tsv`` maps ``<sha>\\t<row>``. Appends are serialized with flock;
+  the bytes of an append cut short by a killed writer are truncated by the
+  next one.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-writer best effort
+    fcntl = None
+
+DEFAULT_CACHE_DIR = os.getenv(
+    "EMBEDDING_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".embedding_cache"),
+)
+DEFAULT_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "20000"))
+
+
+def content_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class _DiskStore:
+    """Append-only float32 matrix + key index for one model."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.index_path = os.path.join(directory, "index.tsv")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.lock_path = os.path.join(directory, ".lock")
+        self.dim = None
+        self._rows = {}
+        self._index_offset = 0
+        self._mmap = None
+        self._mmap_size = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+
+    # -- reading -------------------------------------------------------
+
+    def _refresh_index(self) -> None:
+        """Read index lines appended (possibly by other processes) since last time."""
+        try:
+            size = os.path.getsize(self.index_path)
+        except OSError:
+            return
+        if size <= self._index_offset:
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read(size - self._index_offset)
+        # Only consume complete lines
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            key, _, row = line.decode("ascii").partition("\t")
+            if row:
+                self._rows[key] = int(row)
+        self._index_offset += end
+        if self.dim is None and os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+
+    def _drop_mmap(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._mmap_size = 0
+
+    def _row_bytes(self, row: int):
+        row_size = self.dim * 4
+        needed = (row + 1) * row_size
+        if self._mmap is None or self._mmap_size < needed:
+            self._drop_mmap()
+            size = os.path.getsize(self.vectors_path)
+            if size < needed:
+                return None
+            with open(self.vectors_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mmap_size = size
+        return self._mmap[row * row_size:needed]
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                self._refresh_index()
+                row = self._rows.get(key)
+            if row is None or self.dim is None:
+                return None
+            raw = self._row_bytes(row)
+            if raw is None:
+                return None
+            vec = array("f")
+            vec.frombytes(raw)
+            return vec.tolist()
+
+    # -- writing -------------------------------------------------------
+
+    def put_many(self, items) -> None:
+        """items: iterable of (key, vector). Vectors of another dimension are skipped."""
+        items = list(items)
+        if not items:
+            return
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh_index()
+                items = [(k, v) for k, v in items if k not in self._rows]
+                if not items:
+                    return
+                if self.dim is None:
+                    self.dim = len(items[0][1])
+                    with open(self.meta_path, "w") as f:
+                        json.dump({"dim": self.dim}, f)
+                rejected = sum(1 for _, vector in items if len(vector) != self.dim)
+                if rejected:
+                    print(f"Cache d'embeddings: {rejected} vecteurs ignorés (dimension attendue {self.dim})")
+                row_size = self.dim * 4
+                # A writer killed mid-append leaves a torn row or index line:
+                # cut both back to what the index covers before appending
+                rows = max(self._rows.values(), default=-1) + 1
+                with open(self.vectors_path, "ab") as vf:
+                    if vf.tell() != rows * row_size:
+                        vf.truncate(rows * row_size)
+                        self._drop_mmap()
+                    next_row = rows
+                    lines = []
+                    for key, vector in items:
+                        if key in self._rows or len(vector) != self.dim:
+                            continue
+                        vf.write(array("f", vector).tobytes())
+                        lines.append(f"{key}\t{next_row}\n")
+                        self._rows[key] = next_row
+                        next_row += 1
+                with open(self.index_path, "a") as xf:
+                    if xf.tell() != self._index_offset:
+                        xf.truncate(self._index_offset)
+                    xf.write("".join(lines))
+                self._index_offset = os.path.getsize(self.index_path)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class EmbeddingCache:
+    """In-memory LRU in front of per-model on-disk stores."""
+
+    def __init__(self, cache_dir: str = None, memory_entries: int = None, persist: bool = True):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.memory_entries = memory_entries or DEFAULT_MEMORY_ENTRIES
+        self.persist = persist
+        self._memory = OrderedDict()
+        self._stores = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, model_name: str):
+        if not self.persist:
+            return None
+        store = self._stores.get(model_name)
+        if store is None:
+            safe = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+            try:
+                store = _DiskStore(os.path.join(self.cache_dir, safe))
+            except OSError as e:
+                print(f"Cache d'embeddings disque indisponible: {e}")
+                self.persist = False
+                return None
+            self._stores[model_name] = store
+        return store
+
+    def _remember(self, key, vector) -> None:
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, model_name: str, text: str):
+        key = content_key(model_name, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return vector
+        store = self._store(model_name)
+        vector = store.get(key) if store is not None else None
+        if vector is not None:
+            self._remember(key, vector)
+            self.hits += 1
+        else:
+            self.misses += 1
+        return vector
+
+    def put_many(self, model_name: str, texts, vectors) -> None:
+        keyed = [(content_key(model_name, t), list(v)) for t, v in zip(texts, vectors)]
+        for key, vector in keyed:
+            self._remember(key, vector)
+        store = self._store(model_name)
+        if store is not None:
+            try:
+                store.put_many(keyed)
+            except OSError as e:
+                print(f"Écriture du cache d'embeddings impossible: {e}")
+
+    def get_or_compute(self, model_name: str, texts, compute):
+        """Return vectors for texts, calling compute(missing_texts) once for the misses."""
+        texts = list(texts)
+        results = [self.get(model_name, t) for t in texts]
+        missing = sorted({t for t, v in zip(texts, results) if v is None})
+        if missing:
+            computed = dict(zip(missing, compute(missing)))
+            self.put_many(model_name, missing, [computed[t] for t in missing])
+            results = [v if v is not None else computed[t] for t, v in zip(texts, results)]
+        return results
+
+
+embedding_cache = EmbeddingCache(persist=os.getenv("EMBEDDING_CACHE_PERSIST", "True").lower() == "true")
@@ -0,0 +1,102 @@
+"""
+Process-wide registry of local embedding models.
+
+Loading a SentenceTransformer takes seconds and hundreds of MB, so each model
+is loaded at most once per worker process (lazily, under a per-model lock) and
+shared by rag_service, rag_grasss_service and the PDF indexer.
+"""
+
+import os
+import threading
+
+from backend.embedding_cache import embedding_cache
+
+DEFAULT_EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+
+
+class EmbeddingRegistry:
+    """Lazily loads and caches SentenceTransformer models by name."""
+
+    def __init__(self):
+        self._models = {}
+        self._locks = {}
+        self._registry_lock = threading.Lock()
+
+    def _lock_for(self, model_name: str) -> threading.Lock:
+        with self._registry_lock:
+            lock = self._locks.get(model_name)
+            if lock is None:
+                lock = self._locks[model_name] = threading.Lock()
+            return lock
+
+    def get_model(self, model_name: str = None):
+        """Return the shared model instance, loading it on first use."""
+        model_name = model_name or DEFAULT_EMBEDDING_MODEL
+        model = self._models.get(model_name)
+        if model is not None:
+            return model
+        # Double-checked locking: only one thread pays the load cost
+        with self._lock_for(model_name):
+            model = self._models.get(model_name)
+            if model is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except Exception:
+                    raise RuntimeError("sentence-transformers not available for local embeddings")
+                model = SentenceTransformer(model_name)
+                self._models[model_name] = model
+        return model
+
+    def is_loaded(self, model_name: str = None) -> bool:
+        return (model_name or DEFAULT_EMBEDDING_MODEL) in self._models
+
+    def encode(self, texts, model_name: str = None, batch_size: int = 64):
+        """Encode a list of texts and return a list of list[float]."""
+        if not texts:
+            return []
+        model = self.get_model(model_name)
+        vectors = model.encode(list(texts), batch_size=batch_size, show_progress_bar=False)
+        return [vec.tolist() for vec in vectors]
+
+    def warm_up(self, model_names=None):
+        """Load the given models (default model if None) and run one forward pass."""
+        for name in model_names or [DEFAULT_EMBEDDING_MODEL]:
+            self.encode(["warm-up"], model_name=name)
+
+
+embedding_registry = EmbeddingRegistry()
+
+
+def get_embedding_model(model_name: str = None):
+    return embedding_registry.get_model(model_name)
+
+
+def embed_texts(texts, model_name: str = None, batch_size: int = 64, use_cache: bool = True):
+    """Embed several texts with the shared local model.
+
+    Texts already embedded (by any worker or by the indexer) are served from
+    the content-addressed cache; only the misses reach the model.
+    """
+    model_name = model_name or DEFAULT_EMBEDDING_MODEL
+    if not use_cache:
+        return embedding_registry.encode(texts, model_name=model_name, batch_size=batch_size)
+    return embedding_cache.get_or_compute(
+        model_name,
+        texts,
+        lambda missing: embedding_registry.encode(missing, model_name=model_name, batch_size=batch_size),
+    )
+
+
+def embed_text(text: str, model_name: str = None):
+    """Embed a single text with the shared local model."""
+    return embed_texts([text], model_name=model_name)[0]
+
+
+def warm_up_embeddings(model_names=None) -> bool:
+    """Best-effort warm-up called at worker boot. Never raises."""
+    try:
+        embedding_registry.warm_up(model_names)
+        return True
+    except Exception as e:
+        print(f"Embedding warm-up skipped: {e}")
+        return False
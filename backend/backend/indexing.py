@@ -0,0 +1,367 @@
+"""
+Batched, parallel indexing of the pedagogical PDF corpus into Chroma.
+
+Pipeline:
+1. PDF text is extracted in a process pool, one task per file (PyPDF2 is
+   CPU-bound): files run in parallel, the pages of one PDF serially;
+2. pages of each finished file are chunked as soon as they arrive
+   (structure-aware, token-budgeted: see backend.chunking);
+3. chunks are embedded in large batches (one forward pass per batch);
+4. chunks are upserted into the collection in large batches;
+5. the BM25 lexical index of the collection (backend.lexical_index) is
+   updated with the same chunks and saved next to the manifest.
+
+A JSON manifest (content hash, size, mtime and chunk ids per file) enables
+incremental runs that only touch new, modified or deleted PDFs.
+
+Used by ``manage.py index_documents`` and by the legacy chroma_db/indexer.py.
+"""
+
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from backend.chunking import (
+    DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP_TOKENS, Chunker, model_token_counter, token_counter_label,
+)
+from backend.embeddings import DEFAULT_EMBEDDING_MODEL, embed_texts
+from backend.lexical_index import LexicalIndex, lexical_index_path, load_or_create
+from backend.vector_store import get_vector_store, mark_index_updated
+
+CORPUS_COLLECTION = "tuteur_intelligent"
+DEFAULT_EMBED_BATCH_SIZE = 256
+DEFAULT_UPSERT_BATCH_SIZE = 2000
+
+
+def extract_pdf_pages(pdf_path):
+    """Lit le contenu textuel d'un PDF page par page -> [(numéro de page, texte)].
+
+    Returns None when the file cannot be read (the caller keeps what was
+    indexed before). Runs inside the worker processes, so it must stay a
+    top-level function.
+    """
+    import PyPDF2
+
+    pages = []
+    try:
+        with open(pdf_path, "rb") as f:
+            reader = PyPDF2.PdfReader(f)
+            for number, page in enumerate(reader.pages, start=1):
+                content = page.extract_text()
+                if content:
+                    pages.append((number, content))
+    except Exception as e:
+        print(f"Erreur lors de la lecture de {pdf_path}: {e}")
+        return None
+    return pages
+
+
+def chunk_pages(filename, pages, chunker):
+    """Return (ids, documents, metadatas) for one file."""
+    chunks = chunker.chunk_pages(pages)
+    ids = [f"{filename}_{i}" for i in range(len(chunks))]
+    documents = [chunk.text for chunk in chunks]
+    metadatas = [
+        {
+            "source": filename,
+            "partie": i,
+            "page_start": chunk.page_start,
+            "page_end": chunk.page_end,
+            "heading": chunk.heading,
+            "tokens": chunk.tokens,
+        }
+        for i, chunk in enumerate(chunks)
+    ]
+    return ids, documents, metadatas
+
+
+def chunking_signature(chunker, embedding_model=None):
+    """Changing the chunking parameters, the token counter or the embedding model invalidates every manifest entry.
+
+    Otherwise an incremental run would mix vectors of two models (or chunks
+    sized by two counters) in one collection.
+    """
+    return (
+        f"tokens={chunker.max_tokens}/overlap={chunker.overlap_tokens}/min={chunker.min_tokens}"
+        f"/counter={token_counter_label(chunker.count_tokens)}/model={embedding_model or DEFAULT_EMBEDDING_MODEL}"
+    )
+
+
+def list_pdfs(folder):
+    return sorted(
+        os.path.join(folder, name)
+        for name in os.listdir(folder)
+        if name.lower().endswith(".pdf")
+    )
+
+
+class IndexingStats:
+    """Counters and per-stage wall time of one indexing run."""
+
+    def __init__(self):
+        self.files = 0
+        self.pages = 0
+        self.chunks = 0
+        self.skipped = 0
+        self.removed_files = 0
+        self.deleted_chunks = 0
+        self.failed_files = 0
+        self.extract_seconds = 0.0
+        self.embed_seconds = 0.0
+        self.upsert_seconds = 0.0
+        self.total_seconds = 0.0
+
+    def report(self):
+        def rate(count, seconds):
+            return count / seconds if seconds > 0 else 0.0
+        return {
+            "files": self.files,
+            "pages": self.pages,
+            "chunks": self.chunks,
+            "skipped_files": self.skipped,
+            "removed_files": self.removed_files,
+            "deleted_chunks": self.deleted_chunks,
+            "failed_files": self.failed_files,
+            "total_seconds": round(self.total_seconds, 3),
+            "extract_seconds": round(self.extract_seconds, 3),
+            "embed_seconds": round(self.embed_seconds, 3),
+            "upsert_seconds": round(self.upsert_seconds, 3),
+            "pages_per_second": round(rate(self.pages, self.total_seconds), 1),
+            "chunks_per_second": round(rate(self.chunks, self.total_seconds), 1),
+            "embed_chunks_per_second": round(rate(self.chunks, self.embed_seconds), 1),
+        }
+
+
+class _BatchWriter:
+    """Buffers chunks, embeds them per batch and upserts them per batch."""
+
+    def __init__(self, collection, stats, embed_batch_size, upsert_batch_size, use_cache=True):
+        self.collection = collection
+        self.use_cache = use_cache
+        self.stats = stats
+        self.embed_batch_size = embed_batch_size
+        self.upsert_batch_size = upsert_batch_size
+        self._pending = ([], [], [])
+        self._ready = ([], [], [], [])
+
+    def add(self, ids, documents, metadatas):
+        p_ids, p_docs, p_metas = self._pending
+        p_ids.extend(ids)
+        p_docs.extend(documents)
+        p_metas.extend(metadatas)
+        while len(p_ids) >= self.embed_batch_size:
+            self._embed(self.embed_batch_size)
+
+    def _embed(self, count):
+        p_ids, p_docs, p_metas = self._pending
+        batch = p_docs[:count]
+        started = time.perf_counter()
+        vectors = embed_texts(batch, batch_size=min(count, self.embed_batch_size), use_cache=self.use_cache)
+        self.stats.embed_seconds += time.perf_counter() - started
+        r_ids, r_docs, r_metas, r_vecs = self._ready
+        r_ids.extend(p_ids[:count])
+        r_docs.extend(batch)
+        r_metas.extend(p_metas[:count])
+        r_vecs.extend(vectors)
+        del p_ids[:count], p_docs[:count], p_metas[:count]
+        if len(r_ids) >= self.upsert_batch_size:
+            self._upsert()
+
+    def _upsert(self):
+        r_ids, r_docs, r_metas, r_vecs = self._ready
+        if not r_ids:
+            return
+        started = time.perf_counter()
+        self.collection.upsert(ids=list(r_ids), documents=list(r_docs), metadatas=list(r_metas), embeddings=list(r_vecs))
+        self.stats.upsert_seconds += time.perf_counter() - started
+        self.stats.chunks += len(r_ids)
+        for buffer in self._ready:
+            del buffer[:]
+
+    def flush(self):
+        if self._pending[0]:
+            self._embed(len(self._pending[0]))
+        self._upsert()
+
+
+# ============================================================================
+# INCREMENTAL MANIFEST
+# ============================================================================
+
+def manifest_path(chroma_path, collection_name):
+    return os.path.join(chroma_path, f"index_manifest_{collection_name}.json")
+
+
+def load_manifest(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f).get("files", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, files):
+    """Atomic write so a crash never leaves a truncated manifest."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "files": files}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def plan_changes(paths, manifest, signature=""):
+    """Split paths into (to_index, fingerprints, removed_filenames).
+
+    A file whose size and mtime match the manifest is not even hashed; a file
+    whose content hash matches (touched but identical) is skipped too. Files
+    chunked with other parameters (``signature``) are always re-indexed.
+    """
+    to_index = []
+    fingerprints = {}
+    for path in paths:
+        filename = os.path.basename(path)
+        st = os.stat(path)
+        entry = manifest.get(filename)
+        if entry and entry.get("chunking") != signature:
+            entry = None
+        if entry and entry.get("size") == st.st_size and entry.get("mtime") == st.st_mtime:
+            continue
+        sha = file_sha256(path)
+        fingerprints[filename] = {"sha256": sha, "size": st.st_size, "mtime": st.st_mtime, "chunking": signature}
+        if entry and entry.get("sha256") == sha:
+            continue
+        to_index.append(path)
+    present = {os.path.basename(p) for p in paths}
+    removed = [name for name in manifest if name not in present]
+    return to_index, fingerprints, removed
+
+
+def index_documents(
+    folder,
+    chroma_path=None,
+    collection_name=CORPUS_COLLECTION,
+    workers=None,
+    max_tokens=DEFAULT_MAX_TOKENS,
+    overlap_tokens=DEFAULT_OVERLAP_TOKENS,
+    embed_batch_size=DEFAULT_EMBED_BATCH_SIZE,
+    upsert_batch_size=DEFAULT_UPSERT_BATCH_SIZE,
+    use_embedding_cache=True,
+    incremental=False,
+    progress=print,
+):
+    """Index the PDFs of ``folder`` into ``collection_name`` and return IndexingStats.
+
+    With ``incremental=True`` only new or modified files (per the manifest of
+    content fingerprints) are re-processed and chunks of deleted files are
+    removed. Either way the manifest is rewritten, and chunks left over from
+    a previous, longer version of a file are deleted. A file that cannot be
+    read keeps its previous chunks and manifest entry, and is retried by the
+    next run.
+    """
+    stats = IndexingStats()
+    started = time.perf_counter()
+    paths = list_pdfs(folder)
+    store = get_vector_store(chroma_path)
+    collection = store.get_collection(collection_name, create=True)
+    writer = _BatchWriter(collection, stats, embed_batch_size, upsert_batch_size, use_embedding_cache)
+
+    manifest_file = manifest_path(store.path, collection_name)
+    manifest = load_manifest(manifest_file)
+    # Token budgets are measured with the embedding model's own tokenizer
+    chunker = Chunker(max_tokens=max_tokens, overlap_tokens=overlap_tokens, count_tokens=model_token_counter())
+    signature = chunking_signature(chunker)
+    to_index, fingerprints, removed = plan_changes(paths, manifest if incremental else {}, signature)
+    if not incremental:
+        removed = [name for name in manifest if name not in fingerprints]
+    # A full run re-adds every file, so the lexical index starts empty; an
+    # incremental run whose saved index is missing (collection indexed before
+    # the lexical index existed) or unreadable rebuilds it from the stored chunks
+    lexical_file = lexical_index_path(store.path, collection_name)
+    if not incremental:
+        lexical = LexicalIndex()
+    else:
+        lexical = load_or_create(lexical_file, collection)
+    stats.skipped = len(paths) - len(to_index)
+
+    # Files that disappeared from the folder
+    for filename in removed:
+        stale_ids = manifest.pop(filename, {}).get("chunk_ids", [])
+        if stale_ids:
+            collection.delete(ids=stale_ids)
+            lexical.remove(stale_ids)
+            stats.deleted_chunks += len(stale_ids)
+        stats.removed_files += 1
+        progress(f"Supprimé de l'index: {filename} ({len(stale_ids)} morceaux)")
+
+    # Touched but identical files only need their fingerprint refreshed
+    for filename, fingerprint in fingerprints.items():
+        if filename in manifest and manifest[filename].get("sha256") == fingerprint["sha256"]:
+            manifest[filename].update(fingerprint)
+
+    if to_index:
+        workers = workers or min(len(to_index), os.cpu_count() or 1) or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(extract_pdf_pages, path): path for path in to_index}
+            for done, future in enumerate(as_completed(futures), start=1):
+                path = futures[future]
+                filename = os.path.basename(path)
+                pages = future.result()
+                if pages is None:
+                    # Unreadable: keep what was indexed, don't record the new fingerprint
+                    kept_ids = manifest.get(filename, {}).get("chunk_ids", [])
+                    if kept_ids and not incremental:
+                        # The full run's lexical index started empty
+                        kept = collection.get(ids=kept_ids, include=["documents"])
+                        lexical.add(kept.get("ids") or [], kept.get("documents") or [])
+                    stats.failed_files += 1
+                    progress(f"[{done}/{len(to_index)}] {filename}: illisible, {len(kept_ids)} morceaux conservés")
+                    continue
+                ids, documents, metadatas = chunk_pages(filename, pages, chunker)
+                writer.add(ids, documents, metadatas)
+                lexical.add(ids, documents)
+                stale_ids = set(manifest.get(filename, {}).get("chunk_ids", [])) - set(ids)
+                if stale_ids:
+                    collection.delete(ids=sorted(stale_ids))
+                    lexical.remove(stale_ids)
+                    stats.deleted_chunks += len(stale_ids)
+                manifest[filename] = dict(fingerprints[filename], chunk_ids=ids)
+                stats.files += 1
+                stats.pages += len(pages)
+                progress(f"[{done}/{len(to_index)}] {filename}: {len(pages)} pages, {len(documents)} morceaux")
+        # Extraction overlaps with embedding; report the time spent outside the other stages
+        writer.flush()
+
+    stats.total_seconds = time.perf_counter() - started
+    stats.extract_seconds = max(0.0, stats.total_seconds - stats.embed_seconds - stats.upsert_seconds)
+
+    save_manifest(manifest_file, manifest)
+    if to_index or removed or not os.path.exists(lexical_file):
+        lexical.save(lexical_file)
+    if to_index or removed:
+        mark_index_updated(store.path)
+    return stats
+
+
+def watch_documents(folder, interval=10.0, progress=print, **kwargs):
+    """Poll ``folder`` and run an incremental indexing pass whenever it changes."""
+    last_snapshot = None
+    while True:
+        snapshot = sorted(
+            (os.path.basename(p), os.path.getsize(p), os.path.getmtime(p))
+            for p in list_pdfs(folder)
+        )
+        if snapshot != last_snapshot:
+            stats = index_documents(folder, incremental=True, progress=progress, **kwargs)
+            if stats.files or stats.removed_files:
+                progress(f"Index mis à jour: {stats.report()}")
+            last_snapshot = snapshot
+        time.sleep(interval)
@@ -0,0 +1,265 @@
+"""
+Database-backed background job queue.
+
+Slow side effects (LLM summary generation, embeddings, Chroma writes) are
+enqueued as ``BackgroundJob`` rows and executed by worker processes started
+with ``manage.py run_jobs``, so a request returns as soon as its critical data
+is committed.
+
+- Handlers are registered with ``@job("name")`` in ``<app>/tasks.py`` modules,
+  which workers autodiscover.
+- ``enqueue`` is deferred to ``transaction.on_commit``: a job never runs
+  against rows its request has not committed yet.
+- An ``idempotency_key`` makes enqueueing the same work twice a no-op while
+  the first job is pending, running or done; a job that ended ``failed`` is
+  queued again with fresh attempts. Handlers are written so that re-running
+  them after a crash is harmless.
+- An attempt is charged when a job is claimed. Failures are retried with
+  jittered exponential backoff up to ``max_attempts``; jobs left ``running``
+  by a dead (or too slow) worker are reclaimed after ``LEASE_SECONDS``, and
+  failed if that was their last attempt, so a job that kills its worker
+  cannot loop forever.
+- With ``EAGER`` enabled (no worker running, e.g. local development) jobs run
+  inline right after the commit.
+"""
+
+import os
+import random
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+DEFAULT_CONFIG = {
+    "EAGER": False,
+    "MAX_ATTEMPTS": 5,
+    "RETRY_BASE_SECONDS": 5,
+    "RETRY_MAX_SECONDS": 600,
+    "LEASE_SECONDS": 600,
+    "POLL_INTERVAL": 1.0,
+}
+
+_registry = {}
+
+
+class JobSpec:
+    __slots__ = ("name", "func", "max_attempts", "on_failure")
+
+    def __init__(self, name, func, max_attempts=None, on_failure=None):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+        self.on_failure = on_failure
+
+
+def get_config():
+    config = dict(DEFAULT_CONFIG)
+    config.update(getattr(settings, "BACKGROUND_JOBS", {}) or {})
+    return config
+
+
+def job(name, max_attempts=None, on_failure=None):
+    """Register ``func(**payload)`` as the handler of jobs called ``name``.
+
+    ``on_failure(payload, error)`` is called once the job has exhausted its
+    attempts.
+    """
+    def decorator(func):
+        _registry[name] = JobSpec(name, func, max_attempts, on_failure)
+        return func
+    return decorator
+
+
+def autodiscover():
+    autodiscover_modules("tasks")
+
+
+def _spec(name):
+    spec = _registry.get(name)
+    if spec is None:
+        # Web processes only import tasks modules on first use
+        autodiscover()
+        spec = _registry.get(name)
+    return spec
+
+
+def enqueue(name, payload=None, idempotency_key=None, delay=0, max_attempts=None):
+    """Queue a job once the current transaction commits.
+
+    Returns immediately; the job row (or the eager run) happens on commit.
+    """
+    payload = payload or {}
+
+    def create():
+        from authentication.models import BackgroundJob
+
+        spec = _spec(name)
+        attempts = max_attempts or (spec and spec.max_attempts) or get_config()["MAX_ATTEMPTS"]
+        fields = dict(
+            name=name,
+            payload=payload,
+            max_attempts=attempts,
+            run_after=timezone.now() + timedelta(seconds=delay),
+        )
+        if idempotency_key:
+            background_job, created = BackgroundJob.objects.get_or_create(
+                idempotency_key=idempotency_key, defaults=fields
+            )
+            if not created and background_job.status == BackgroundJob.STATUS_FAILED:
+                # Same work, earlier run gave up: start over rather than stay stuck
+                created = BackgroundJob.objects.filter(
+                    pk=background_job.pk, status=BackgroundJob.STATUS_FAILED
+                ).update(
+                    attempts=0, status=BackgroundJob.STATUS_PENDING, finished_at=None,
+                    locked_by="", locked_at=None, **fields,
+                )
+        else:
+            background_job, created = BackgroundJob.objects.create(**fields), True
+        if created and get_config()["EAGER"] and not delay:
+            claimed = _claim(background_job.pk, _worker_id(), timezone.now())
+            if claimed is not None:
+                run_job(claimed)
+
+    transaction.on_commit(create)
+
+
+def _worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _claim(pk, worker_id, now):
+    """Mark a pending job running and charge the attempt; return it, or None if taken."""
+    from authentication.models import BackgroundJob
+
+    # Conditional update: safe on backends without SELECT ... FOR UPDATE (SQLite)
+    claimed = BackgroundJob.objects.filter(pk=pk, status=BackgroundJob.STATUS_PENDING).update(
+        status=BackgroundJob.STATUS_RUNNING,
+        attempts=F("attempts") + 1,
+        locked_by=worker_id,
+        locked_at=now,
+    )
+    return BackgroundJob.objects.get(pk=pk) if claimed else None
+
+
+def _reclaim_expired(now):
+    """Jobs whose lease expired (worker died or ran too long): retry, or fail on their last attempt."""
+    from authentication.models import BackgroundJob
+
+    expired = BackgroundJob.objects.filter(
+        status=BackgroundJob.STATUS_RUNNING,
+        locked_at__lt=now - timedelta(seconds=get_config()["LEASE_SECONDS"]),
+    )
+    exhausted = list(expired.filter(attempts__gte=F("max_attempts")))
+    if exhausted:
+        BackgroundJob.objects.filter(
+            pk__in=[background_job.pk for background_job in exhausted], status=BackgroundJob.STATUS_RUNNING
+        ).update(
+            status=BackgroundJob.STATUS_FAILED, locked_by="", locked_at=None, finished_at=now,
+            last_error="Lease expired on the last attempt (worker died or job too slow)",
+        )
+    expired.update(status=BackgroundJob.STATUS_PENDING, locked_by="", locked_at=None)
+    return exhausted
+
+
+def _notify_failure(background_job, error):
+    spec = _registry.get(background_job.name)
+    if spec is not None and spec.on_failure:
+        try:
+            spec.on_failure(background_job.payload, error)
+        except Exception as failure_error:
+            print(f"on_failure of {background_job.name} failed: {failure_error}")
+
+
+def claim_next(worker_id=None):
+    """Lock and return the next due job, or None."""
+    from authentication.models import BackgroundJob
+
+    now = timezone.now()
+    with transaction.atomic():
+        exhausted = _reclaim_expired(now)
+
+        candidate = (
+            BackgroundJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=BackgroundJob.STATUS_PENDING, run_after__lte=now)
+            .order_by("run_after", "id")
+            .first()
+        )
+        claimed = _claim(candidate.pk, worker_id or _worker_id(), now) if candidate is not None else None
+    for background_job in exhausted:
+        _notify_failure(background_job, TimeoutError("lease expired"))
+    return claimed
+
+
+def _retry_delay(attempts):
+    config = get_config()
+    delay = min(config["RETRY_MAX_SECONDS"], config["RETRY_BASE_SECONDS"] * (2 ** (attempts - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _record_outcome(background_job, **fields):
+    """Write the outcome unless the lease was lost (job reclaimed and handed to another worker)."""
+    from authentication.models import BackgroundJob
+
+    updated = BackgroundJob.objects.filter(
+        pk=background_job.pk, status=BackgroundJob.STATUS_RUNNING, locked_by=background_job.locked_by
+    ).update(locked_by="", locked_at=None, **fields)
+    if not updated:
+        print(f"Job {background_job} lost its lease; outcome not recorded")
+    return bool(updated)
+
+
+def run_job(background_job):
+    """Execute one claimed job (attempt already charged) and record the outcome. Returns True on success."""
+    from authentication.models import BackgroundJob
+
+    spec = _spec(background_job.name)
+    try:
+        if spec is None:
+            raise LookupError(f"Unknown job: {background_job.name}")
+        spec.func(**background_job.payload)
+    except Exception as e:
+        last_error = traceback.format_exc()[-4000:]
+        if spec is not None and background_job.attempts < background_job.max_attempts:
+            fields = dict(
+                status=BackgroundJob.STATUS_PENDING,
+                run_after=timezone.now() + timedelta(seconds=_retry_delay(background_job.attempts)),
+            )
+        else:
+            fields = dict(status=BackgroundJob.STATUS_FAILED, finished_at=timezone.now())
+        recorded = _record_outcome(background_job, last_error=last_error, **fields)
+        print(f"Job {background_job} failed (attempt {background_job.attempts}): {e}")
+        if recorded and fields["status"] == BackgroundJob.STATUS_FAILED:
+            _notify_failure(background_job, e)
+        return False
+
+    _record_outcome(background_job, status=BackgroundJob.STATUS_DONE, last_error="", finished_at=timezone.now())
+    return True
+
+
+def run_pending(limit=None, worker_id=None):
+    """Run due jobs until the queue is empty (or ``limit`` jobs). Returns the count."""
+    done = 0
+    while limit is None or done < limit:
+        background_job = claim_next(worker_id)
+        if background_job is None:
+            break
+        run_job(background_job)
+        done += 1
+    return done
+
+
+def work(poll_interval=None, stop=None):
+    """Worker loop: run due jobs, sleep ``poll_interval`` when idle."""
+    autodiscover()
+    poll_interval = poll_interval if poll_interval is not None else get_config()["POLL_INTERVAL"]
+    worker_id = _worker_id()
+    while stop is None or not stop():
+        if not run_pending(limit=100, worker_id=worker_id):
+            time.sleep(poll_interval)
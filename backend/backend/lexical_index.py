@@ -0,0 +1,237 @@
+"""
+BM25 lexical index over the pedagogical corpus.
+
+Curriculum queries are keyword-heavy ("théorème de Thalès", "conjugaison
+passé simple") and small sentence embeddings often miss exact terms. This
+inverted index is built by the indexer next to the Chroma collection and
+queried alongside it; both rankings are merged with reciprocal rank fusion
+(see rag_service).
+
+Text is lowercased, accent-folded, stripped of French stop words and reduced
+with a light French stemmer, so "théorèmes" and "Theoreme" share one term.
+
+The index is a JSON file in the Chroma directory
+(``lexical_index_<collection>.json``). Workers load it once and reload it
+when the indexer rewrites the file.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+DEFAULT_K1 = 1.2
+DEFAULT_B = 0.75
+# Standard RRF constant: damps the weight of the very first ranks
+RRF_K = 60
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Already accent-folded
+STOP_WORDS = frozenset("""
+a au aux avec ce ces cet cette c d dans de des du elle elles en est et etre
+eux il ils je j l la le les leur leurs lui m ma mais me meme mes moi mon n
+ne nos notre nous on ou par pas pour qu que quel quelle quelles quels qui s
+sa sans se ses son sont sur t ta te tes toi ton tu un une vos votre vous y
+ete avoir ai as avez avons ont etait sont sera comme plus tres si
+""".split())
+
+# Longest first; a suffix is only removed if at least 3 characters remain
+_SUFFIXES = (
+    "issement", "atrice", "ateur", "ation", "ement", "ment",
+    "euse", "ique", "isme", "iste", "able", "ance", "ence",
+    "eur", "ite", "ive", "if", "ee", "er", "ez", "e",
+)
+
+
+def fold_accents(text: str) -> str:
+    """Lowercase and strip diacritics ("Thalès" -> "thales")."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).replace("œ", "oe").replace("æ", "ae")
+
+
+def stem(word: str) -> str:
+    """Light French stemmer on an accent-folded word (plural, then one derivational suffix)."""
+    if len(word) <= 3 or word.isdigit():
+        return word
+    if word.endswith("aux") and len(word) > 4:
+        word = word[:-3] + "al"
+    elif word[-1] in "sx":
+        word = word[:-1]
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> list:
+    """Return the index terms of text."""
+    return [
+        stem(token)
+        for token in _TOKEN_RE.findall(fold_accents(text or ""))
+        if token not in STOP_WORDS and (len(token) > 1 or token.isdigit())
+    ]
+
+
+class LexicalIndex:
+    """In-memory BM25 index of chunk ids -> term frequencies."""
+
+    def __init__(self, k1: float = DEFAULT_K1, b: float = DEFAULT_B):
+        self.k1 = k1
+        self.b = b
+        self._docs = {}       # id -> {term: tf}
+        self._lengths = {}    # id -> number of terms
+        self._postings = {}   # term -> {id: tf}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, ids, documents) -> None:
+        """Index (or re-index) documents under ids."""
+        for doc_id, document in zip(ids, documents):
+            if doc_id in self._docs:
+                self._remove(doc_id)
+            terms = Counter(tokenize(document))
+            self._docs[doc_id] = dict(terms)
+            self._lengths[doc_id] = sum(terms.values())
+            self._total_length += self._lengths[doc_id]
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, ids) -> None:
+        for doc_id in ids:
+            if doc_id in self._docs:
+                self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        for term in self._docs.pop(doc_id):
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(doc_id)
+
+    def search(self, query: str, k: int = 10) -> list:
+        """Return up to k (id, score) pairs by decreasing BM25 score."""
+        count = len(self._docs)
+        if not count:
+            return []
+        avg_length = self._total_length / count or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self._postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, path: str) -> None:
+        """Atomic write so readers never load a truncated index."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "k1": self.k1, "b": self.b, "docs": self._docs}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(k1=data.get("k1", DEFAULT_K1), b=data.get("b", DEFAULT_B))
+        for doc_id, terms in data.get("docs", {}).items():
+            index._docs[doc_id] = terms
+            index._lengths[doc_id] = sum(terms.values())
+            index._total_length += index._lengths[doc_id]
+            for term, tf in terms.items():
+                index._postings.setdefault(term, {})[doc_id] = tf
+        return index
+
+
+def lexical_index_path(chroma_path: str, collection_name: str) -> str:
+    return os.path.join(chroma_path, f"lexical_index_{collection_name}.json")
+
+
+def load_or_create(path: str, collection) -> LexicalIndex:
+    """Load the saved index; rebuild it from the collection if it is missing or unreadable.
+
+    An empty index would silently drop every chunk not re-added by the
+    current run from lexical retrieval.
+    """
+    try:
+        return LexicalIndex.load(path)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"Lexical index unreadable ({path}), rebuilding from the collection: {e}")
+    return build_from_collection(collection)
+
+
+def build_from_collection(collection, batch_size: int = 2000) -> LexicalIndex:
+    """Rebuild the index from the documents already stored in a Chroma collection."""
+    index = LexicalIndex()
+    offset = 0
+    while True:
+        page = collection.get(include=["documents"], limit=batch_size, offset=offset)
+        ids = page.get("ids") or []
+        if not ids:
+            break
+        index.add(ids, page.get("documents") or [])
+        offset += len(ids)
+    return index
+
+
+def reciprocal_rank_fusion(*rankings, k: int = RRF_K) -> list:
+    """Merge ranked id lists: score(id) = sum of 1 / (k + rank). Return ids best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])
+
+
+# ============================================================================
+# PER-WORKER CACHE
+# ============================================================================
+
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def get_lexical_index(collection_name: str, chroma_path: str = None):
+    """The worker's copy of a collection's index, or None if it was never built.
+
+    The file's mtime is checked on every call so a rebuild by the indexer is
+    picked up without restarting the worker.
+    """
+    if chroma_path is None:
+        from backend.vector_store import default_chroma_path
+        chroma_path = default_chroma_path()
+    path = lexical_index_path(chroma_path, collection_name)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    cached = _loaded.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _loaded_lock:
+        cached = _loaded.get(path)
+        if cached is None or cached[0] != mtime:
+            try:
+                cached = (mtime, LexicalIndex.load(path))
+            except (OSError, ValueError) as e:
+                print(f"Lexical index unreadable ({path}): {e}")
+                return None
+            _loaded[path] = cached
+    return cached[1]
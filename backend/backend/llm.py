@@ -0,0 +1,441 @@
+"""
+LLM provider layer.
+
+One provider instance per worker process holds the configured clients, so no
+request pays for client construction or ``genai_legacy.configure``. Every
+generation runs under a per-action deadline (``LLM_DEADLINES``), is retried
+with jittered exponential backoff while the deadline allows, and can be
+hedged: when a call is still pending after the observed p95 latency of its
+action, a second identical call is issued and the first reply wins.
+
+A call abandoned at its deadline keeps its pool thread until the client
+gives up, so every call passes the time left to the client's own timeout.
+Retries and hedges are billed upstream: requests_sent() reports them for
+the usage ledger. Gemini replies are ReplyText strings carrying the token
+counts reported by the API (usage_metadata).
+
+Providers:
+- ``gemini`` (default): google.genai client, legacy google.generativeai as
+  fallback;
+- ``stub``: canned replies with configurable latency, for tests, local
+  development and load benchmarks (``LLM_PROVIDER=stub``).
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+GEMINI_MODEL = "gemini-3-flash-preview"
+GEMINI_EMBEDDING_MODEL = "embed-text-1"
+
+DEFAULT_DEADLINES = {
+    'tutor': 20.0,
+    'chat': 20.0,
+    'exercise': 30.0,
+    'remediation': 30.0,
+    'diagnostic': 45.0,
+    'diagnostic_analysis': 45.0,
+    'summary': 60.0,
+    'default': 30.0,
+}
+
+
+def _setting(name, default):
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default)
+    except Exception:
+        return default
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies per action."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, action, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get(action)
+            if samples is None:
+                samples = self._samples[action] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, action, q: float):
+        """Return the q-quantile in seconds, or None below min_samples."""
+        with self._lock:
+            samples = sorted(self._samples.get(action) or ())
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class LLMProvider:
+    """Deadline, retry and hedging policy around a blocking ``_call``."""
+
+    name = "base"
+
+    def __init__(self, deadlines=None, max_retries=2, backoff_base=0.5,
+                 hedge=False, hedge_min_delay=1.0, max_workers=32, stream_idle_timeout=15.0):
+        self.deadlines = dict(DEFAULT_DEADLINES, **(deadlines or {}))
+        # Longest wait for the next chunk of a started stream
+        self.stream_idle_timeout = stream_idle_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.latency = LatencyTracker()
+        # Calls run in a shared pool so a stuck request can be abandoned at its deadline
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"llm-{self.name}")
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {'calls': 0, 'failures': 0, 'timeouts': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0}
+
+    # -- to implement --------------------------------------------------
+
+    def _call(self, prompt: str, action=None, timeout: float = None) -> str:
+        """One blocking upstream call, given up by the client after timeout seconds. Return the text or raise."""
+        raise NotImplementedError
+
+    def embed(self, text: str):
+        """Remote embedding of one text. Return list[float] or raise."""
+        raise NotImplementedError(f"{self.name} provider has no embeddings")
+
+    async def stream(self, prompt: str, action=None):
+        """Yield reply chunks. Default: one chunk from the blocking path."""
+        from asgiref.sync import sync_to_async
+        reply_text = await sync_to_async(self.generate, thread_sensitive=False)(prompt, action)
+        if reply_text:
+            yield reply_text
+
+    # -- policy --------------------------------------------------------
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self._stats[key] += n
+
+    def metrics(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['provider'] = self.name
+        return stats
+
+    def deadline_for(self, action) -> float:
+        return float(self.deadlines.get(action or 'default', self.deadlines['default']))
+
+    def requests_sent(self) -> int:
+        """Upstream requests (attempts, retries, hedges) of this thread's last generate()."""
+        return getattr(self._local, 'requests', 0)
+
+    def _submit(self, prompt, action, timeout):
+        self._local.requests = getattr(self._local, 'requests', 0) + 1
+        return self._pool.submit(self._call, prompt, action, timeout)
+
+    def _attempt(self, prompt, action, timeout):
+        """One attempt, hedged after the action's p95 when enabled."""
+        started = time.monotonic()
+        primary = self._submit(prompt, action, timeout)
+        pending = {primary}
+        hedge_at = None
+        if self.hedge:
+            p95 = self.latency.percentile(action, 0.95)
+            if p95 is not None:
+                hedge_at = started + max(self.hedge_min_delay, p95)
+
+        error = None
+        while pending:
+            now = time.monotonic()
+            remaining = timeout - (now - started)
+            if remaining <= 0:
+                break
+            wait_for = remaining if hedge_at is None else min(remaining, max(0.0, hedge_at - now))
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    text = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if not text:
+                    error = RuntimeError(f"{self.name}: empty reply")
+                    continue
+                if future is not primary:
+                    self._count('hedge_wins')
+                self.latency.record(action, time.monotonic() - started)
+                return text
+            if hedge_at is not None and time.monotonic() >= hedge_at:
+                # Slow tail: race a second identical request
+                pending.add(self._submit(prompt, action, timeout - (time.monotonic() - started)))
+                self._count('hedges')
+                hedge_at = None
+        if error is not None and not pending:
+            raise error
+        self._count('timeouts')
+        raise TimeoutError(f"{self.name}: no reply within {timeout:.1f}s")
+
+    def generate(self, prompt: str, action=None, deadline: float = None):
+        """Generate a reply within the action's deadline. Return the text or None."""
+        self._count('calls')
+        self._local.requests = 0
+        budget = deadline if deadline is not None else self.deadline_for(action)
+        end = time.monotonic() + budget
+        for attempt in range(self.max_retries + 1):
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                return self._attempt(prompt, action, remaining)
+            except TimeoutError:
+                break
+            except Exception as e:
+                print(f"LLM {self.name} error (attempt {attempt + 1}): {e}")
+            if attempt < self.max_retries:
+                self._count('retries')
+                # Full jitter, capped by what is left of the deadline
+                delay = random.uniform(0, self.backoff_base * (2 ** attempt))
+                time.sleep(max(0.0, min(delay, end - time.monotonic())))
+        self._count('failures')
+        return None
+
+
+class ReplyText(str):
+    """Reply text with the token counts reported upstream (None when unknown)."""
+
+    prompt_tokens = None
+    reply_tokens = None
+
+    @classmethod
+    def from_response(cls, text, response):
+        reply = cls(text)
+        usage = getattr(response, 'usage_metadata', None)
+        if usage is not None:
+            reply.prompt_tokens = getattr(usage, 'prompt_token_count', None)
+            reply.reply_tokens = getattr(usage, 'candidates_token_count', None)
+        return reply
+
+
+class GeminiProvider(LLMProvider):
+    """google.genai client (preferred) or legacy google.generativeai."""
+
+    name = "gemini"
+
+    def __init__(self, api_key=None, model=GEMINI_MODEL, **kwargs):
+        super().__init__(**kwargs)
+        self.api_key = api_key or os.getenv("GEMINI_API_KEY")
+        self.model = model
+        self.client = None
+        self.legacy = None
+        self._legacy_models = {}
+        self._legacy_lock = threading.Lock()
+        try:
+            import google.genai as genai_module
+            self.client = genai_module.Client(api_key=self.api_key) if self.api_key else genai_module.Client()
+        except Exception:
+            self.client = None
+        if self.client is None:
+            try:
+                import google.generativeai as genai_legacy
+                # Configured once per process, not on every call
+                genai_legacy.configure(api_key=self.api_key)
+                self.legacy = genai_legacy
+            except Exception:
+                self.legacy = None
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None or self.legacy is not None
+
+    def _legacy_model(self, name):
+        model = self._legacy_models.get(name)
+        if model is None:
+            with self._legacy_lock:
+                model = self._legacy_models.get(name)
+                if model is None:
+                    model = self._legacy_models[name] = self.legacy.GenerativeModel(name)
+        return model
+
+    def _call(self, prompt, action=None, timeout=None):
+        if self.client is not None:
+            options = {}
+            if timeout:
+                from google.genai import types
+                # HttpOptions.timeout is in milliseconds
+                options['config'] = types.GenerateContentConfig(
+                    http_options=types.HttpOptions(timeout=max(1, int(timeout * 1000)))
+                )
+            resp = self.client.models.generate_content(model=self.model, contents=prompt, **options)
+            return ReplyText.from_response(getattr(resp, 'text', None) or str(resp), resp)
+        if self.legacy is not None:
+            options = {'request_options': {'timeout': timeout}} if timeout else {}
+            response = self._legacy_model(self.model).generate_content(prompt, **options)
+            return ReplyText.from_response(getattr(response, 'text', '') or str(response), response)
+        raise RuntimeError("No Gemini client configured")
+
+    def embed(self, text):
+        # The client API surface may vary; try common patterns and raise on failure
+        if self.client is not None:
+            try:
+                resp = self.client.embeddings.create(model=GEMINI_EMBEDDING_MODEL, input=[text])
+                return resp.data[0].embedding
+            except Exception:
+                resp = self.client.embed(model=GEMINI_EMBEDDING_MODEL, text=[text])
+                return resp.data[0].embedding
+        if self.legacy is not None:
+            try:
+                emb_resp = self.legacy.embeddings.create(model=GEMINI_EMBEDDING_MODEL, input=[text])
+                return emb_resp.data[0].embedding
+            except Exception:
+                emb_resp = self.legacy.get_embeddings(input=[text], model=GEMINI_EMBEDDING_MODEL)
+                return emb_resp['data'][0]['embedding']
+        raise RuntimeError("Unable to obtain embeddings from Gemini or legacy client")
+
+    async def stream(self, prompt, action=None):
+        """Stream through client.aio; fall back to one blocking chunk if nothing was sent.
+
+        The first chunk must arrive within the action's deadline and each
+        next one within stream_idle_timeout, so a hung upstream stream cannot
+        hold its admission slot forever. A failure after the first chunk is
+        raised: the reply is truncated and must not pass for a complete one.
+        Chunks are ReplyText: the counts of the latest usage_metadata seen
+        (cumulative, complete on the last chunk).
+        """
+        if self.client is not None:
+            streamed = False
+            try:
+                deadline = self.deadline_for(action)
+                async with asyncio.timeout(deadline):
+                    stream = await self.client.aio.models.generate_content_stream(model=self.model, contents=prompt)
+                chunks = stream.__aiter__()
+                while True:
+                    try:
+                        async with asyncio.timeout(self.stream_idle_timeout if streamed else deadline):
+                            chunk = await chunks.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    text = getattr(chunk, 'text', None)
+                    if text:
+                        streamed = True
+                        yield ReplyText.from_response(text, chunk)
+                if streamed:
+                    return
+            except TimeoutError:
+                self._count('timeouts')
+                if streamed:
+                    raise
+                # Deadline spent waiting for the first chunk: no time left for a fallback
+                return
+            except Exception:
+                if streamed:
+                    raise
+        async for text in super().stream(prompt, action):
+            yield text
+
+
+class StubProvider(LLMProvider):
+    """Offline provider: canned replies per action after a simulated latency.
+
+    ``latency`` is a number of seconds or a callable returning one (e.g. a
+    sampler of a latency distribution).
+    """
+
+    name = "stub"
+
+    def __init__(self, latency=0.0, replies=None, **kwargs):
+        super().__init__(**kwargs)
+        self.simulated_latency = latency
+        self.replies = replies or {}
+        self._counter = itertools.count(1)
+
+    def _sleep(self, timeout=None):
+        seconds = self.simulated_latency() if callable(self.simulated_latency) else self.simulated_latency
+        if timeout is not None and seconds > timeout:
+            # Like a client timeout: the thread is freed at the deadline
+            time.sleep(max(0.0, timeout))
+            raise TimeoutError(f"{self.name}: client timeout after {timeout:.1f}s")
+        if seconds:
+            time.sleep(seconds)
+
+    def reply_for(self, prompt, action=None):
+        if action in self.replies:
+            reply = self.replies[action]
+            return reply(prompt) if callable(reply) else reply
+        n = next(self._counter)
+        if action in ('exercise', 'exercise_bank'):
+            return json.dumps({
+                "question": f"Question de test n°{n} : combien font {n} + {n} ?",
+                "options": [
+                    {"id": "A", "text": str(2 * n), "is_correct": True, "explanation": "Addition"},
+                    {"id": "B", "text": str(2 * n + 1), "is_correct": False, "explanation": "Erreur de calcul"},
+                    {"id": "C", "text": str(n), "is_correct": False, "explanation": "Un seul terme"},
+                    {"id": "D", "text": str(n * n), "is_correct": False, "explanation": "Produit"},
+                ],
+                "difficulty": "moyen",
+                "competencies": ["Calcul"],
+                "hint": "Additionnez les deux nombres",
+            }, ensure_ascii=False)
+        if action in ('diagnostic', 'diagnostic_set'):
+            return json.dumps({
+                "questions": [
+                    {"id": i, "text": f"Question de diagnostic {n}.{i}", "type": "open", "expected_level": "facile"}
+                    for i in range(1, 6)
+                ],
+                "evaluation_criteria": ["Compréhension", "Restitution", "Analyse"],
+            }, ensure_ascii=False)
+        if action == 'diagnostic_analysis':
+            return json.dumps({"niveau_diagnostique": "intermediate", "lacunes_identifiees": [],
+                               "points_forts": [], "recommandations": []})
+        if action == 'summary':
+            return json.dumps({"titre": "Session de test", "resume_court": "Résumé de test",
+                               "concepts_couverts": ["Test"]}, ensure_ascii=False)
+        return f"Réponse de test n°{n}."
+
+    def _call(self, prompt, action=None, timeout=None):
+        self._sleep(timeout)
+        return self.reply_for(prompt, action)
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def build_provider(name=None):
+    """Instantiate the provider named by ``name`` or settings.LLM_PROVIDER."""
+    name = (name or _setting('LLM_PROVIDER', os.getenv('LLM_PROVIDER', 'gemini'))).lower()
+    options = dict(
+        deadlines=_setting('LLM_DEADLINES', None),
+        max_retries=int(_setting('LLM_MAX_RETRIES', 2)),
+        hedge=bool(_setting('LLM_HEDGE_ENABLED', False)),
+        hedge_min_delay=float(_setting('LLM_HEDGE_MIN_DELAY', 1.0)),
+        stream_idle_timeout=float(_setting('LLM_STREAM_IDLE_TIMEOUT', 15.0)),
+    )
+    if name == 'stub':
+        return StubProvider(latency=float(_setting('LLM_STUB_LATENCY', 0.0)), **options)
+    if name == 'gemini':
+        return GeminiProvider(**options)
+    raise ValueError(f"Unknown LLM provider: {name}")
+
+
+def get_llm_provider() -> LLMProvider:
+    """Process-wide provider instance."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = build_provider()
+    return _provider
+
+
+def set_llm_provider(provider) -> None:
+    """Replace the process-wide provider (tests, benchmarks)."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
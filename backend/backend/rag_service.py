@@ -1,106 +1,191 @@
-import os
-import chromadb
-from chromadb.utils import embedding_functions
+import time
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
 
-# Prefer the new google.genai package, fallback to legacy google.generativeai if needed
-GEMINI_KEY = os.getenv("GEMINI_API_KEY")
-gen_client = None
-genai_module = None
-genai_legacy = None
-try:
-    import google.genai as genai_module
-    try:
-        gen_client = genai_module.Client(api_key=GEMINI_KEY) if GEMINI_KEY else genai_module.Client()
-    except Exception:
-        gen_client = None
-except Exception:
-    genai_module = None
+from backend.embedding_cache import embedding_cache
+from backend.chunking import approximate_token_count
+from backend.circuit_breaker import get_breaker
+from backend.context_packing import Passage, context_budget, join_passages, pack
+from backend.embeddings import embed_text
+from backend.lexical_index import get_lexical_index, reciprocal_rank_fusion
+from backend.llm import GEMINI_EMBEDDING_MODEL, get_llm_provider
+from backend.response_cache import get_response_cache, prompt_key
+from backend.singleflight import get_generation_flight
+from backend.throttling import get_admission_controller
+from backend.tracing import annotate, count_tokens, span
+from backend.usage import CallTimer, check_quota, current_context, model_label, record_call, reported_tokens
+from backend.vector_store import get_vector_store
 
-if gen_client is None:
-    try:
-        import google.generativeai as genai_legacy
-        # legacy: configuration will be attempted on demand
-    except Exception:
-        genai_legacy = None
+CORPUS_COLLECTION = "tuteur_intelligent"
+RETRIEVAL_MODES = ('vector', 'lexical', 'hybrid')
 
 
 def _get_embedding_via_gemini(text: str):
-    """Try to get embeddings from Gemini. Return list[float] or raise."""
-    # The client API surface may vary; try common patterns and raise on failure
-    # Try new client-based API
-    if gen_client is not None:
-        try:
-            # client.embeddings.create -> data[0].embedding
-            resp = gen_client.embeddings.create(model="embed-text-1", input=[text])
-            return resp.data[0].embedding
-        except Exception:
-            try:
-                # alternative: client.embed
-                resp = gen_client.embed(model="embed-text-1", text=[text])
-                return resp.data[0].embedding
-            except Exception:
-                pass
-
-    # Try legacy module if available
-    if genai_legacy is not None:
-        try:
-            genai_legacy.configure(api_key=GEMINI_KEY)
-            emb_resp = genai_legacy.embeddings.create(model="embed-text-1", input=[text])
-            return emb_resp.data[0].embedding
-        except Exception:
-            try:
-                emb_resp = genai_legacy.get_embeddings(input=[text], model="embed-text-1")
-                return emb_resp['data'][0]['embedding']
-            except Exception:
-                pass
-
-    raise RuntimeError("Unable to obtain embeddings from Gemini or legacy client")
+    """Gemini embedding through the content-addressed cache. Return list[float] or raise."""
+    return embedding_cache.get_or_compute(
+        f"gemini:{GEMINI_EMBEDDING_MODEL}",
+        [text],
+        lambda missing: [get_llm_provider().embed(t) for t in missing],
+    )[0]
 
 
 def _get_embedding_local(text: str):
-    """Fallback to sentence-transformers local embedding."""
-    try:
-        from sentence_transformers import SentenceTransformer
-    except Exception:
-        raise RuntimeError("sentence-transformers not available for local embeddings")
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-    vec = model.encode(text)
-    return vec.tolist()
+    """Fallback to the process-wide sentence-transformers model (see backend.embeddings)."""
+    return embed_text(text)
 
 
 def _get_embedding(text: str):
-    # If a Gemini client (new or legacy) is available, try remote embeddings first
-    if gen_client is not None or genai_legacy is not None:
+    # If a Gemini client (new or legacy) is available, try remote embeddings first,
+    # unless its breaker is open: then go straight to the local model
+    remote = get_breaker("gemini.embed")
+    if getattr(get_llm_provider(), 'available', False) and remote.allow():
         try:
-            return _get_embedding_via_gemini(text)
+            embedding = _get_embedding_via_gemini(text)
         except Exception:
-            return _get_embedding_local(text)
-    return _get_embedding_local(text)
+            remote.record_failure()
+        else:
+            remote.record_success()
+            return embedding
+    # Raises CircuitOpenError while the local model is known to be broken
+    return get_breaker("local.embed").call(_get_embedding_local, text)
 
 
-def get_ai_response(user_query: str, n_results: int = 3, max_context_chars: int = 1500):
-    """Return a dict: { 'reply': str, 'sources': [str,...] }
-    - uses Gemini embeddings when available, else local SentenceTransformer
-    - queries ChromaDB with embeddings
-    - limits concatenated context size to max_context_chars
-    """
-    # 1. Connect to ChromaDB
-    client = chromadb.PersistentClient(path="./chroma_db")
-    collection = client.get_collection(name="tuteur_intelligent")
+NO_INDEX_REPLY = "Désolé, ma base de connaissances n'est pas encore indexée. Réessayez plus tard."
+NO_REPLY = "Désolé, impossible de générer une réponse pour le moment."
+DEGRADED_REPLY = (
+    "Le tuteur est momentanément indisponible. En attendant, voici un extrait "
+    "du cours qui peut t'aider :\n\n{excerpt}"
+)
+# Corpus passages inserted into templated prompts (build_generation_prompt)
+COURSE_CONTEXT = "\n\nEXTRAITS DU COURS (à utiliser s'ils sont pertinents):\n{context}"
+# Actions whose free-text reply can be replaced by a course excerpt
+DEGRADED_TEMPLATE_ACTIONS = (None, 'chat', 'tutor')
+
 
-    # Check collection non-empty (best-effort)
+def _vector_search(collection, user_query: str, n_results: int):
+    """Nearest chunks by embedding. Return (documents, metadatas, ids)."""
     try:
-        col_count = collection.count()
+        with span("embed"):
+            q_emb = _get_embedding(user_query)
     except Exception:
-        # fallback: attempt a query and see if results exist
-        try:
-            probe = collection.query(query_texts=["test"], n_results=1)
-            col_count = len(probe.get('ids', [[]])[0])
-        except Exception:
-            col_count = 0
+        # As a last resort, let Chroma embed the query with the collection's own embedding function
+        with span("search.vector", n=n_results, chroma_embedding=True):
+            results = collection.query(query_texts=[user_query], n_results=n_results)
+    else:
+        with span("search.vector", n=n_results):
+            results = collection.query(query_embeddings=[q_emb], n_results=n_results)
+    docs = results.get('documents', [[]])[0]
+    metadatas = results.get('metadatas', [[]])[0]
+    ids = results.get('ids', [[]])[0]
+    return docs, metadatas, ids
+
+
+def retrieval_mode() -> str:
+    mode = getattr(settings, 'RAG_RETRIEVAL_MODE', 'hybrid')
+    return mode if mode in RETRIEVAL_MODES else 'hybrid'
+
+
+def retrieve(collection, user_query: str, n_results: int = 3, mode: str = None):
+    """Return the (documents, metadatas, ids) of the n_results best corpus chunks.
+
+    - 'vector': Chroma nearest neighbours only
+    - 'lexical': BM25 over the lexical index
+    - 'hybrid': both rankings over a wider candidate pool, merged with
+      reciprocal rank fusion
+    Falls back to 'vector' while the collection has no lexical index (or,
+    in 'lexical' mode, when no query term matches).
+    """
+    mode = mode or retrieval_mode()
+    lexical = get_lexical_index(collection.name) if mode != 'vector' else None
+    if lexical is None:
+        return _vector_search(collection, user_query, n_results)
+
+    candidates = max(n_results, int(getattr(settings, 'RAG_HYBRID_CANDIDATES', 20)))
+    with span("search.lexical", n=candidates) as s:
+        lexical_ids = [doc_id for doc_id, _ in lexical.search(user_query, k=candidates)]
+        s.set(hits=len(lexical_ids))
+    if mode == 'lexical':
+        if not lexical_ids:
+            return _vector_search(collection, user_query, n_results)
+        hits = {}
+        ranked = lexical_ids[:n_results]
+    else:
+        docs, metadatas, ids = _vector_search(collection, user_query, candidates)
+        hits = {doc_id: (doc, meta) for doc, meta, doc_id in zip(docs, metadatas, ids)}
+        with span("search.fuse"):
+            ranked = reciprocal_rank_fusion(ids, lexical_ids)[:n_results]
+
+    # Chunks found by BM25 only are fetched from Chroma in one call
+    missing = [doc_id for doc_id in ranked if doc_id not in hits]
+    if missing:
+        with span("chroma.fetch", n=len(missing)):
+            fetched = collection.get(ids=missing, include=['documents', 'metadatas'])
+        for doc_id, doc, meta in zip(fetched.get('ids') or [], fetched.get('documents') or [], fetched.get('metadatas') or []):
+            hits[doc_id] = (doc, meta)
+    ranked = [doc_id for doc_id in ranked if doc_id in hits]
+    return [hits[i][0] for i in ranked], [hits[i][1] for i in ranked], ranked
+
+
+def retrieve_context(query: str, n_results: int = 3, context_tokens: int = None, action: str = None):
+    """Retrieve corpus passages for query, packed into a token budget.
 
-    if not col_count:
+    Returns a dict: { 'context': str, 'sources': [...], 'documents': [str], 'indexed': bool }
+    where 'indexed' is False when the corpus collection is still empty.
+    """
+    # 1. Reuse the worker's ChromaDB client and cached collection handle
+    with span("chroma.open"):
+        store = get_vector_store()
+        collection = store.get_collection(CORPUS_COLLECTION)
+        # Check collection non-empty (best-effort, memoized until the indexer writes)
+        indexed = bool(store.count(CORPUS_COLLECTION))
+    if not indexed:
+        return {"context": "", "sources": [], "documents": [], "indexed": False}
+
+    # 2-3. Vector, lexical (BM25) or fused retrieval, see RAG_RETRIEVAL_MODE
+    with span("retrieve", mode=retrieval_mode()) as s:
+        docs, metadatas, ids = retrieve(collection, query, n_results=n_results)
+        s.set(hits=len(ids))
+
+    # 4. Build context: best-ranked chunks first, within the token budget
+    if context_tokens is None:
+        context_tokens = context_budget(action)['corpus']
+    with span("pack", budget=context_tokens) as s:
+        packed = pack(
+            [Passage(doc, score=1.0 / rank, source=_id) for rank, (doc, _id) in enumerate(zip(docs, ids), start=1)],
+            context_tokens,
+        )
+        s.set(passages=len(packed))
+
+    # 5. Prepare sources list (filenames / metadata) of the chunks kept
+    kept = {passage.source for passage in packed}
+    sources = []
+    for m, _id in zip(metadatas, ids):
+        if _id not in kept:
+            continue
+        src = m.get('source') if isinstance(m, dict) else None
+        sources.append({'id': _id, 'source': src, 'meta': m})
+
+    return {
+        "context": join_passages(packed),
+        "sources": sources,
+        "documents": [passage.text for passage in packed],
+        "indexed": True,
+    }
+
+
+def build_rag_prompt(user_query: str, n_results: int = 3, context_tokens: int = None, action: str = None):
+    """Retrieve corpus context for user_query and wrap both in the assistant prompt.
+
+    Retrieved chunks are deduplicated and packed into context_tokens
+    (default: the corpus budget of action, see backend.context_packing).
+
+    Returns a dict: { 'prompt': str, 'sources': [...], 'documents': [str], 'fallback': str }
+    where 'fallback' is the reply to use when generation fails.
+    """
+    retrieved = retrieve_context(user_query, n_results=n_results, context_tokens=context_tokens, action=action)
+
+    if not retrieved["indexed"]:
         # Fallback: générer quand même une réponse avec Gemini sans contexte RAG
         prompt_only = f"""
 Vous êtes un assistant tuteur pédagogique concis et clair.
@@ -108,90 +193,214 @@ Répondez de manière bienveillante et pédagogique à la question ou à la dema
 
 QUESTION OU DEMANDE:\n{user_query}\n\nREPONSE PEDAGOGIQUE:
 """
-        reply_text = None
-        if gen_client is not None:
-            try:
-                resp = gen_client.models.generate_content(model="gemini-3-flash-preview", contents=prompt_only)
-                reply_text = getattr(resp, 'text', None) or str(resp)
-            except Exception:
-                pass
-        if not reply_text and genai_legacy is not None:
-            try:
-                genai_legacy.configure(api_key=GEMINI_KEY)
-                model = genai_legacy.GenerativeModel('gemini-3-flash-preview')
-                response = model.generate_content(prompt_only)
-                reply_text = getattr(response, 'text', '') or str(response)
-            except Exception:
-                pass
-        if not reply_text:
-            reply_text = "Désolé, ma base de connaissances n'est pas encore indexée. Réessayez plus tard."
-        return {"reply": reply_text, "sources": []}
+        return {"prompt": prompt_only, "sources": [], "documents": [], "fallback": NO_INDEX_REPLY}
 
-    # 2. Compute embedding for the query
-    try:
-        q_emb = _get_embedding(user_query)
-    except Exception:
-        # As a last resort, use chroma internal embedding via SentenceTransformer
-        embedding_func = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
-        collection.embedding_function = embedding_func
-        results = collection.query(query_texts=[user_query], n_results=n_results)
-        docs = results.get('documents', [[]])[0]
-        metadatas = results.get('metadatas', [[]])[0]
-        ids = results.get('ids', [[]])[0]
-    else:
-        # 3. Query by embeddings
-        results = collection.query(query_embeddings=[q_emb], n_results=n_results)
-        docs = results.get('documents', [[]])[0]
-        metadatas = results.get('metadatas', [[]])[0]
-        ids = results.get('ids', [[]])[0]
-
-    # 4. Build context (limit size)
-    context_parts = []
-    for doc in docs:
-        if not doc:
-            continue
-        context_parts.append(doc)
-    context = " \n\n ".join(context_parts)
-    if len(context) > max_context_chars:
-        context = context[:max_context_chars] + "..."
-
-    # 5. Build prompt (do NOT include sources in the reply text)
+    # Build prompt (do NOT include sources in the reply text)
     prompt = f"""
 Vous êtes un assistant tuteur pédagogique concis et clair.
 Utilisez uniquement le contexte fourni pour répondre. Si la réponse n'est pas dans le contexte, dites-le brièvement et proposez une aide générale.
 
-CONTEXTE:\n{context}\n\nQUESTION: {user_query}\n\nREPONSE PEDAGOGIQUE:
+CONTEXTE:\n{retrieved["context"]}\n\nQUESTION: {user_query}\n\nREPONSE PEDAGOGIQUE:
 """
+    return {"prompt": prompt, "sources": retrieved["sources"], "documents": retrieved["documents"], "fallback": NO_REPLY}
 
-    # 6. Generate with Gemini (or fallback to legacy). Keep the generated text if available.
-    reply_text = None
-    # Try new google.genai client first
-    if gen_client is not None:
-        try:
-            # Use the client models API (client.models.generate_content)
-            # Use a supported Gemini model (match the test script which used gemini-3-flash-preview)
-            resp = gen_client.models.generate_content(model="gemini-3-flash-preview", contents=prompt)
-            reply_text = getattr(resp, 'text', None) or str(resp)
-        except Exception:
-            reply_text = None
 
-    # Fallback to legacy google.generativeai usage
-    if not reply_text and genai_legacy is not None:
-        try:
-            genai_legacy.configure(api_key=GEMINI_KEY)
-            model = genai_legacy.GenerativeModel('gemini-3-flash-preview')
-            response = model.generate_content(prompt)
-            reply_text = getattr(response, 'text', '') or str(response)
-        except Exception:
-            reply_text = None
+def build_generation_prompt(prompt: str, retrieval_query: str = None, suffix: str = "",
+                            n_results: int = 3, context_tokens: int = None, action: str = None):
+    """Complete an already templated prompt, without wrapping it again.
 
-    if not reply_text:
-        reply_text = "Désolé, impossible de générer une réponse pour le moment."
+    With retrieval_query (e.g. the student's message, never the templated
+    prompt itself), the corpus passages retrieved for it are inserted
+    between prompt and suffix; without it no retrieval is done.
 
-    # 7. Prepare sources list (filenames / metadata)
-    sources = []
-    for m, _id in zip(metadatas, ids):
-        src = m.get('source') if isinstance(m, dict) else None
-        sources.append({'id': _id, 'source': src, 'meta': m})
+    Returns the same dict as build_rag_prompt.
+    """
+    if not retrieval_query:
+        return {"prompt": prompt + suffix, "sources": [], "documents": [], "fallback": NO_REPLY}
+    retrieved = retrieve_context(retrieval_query, n_results=n_results, context_tokens=context_tokens, action=action)
+    course = COURSE_CONTEXT.format(context=retrieved["context"]) if retrieved["context"] else ""
+    return {
+        "prompt": prompt + course + suffix,
+        "sources": retrieved["sources"],
+        "documents": retrieved["documents"],
+        "fallback": NO_REPLY,
+    }
+
+
+def _generate_text(prompt: str, action: str = None):
+    """Generate with the process-wide LLM provider (backend.llm). Return the text or None.
+
+    Returns None at once while the provider's circuit breaker is open.
+    """
+    provider = get_llm_provider()
+    breaker = get_breaker(f"{provider.name}.generate")
+    if not breaker.allow():
+        annotate(breaker_open=breaker.name)
+        return None
+    with span("llm.generate", provider=provider.name) as s, CallTimer(action, provider, prompt) as call:
+        reply_text = call.reply = provider.generate(prompt, action=action)
+        if s.recording:
+            prompt_tokens, reply_tokens = reported_tokens(reply_text)
+            if prompt_tokens is None:
+                prompt_tokens = approximate_token_count(prompt)
+            if reply_tokens is None:
+                reply_tokens = approximate_token_count(reply_text or "")
+            s.set(prompt_tokens=prompt_tokens, reply_tokens=reply_tokens)
+            count_tokens(action, prompt_tokens, reply_tokens)
+    if reply_text:
+        breaker.record_success()
+    else:
+        breaker.record_failure()
+    return reply_text
+
+
+def degraded_reply(built: dict, action: str = None) -> str:
+    """Templated reply when generation is unavailable: a course excerpt if any."""
+    documents = built.get("documents") or []
+    if action in DEGRADED_TEMPLATE_ACTIONS and documents:
+        excerpt = documents[0]
+        if len(excerpt) > 600:
+            excerpt = excerpt[:600] + "..."
+        return DEGRADED_REPLY.format(excerpt=excerpt)
+    return built["fallback"]
+
+
+def _respond(cache_text: str, scope: str, build, action: str = None, private_terms=()):
+    """Cache lookup, single-flight and degraded mode around build() + generation.
 
-    return {"reply": reply_text, "sources": sources}
+    build() returns a build_rag_prompt-style dict and only runs on a cache miss.
+    """
+    cache = get_response_cache()
+    with span("cache.lookup") as s:
+        cached = cache.get(cache_text, action=action, scope=scope)
+        s.set(hit=cached is not None)
+    if cached is not None:
+        annotate(cache="hit")
+        return cached
+    annotate(cache="miss")
+    # Refused before any upstream call (429), see backend.usage
+    check_quota(action)
+
+    def generate():
+        # Bounded concurrency: waits in a bounded queue or raises Overloaded (429)
+        with span("admission"):
+            slot = get_admission_controller().acquire()
+        with slot:
+            with span("prompt"):
+                built = build()
+            reply_text = _generate_text(built["prompt"], action=action)
+        if not reply_text:
+            # Never cache the apology: the next request should retry Gemini
+            stale = cache.get_stale(cache_text, action=action, scope=scope)
+            annotate(degraded="stale" if stale is not None else "template")
+            if stale is not None:
+                return dict(stale, degraded=True)
+            return {"reply": degraded_reply(built, action), "sources": built["sources"], "degraded": True}
+
+        result = {"reply": reply_text, "sources": built["sources"]}
+        cache.set(cache_text, result, action=action, scope=scope, private_terms=private_terms)
+        return result
+
+    if not cache.is_cacheable(action):
+        return generate()
+    key = prompt_key(cache_text, action or 'chat', scope)
+    # Followers of an identical in-flight generation only show this span
+    with span("singleflight"):
+        result = get_generation_flight().do(key, generate)
+    # Followers get their own copy of the shared result
+    return dict(result, sources=list(result["sources"]))
+
+
+def get_ai_response(user_query: str, n_results: int = 3, context_tokens: int = None,
+                    action: str = None, private_terms=()):
+    """Answer a free-form question from the corpus (chat endpoint).
+
+    Return a dict: { 'reply': str, 'sources': [str,...] }
+    - serves repeated prompts from the response cache (rules per action,
+      replies containing one of private_terms are never stored)
+    - when generation fails or its breaker is open, serves a stale cached
+      reply, else a templated one; such results carry 'degraded': True
+    - coalesces concurrent identical prompts of cacheable actions into a
+      single upstream generation (backend.singleflight)
+    - uses Gemini embeddings when available, else local SentenceTransformer
+    - queries ChromaDB with embeddings, fused with BM25 in 'hybrid' mode
+    - packs the retrieved chunks into context_tokens (default: the
+      action's corpus budget, see backend.context_packing)
+
+    Templated prompts (GRASSS handlers) go through generate_response instead.
+    """
+    return _respond(
+        user_query,
+        f"{n_results}:{context_tokens}",
+        lambda: build_rag_prompt(user_query, n_results=n_results, context_tokens=context_tokens, action=action),
+        action=action,
+        private_terms=private_terms,
+    )
+
+
+def generate_response(prompt: str, action: str = None, retrieval_query: str = None, suffix: str = "",
+                      n_results: int = 3, context_tokens: int = None, private_terms=()):
+    """Generate from an already templated prompt; same result dict as get_ai_response.
+
+    Corpus retrieval runs on retrieval_query only (see
+    build_generation_prompt), so the templated prompt is neither embedded
+    nor wrapped in the assistant prompt. Cache, single-flight and degraded
+    mode behave as in get_ai_response.
+    """
+    scope = f"{n_results}:{context_tokens}:{'corpus' if retrieval_query else 'none'}"
+    return _respond(
+        prompt + suffix,
+        scope,
+        lambda: build_generation_prompt(
+            prompt, retrieval_query=retrieval_query, suffix=suffix,
+            n_results=n_results, context_tokens=context_tokens, action=action,
+        ),
+        action=action,
+        private_terms=private_terms,
+    )
+
+
+async def stream_generated_text(prompt: str, action: str = None, usage=None):
+    """Async generator yielding reply chunks as the provider produces them.
+
+    Gemini streams through the async surface of the google.genai client
+    (client.aio); otherwise the blocking generation runs in a thread and is
+    yielded in one chunk. Yields nothing if every backend fails or the
+    provider's circuit breaker is open; raises if the stream breaks after
+    the first chunk (the reply would be truncated).
+
+    The call is recorded in the usage ledger under usage (a
+    backend.usage.UsageContext; the response body is iterated outside the
+    view, where usage_context() no longer applies).
+    """
+    provider = get_llm_provider()
+    breaker = get_breaker(f"{provider.name}.generate")
+    if not breaker.allow():
+        return
+    usage = usage or current_context()
+    parts = []
+    tokens = (None, None)
+    started = time.perf_counter()
+    try:
+        async for text in provider.stream(prompt, action=action):
+            parts.append(text)
+            reported = reported_tokens(text)
+            if reported[1] is not None:
+                tokens = reported
+            yield text
+    except Exception:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        # Client went away: the call proved nothing about the backend
+        breaker.release_trial()
+        raise
+    finally:
+        await sync_to_async(record_call)(
+            action, model_label(provider), prompt, "".join(parts), time.perf_counter() - started, usage,
+            prompt_tokens=tokens[0], reply_tokens=tokens[1],
+        )
+    if parts:
+        breaker.record_success()
+    else:
+        breaker.record_failure()
@@ -0,0 +1,259 @@
+"""
+In-process cache of LLM generations.
+
+Diagnostic and exercise prompts repeat across students of the same class
+level and subject, so rag_service looks replies up by a hash of the
+normalized prompt before calling Gemini. Entries are bounded by total size
+(LRU eviction) and by a per-action TTL; an optional similarity tier serves
+near-duplicate prompts whose embeddings are above a cosine threshold.
+"""
+
+import hashlib
+import math
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    'MAX_BYTES': 32 * 1024 * 1024,
+    # Cosine threshold for the near-duplicate tier (None disables it)
+    'SIMILARITY_THRESHOLD': None,
+    # Expired replies are kept this long to serve as degraded responses
+    # when generation is down (see get_stale)
+    'STALE_SECONDS': 24 * 3600,
+    # TTL in seconds per action; 0 (or missing) means never cached
+    'ACTION_TTLS': {
+        'diagnostic': 24 * 3600,
+        'exercise': 15 * 60,
+        'remediation': 15 * 60,
+        'tutor': 5 * 60,
+        'chat': 3600,
+        'diagnostic_analysis': 0,
+        'summary': 0,
+        'exercise_bank': 0,
+        'diagnostic_set': 0,
+    },
+}
+
+# Rough per-entry bookkeeping cost added to the payload size
+_ENTRY_OVERHEAD = 256
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Unicode NFC and collapsed whitespace."""
+    text = unicodedata.normalize("NFC", prompt or "")
+    return " ".join(text.split())
+
+
+def prompt_key(prompt: str, *parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    digest.update(normalize_prompt(prompt).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _payload_size(value) -> int:
+    if isinstance(value, dict):
+        return len(str(value.get("reply", "")).encode("utf-8")) + len(repr(value.get("sources", "")))
+    return len(str(value).encode("utf-8"))
+
+
+def _unit(vec):
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return [x / norm for x in vec]
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "size", "action", "scope", "embedding")
+
+    def __init__(self, value, expires_at, size, action, scope, embedding):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+        self.action = action
+        self.scope = scope
+        self.embedding = embedding
+
+
+class ResponseCache:
+    """Size-bounded LRU with per-action TTL and an optional similarity tier."""
+
+    def __init__(self, config: dict = None, embed=None):
+        config = dict(DEFAULT_CONFIG, **(config or {}))
+        self.enabled = bool(config['ENABLED'])
+        self.max_bytes = int(config['MAX_BYTES'])
+        self.similarity_threshold = config['SIMILARITY_THRESHOLD']
+        self.action_ttls = dict(config['ACTION_TTLS'])
+        self.stale_seconds = float(config['STALE_SECONDS'])
+        self._embed = embed
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'semantic_hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'rejected': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+
+    # ------------------------------------------------------------------
+    # Rules
+    # ------------------------------------------------------------------
+
+    def ttl_for(self, action) -> int:
+        return int(self.action_ttls.get(action or 'chat') or 0)
+
+    def is_cacheable(self, action) -> bool:
+        return self.enabled and self.ttl_for(action) > 0
+
+    @staticmethod
+    def _contains_private_terms(reply: str, private_terms) -> bool:
+        folded = (reply or "").casefold()
+        return any(term and term.casefold() in folded for term in private_terms or ())
+
+    def _embedding_for(self, prompt: str):
+        if self.similarity_threshold is None or self._embed is None:
+            return None
+        try:
+            return _unit(self._embed(normalize_prompt(prompt)))
+        except Exception:
+            return None
+
+    # ------------------------------------------------------------------
+    # Lookup / store
+    # ------------------------------------------------------------------
+
+    def get(self, prompt: str, action=None, scope=""):
+        """Return the cached value for prompt, or None. ``scope`` separates call parameters."""
+        if not self.is_cacheable(action):
+            return None
+        key = prompt_key(prompt, action, scope)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry.value
+                if entry.expires_at + self.stale_seconds <= now:
+                    self._drop(key)
+                    self._stats['expirations'] += 1
+        value = self._get_similar(prompt, action, scope, now)
+        with self._lock:
+            self._stats['semantic_hits' if value is not None else 'misses'] += 1
+        return value
+
+    def get_stale(self, prompt: str, action=None, scope=""):
+        """Return a cached value even if expired (within STALE_SECONDS), or None.
+
+        Used as a degraded response when the LLM backend is unavailable.
+        """
+        if not self.is_cacheable(action):
+            return None
+        key = prompt_key(prompt, action, scope)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at + self.stale_seconds <= now:
+                return None
+            self._stats['stale_hits'] += 1
+            return entry.value
+
+    def _get_similar(self, prompt, action, scope, now):
+        query = self._embedding_for(prompt)
+        if query is None:
+            return None
+        best_key, best_score = None, self.similarity_threshold
+        with self._lock:
+            for key, entry in self._entries.items():
+                if entry.embedding is None or entry.action != action or entry.scope != scope:
+                    continue
+                if entry.expires_at <= now:
+                    continue
+                score = sum(a * b for a, b in zip(query, entry.embedding))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key].value
+
+    def set(self, prompt: str, value, action=None, scope="", private_terms=()) -> bool:
+        """Store value unless the action is not cacheable or the reply leaks a private term."""
+        if not self.is_cacheable(action):
+            return False
+        reply = value.get("reply", "") if isinstance(value, dict) else str(value)
+        if self._contains_private_terms(reply, private_terms):
+            with self._lock:
+                self._stats['rejected'] += 1
+            return False
+        size = _payload_size(value) + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return False
+        key = prompt_key(prompt, action, scope)
+        entry = _Entry(
+            value=value,
+            expires_at=time.monotonic() + self.ttl_for(action),
+            size=size,
+            action=action,
+            scope=scope,
+            embedding=self._embedding_for(prompt),
+        )
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = entry
+            self._size += size
+            self._stats['stores'] += 1
+            while self._size > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._stats['evictions'] += 1
+        return True
+
+    def _drop(self, key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['size_bytes'] = self._size
+        lookups = stats['hits'] + stats['semantic_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['hits'] + stats['semantic_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Process-wide cache configured from settings.LLM_RESPONSE_CACHE."""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                try:
+                    from django.conf import settings
+                    config = getattr(settings, 'LLM_RESPONSE_CACHE', None)
+                except Exception:
+                    config = None
+                from backend.embeddings import embed_text
+                _response_cache = ResponseCache(config, embed=embed_text)
+    return _response_cache
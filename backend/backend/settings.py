@@ -64,6 +64,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Static files serving (first)
+    'backend.tracing.TracingMiddleware',  # Per-stage timings (removed unless TRACING['ENABLED'])
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # CORS early
@@ -93,6 +94,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
 
 
 # ============================================================================
@@ -183,4 +185,192 @@ REST_FRAMEWORK = {
     )
 }
 
-CHROMA_DB_PATH = os.path.join(BASE_DIR, 'chroma_db')
\ No newline at end of file
+CHROMA_DB_PATH = os.path.join(BASE_DIR, 'chroma_db')
+
+# PDF corpus indexed by `manage.py index_documents`
+RAG_DOCUMENTS_PATH = os.getenv('RAG_DOCUMENTS_PATH', os.path.join(CHROMA_DB_PATH, 'documents_pedagogiques'))
+
+# ============================================================================
+# RAG / EMBEDDINGS
+# ============================================================================
+
+# Load the embedding model when each worker boots (wsgi.py / asgi.py)
+EMBEDDING_WARMUP = os.getenv('EMBEDDING_WARMUP', 'True').lower() == 'true'
+
+# GRASSS student memory layout (rag_grasss_service):
+# 'shared'   = two collections partitioned by user_id / matiere_key metadata
+# 'per_user' = legacy user_{id}_data / user_{id}_matter_{key} collections
+# Defaults to 'per_user' so existing memory stays readable: run
+# `manage.py migrate_rag_collections` first, then set 'shared'.
+RAG_MEMORY_STORAGE = os.getenv('RAG_MEMORY_STORAGE', 'per_user')
+
+# Corpus retrieval (backend.rag_service.retrieve): 'vector', 'lexical' (BM25)
+# or 'hybrid' (both, merged by reciprocal rank fusion). The BM25 index is
+# written by `manage.py index_documents`; without it retrieval stays vector-only.
+RAG_RETRIEVAL_MODE = os.getenv('RAG_RETRIEVAL_MODE', 'hybrid')
+# Candidates taken from each ranking before fusion in 'hybrid' mode
+RAG_HYBRID_CANDIDATES = int(os.getenv('RAG_HYBRID_CANDIDATES', '20'))
+# Prompt context budgets in tokens per action, for student memory and corpus
+# passages (backend.context_packing); entries override the defaults there.
+RAG_CONTEXT_BUDGETS = {
+    'tutor': {
+        'memory': int(os.getenv('RAG_TUTOR_MEMORY_TOKENS', '250')),
+        'corpus': int(os.getenv('RAG_TUTOR_CORPUS_TOKENS', '450')),
+    },
+}
+
+# In-process cache of Gemini replies (backend.response_cache).
+# ACTION_TTLS: seconds per action, 0 = never cached.
+LLM_RESPONSE_CACHE = {
+    'ENABLED': os.getenv('LLM_RESPONSE_CACHE_ENABLED', 'True').lower() == 'true',
+    'MAX_BYTES': int(os.getenv('LLM_RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+    'SIMILARITY_THRESHOLD': float(os.getenv('LLM_RESPONSE_CACHE_SIMILARITY')) if os.getenv('LLM_RESPONSE_CACHE_SIMILARITY') else None,
+    # Expired replies kept this long as degraded answers while Gemini is down
+    'STALE_SECONDS': int(os.getenv('LLM_RESPONSE_CACHE_STALE_SECONDS', str(24 * 3600))),
+    'ACTION_TTLS': {
+        'diagnostic': 24 * 3600,
+        'exercise': 15 * 60,
+        'remediation': 15 * 60,
+        'tutor': 5 * 60,
+        'chat': 3600,
+        'diagnostic_analysis': 0,
+        'summary': 0,
+        'exercise_bank': 0,
+        'diagnostic_set': 0,
+    },
+}
+
+# LLM provider (backend.llm): 'gemini' or 'stub' (canned replies, no network)
+LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'gemini')
+# Per-action generation deadlines in seconds, retries included
+LLM_DEADLINES = {
+    'tutor': float(os.getenv('LLM_DEADLINE_TUTOR', '20')),
+    'chat': 20.0,
+    'exercise': 30.0,
+    'remediation': 30.0,
+    'diagnostic': 45.0,
+    'diagnostic_analysis': 45.0,
+    'summary': 60.0,
+    'default': 30.0,
+}
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '2'))
+# Race a second request when one is slower than the action's observed p95
+LLM_HEDGE_ENABLED = os.getenv('LLM_HEDGE_ENABLED', 'False').lower() == 'true'
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', '1.0'))
+# Streams: first chunk within the action's deadline, then at most this gap between chunks
+LLM_STREAM_IDLE_TIMEOUT = float(os.getenv('LLM_STREAM_IDLE_TIMEOUT', '15'))
+# Simulated latency of the stub provider, in seconds
+LLM_STUB_LATENCY = float(os.getenv('LLM_STUB_LATENCY', '0'))
+
+# Concurrent identical prompts of cacheable actions share one Gemini call
+# (backend.singleflight); followers give up waiting after this many seconds.
+LLM_SINGLEFLIGHT_WAIT_SECONDS = float(os.getenv('LLM_SINGLEFLIGHT_WAIT_SECONDS', '60'))
+
+# Circuit breakers around Gemini and the local embedding model
+# (backend.circuit_breaker): open after FAILURE_THRESHOLD consecutive
+# failures, retry one call after COOLDOWN_SECONDS.
+CIRCUIT_BREAKER = {
+    'FAILURE_THRESHOLD': int(os.getenv('CIRCUIT_BREAKER_FAILURE_THRESHOLD', '3')),
+    'COOLDOWN_SECONDS': float(os.getenv('CIRCUIT_BREAKER_COOLDOWN_SECONDS', '30')),
+}
+
+# Diagnostic question sets (authentication.diagnostic_sets): variants served
+# in rotation per matiere x class level (`manage.py generate_diagnostic_sets`)
+DIAGNOSTIC_SET_VARIANTS = int(os.getenv('DIAGNOSTIC_SET_VARIANTS', '3'))
+
+# Pre-generated exercise bank (authentication.exercise_bank): a refill job is
+# queued when fewer than LOW_WATERMARK unseen exercises remain for a student.
+EXERCISE_BANK = {
+    'ENABLED': os.getenv('EXERCISE_BANK_ENABLED', 'True').lower() == 'true',
+    'LOW_WATERMARK': int(os.getenv('EXERCISE_BANK_LOW_WATERMARK', '5')),
+    'REFILL_SIZE': int(os.getenv('EXERCISE_BANK_REFILL_SIZE', '10')),
+    'REFILL_RETRY_SECONDS': 600,
+}
+
+# Server-side tutoring log (authentication.conversation): the tutor prompt
+# gets the rolling summary, the last RECENT_TURNS turns and every turn not yet
+# summarized (up to MAX_PROMPT_TURNS); the summary is rewritten in the
+# background every SUMMARY_EVERY new turns. RECENT_TURNS >= SUMMARY_EVERY.
+CONVERSATION_MEMORY = {
+    'RECENT_TURNS': int(os.getenv('CONVERSATION_RECENT_TURNS', '8')),
+    'SUMMARY_EVERY': int(os.getenv('CONVERSATION_SUMMARY_EVERY', '8')),
+    'MAX_PROMPT_TURNS': int(os.getenv('CONVERSATION_MAX_PROMPT_TURNS', '32')),
+    'MAX_TURN_CHARS': 800,
+    'SUMMARY_MAX_WORDS': 150,
+}
+
+# Background job queue (backend.jobs, workers: `manage.py run_jobs`).
+# EAGER runs jobs inline after the request commits (no worker needed).
+BACKGROUND_JOBS = {
+    'EAGER': os.getenv('BACKGROUND_JOBS_EAGER', 'False').lower() == 'true',
+    'MAX_ATTEMPTS': int(os.getenv('BACKGROUND_JOBS_MAX_ATTEMPTS', '5')),
+    'RETRY_BASE_SECONDS': 5,
+    'RETRY_MAX_SECONDS': 600,
+    'LEASE_SECONDS': 600,
+    'POLL_INTERVAL': float(os.getenv('BACKGROUND_JOBS_POLL_INTERVAL', '1.0')),
+}
+
+# LLM usage ledger and per-user daily quotas (backend.usage): every generation
+# is recorded (LLMUsageEvent + daily LLMUsageRollup, visible in the admin) and
+# a student past a quota gets HTTP 429 until midnight. 0 = unlimited.
+LLM_USAGE = {
+    'ENABLED': os.getenv('LLM_USAGE_ENABLED', 'True').lower() == 'true',
+    'QUOTAS_ENABLED': os.getenv('LLM_QUOTAS_ENABLED', 'True').lower() == 'true',
+    'DAILY_TOKENS': int(os.getenv('LLM_QUOTA_DAILY_TOKENS', '200000')),
+    'DAILY_CALLS': int(os.getenv('LLM_QUOTA_DAILY_CALLS', '300')),
+    'ACTION_DAILY_CALLS': {},
+    'EXEMPT_STAFF': True,
+    'EVENT_RETENTION_DAYS': int(os.getenv('LLM_USAGE_EVENT_RETENTION_DAYS', '30')),
+}
+
+# Per-student rate limits (backend.throttling): a token bucket per user and
+# action, "N/period" = bursts of N refilled at N per period. Unlisted actions
+# use 'default'. Buckets live in the default cache (per worker unless Redis).
+LLM_THROTTLE = {
+    'ENABLED': os.getenv('LLM_THROTTLE_ENABLED', 'True').lower() == 'true',
+    'RATES': {
+        'default': os.getenv('LLM_THROTTLE_RATE', '6/min'),
+        'tutor': os.getenv('LLM_THROTTLE_TUTOR_RATE', '10/min'),
+        'chat': os.getenv('LLM_THROTTLE_CHAT_RATE', '10/min'),
+        'exercise': '6/min',
+        'diagnostic': '3/min',
+        'remediation': '6/min',
+        'summary': '4/min',
+    },
+}
+
+# Global admission control in front of Gemini: at most MAX_CONCURRENT
+# generations per process, MAX_QUEUE more may wait up to MAX_WAIT_SECONDS;
+# beyond that requests are shed with HTTP 429 + Retry-After.
+LLM_ADMISSION = {
+    'ENABLED': os.getenv('LLM_ADMISSION_ENABLED', 'True').lower() == 'true',
+    'MAX_CONCURRENT': int(os.getenv('LLM_ADMISSION_MAX_CONCURRENT', '8')),
+    'MAX_QUEUE': int(os.getenv('LLM_ADMISSION_MAX_QUEUE', '16')),
+    'MAX_WAIT_SECONDS': float(os.getenv('LLM_ADMISSION_MAX_WAIT_SECONDS', '10')),
+}
+
+# Per-request stage timings (backend.tracing): Server-Timing header, one JSON
+# log line per request on the 'backend.tracing' logger and latency histograms.
+# Disabled, the middleware is not installed. /metrics serves the Prometheus
+# text format whether tracing is on or not, behind METRICS_TOKEN (without a
+# token it is only served when DEBUG is on).
+TRACING = {
+    'ENABLED': os.getenv('TRACING_ENABLED', 'False').lower() == 'true',
+    'SAMPLE_RATE': float(os.getenv('TRACING_SAMPLE_RATE', '1.0')),
+    'SERVER_TIMING': True,
+    'LOG': True,
+    'LOG_SLOW_MS': float(os.getenv('TRACING_LOG_SLOW_MS', '0')),
+    'METRICS_ENABLED': os.getenv('METRICS_ENABLED', 'True').lower() == 'true',
+    'METRICS_TOKEN': os.getenv('METRICS_TOKEN', ''),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'backend.tracing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -0,0 +1,99 @@
+"""
+Single-flight coalescing of identical in-flight calls.
+
+When a whole class starts the same exercise at once, dozens of identical
+prompts reach generate_response before the first reply lands in the response
+cache. SingleFlight lets the first caller for a key (the leader) run the
+upstream call while concurrent callers with the same key wait for its result
+instead of issuing their own request.
+
+Coalescing is per process: each gunicorn/uvicorn worker keeps its own table
+of in-flight keys, which already caps upstream calls per burst at one per
+worker.
+"""
+
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Run ``fn`` once per key among concurrent callers."""
+
+    def __init__(self, wait_timeout: float = None):
+        # A follower stops waiting after wait_timeout seconds and runs fn itself
+        self.wait_timeout = wait_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'leaders': 0, 'coalesced': 0, 'timeouts': 0}
+
+    def do(self, key, fn):
+        """Return fn() for the leader and the leader's result for followers.
+
+        An exception raised by the leader is re-raised in every follower.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self._stats['leaders'] += 1
+                leader = True
+            else:
+                call.waiters += 1
+                self._stats['coalesced'] += 1
+                leader = False
+
+        if not leader:
+            if not call.done.wait(self.wait_timeout):
+                with self._lock:
+                    self._stats['timeouts'] += 1
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._calls))
+
+
+_generation_flight = None
+_generation_flight_lock = threading.Lock()
+
+
+def get_generation_flight() -> SingleFlight:
+    """Process-wide single-flight group for LLM generations."""
+    global _generation_flight
+    if _generation_flight is None:
+        with _generation_flight_lock:
+            if _generation_flight is None:
+                try:
+                    from django.conf import settings
+                    wait_timeout = getattr(settings, 'LLM_SINGLEFLIGHT_WAIT_SECONDS', 60)
+                except Exception:
+                    wait_timeout = 60
+                _generation_flight = SingleFlight(wait_timeout=wait_timeout)
+    return _generation_flight
@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from backend.embedding_cache import EmbeddingCache, _DiskStore
+
+
+class DiskStoreTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_vectors_round_trip_across_instances(self):
+        _DiskStore(self.directory).put_many([("a", [1.0, 2.0]), ("b", [3.0, 4.0])])
+        store = _DiskStore(self.directory)
+        self.assertEqual(store.get("a"), [1.0, 2.0])
+        self.assertEqual(store.get("b"), [3.0, 4.0])
+        self.assertIsNone(store.get("missing"))
+
+    def test_rows_appended_by_another_instance_are_seen(self):
+        reader = _DiskStore(self.directory)
+        reader.put_many([("a", [1.0, 2.0])])
+        _DiskStore(self.directory).put_many([("b", [3.0, 4.0])])
+        self.assertEqual(reader.get("b"), [3.0, 4.0])
+
+    def test_known_keys_and_other_dimensions_are_skipped(self):
+        store = _DiskStore(self.directory)
+        store.put_many([("a", [1.0, 2.0])])
+        store.put_many([("a", [9.0, 9.0]), ("short", [1.0]), ("c", [5.0, 6.0])])
+        self.assertEqual(store.get("a"), [1.0, 2.0])
+        self.assertIsNone(store.get("short"))
+        self.assertEqual(store.get("c"), [5.0, 6.0])
+        self.assertEqual(os.path.getsize(store.vectors_path), 2 * 2 * 4)
+
+    def test_torn_append_is_truncated(self):
+        store = _DiskStore(self.directory)
+        store.put_many([("a", [1.0, 2.0])])
+        # A writer killed halfway through a row and an index line
+        with open(store.vectors_path, "ab") as f:
+            f.write(b"\x00\x01\x02")
+        with open(store.index_path, "a") as f:
+            f.write("dead")
+        store = _DiskStore(self.directory)
+        store.put_many([("b", [3.0, 4.0])])
+        self.assertEqual(_DiskStore(self.directory).get("b"), [3.0, 4.0])
+        with open(store.index_path) as f:
+            self.assertEqual([line.split("\t")[0] for line in f.read().splitlines()], ["a", "b"])
+
+
+class EmbeddingCacheTests(TestCase):
+    def test_disk_tier_survives_a_new_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        EmbeddingCache(cache_dir=directory).put_many("model", ["bonjour"], [[0.5, 0.25]])
+        cache = EmbeddingCache(cache_dir=directory)
+        self.assertEqual(cache.get("model", "bonjour"), [0.5, 0.25])
+        self.assertIsNone(cache.get("model", "autre"))
@@ -0,0 +1,107 @@
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from authentication.models import BackgroundJob
+from backend import jobs
+
+calls = []
+failures = []
+
+
+@jobs.job("tests.ok")
+def ok_job(value=None):
+    calls.append(value)
+
+
+@jobs.job("tests.boom", max_attempts=2, on_failure=lambda payload, error: failures.append((payload, str(error))))
+def boom_job(**payload):
+    raise RuntimeError("boom")
+
+
+@override_settings(BACKGROUND_JOBS={"EAGER": False, "LEASE_SECONDS": 60})
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+        failures.clear()
+
+    def enqueue(self, name, payload=None, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue(name, payload, **kwargs)
+
+    def test_claim_charges_the_attempt_and_locks_the_job(self):
+        self.enqueue("tests.ok", {"value": 1})
+        claimed = jobs.claim_next("worker-a")
+        self.assertEqual(claimed.status, BackgroundJob.STATUS_RUNNING)
+        self.assertEqual(claimed.attempts, 1)
+        self.assertEqual(claimed.locked_by, "worker-a")
+        self.assertIsNone(jobs.claim_next("worker-b"))
+
+    def test_run_pending_runs_and_marks_done(self):
+        self.enqueue("tests.ok", {"value": 1})
+        self.assertEqual(jobs.run_pending(), 1)
+        background_job = BackgroundJob.objects.get()
+        self.assertEqual(background_job.status, BackgroundJob.STATUS_DONE)
+        self.assertEqual(background_job.locked_by, "")
+        self.assertEqual(calls, [1])
+
+    def test_failure_is_retried_later_then_failed(self):
+        self.enqueue("tests.boom", {"n": 1})
+        self.assertFalse(jobs.run_job(jobs.claim_next("worker-a")))
+        background_job = BackgroundJob.objects.get()
+        self.assertEqual(background_job.status, BackgroundJob.STATUS_PENDING)
+        self.assertEqual(background_job.attempts, 1)
+        self.assertGreater(background_job.run_after, timezone.now())
+        self.assertIn("boom", background_job.last_error)
+        self.assertIsNone(jobs.claim_next("worker-a"))
+
+        BackgroundJob.objects.update(run_after=timezone.now())
+        jobs.run_job(jobs.claim_next("worker-a"))
+        background_job.refresh_from_db()
+        self.assertEqual(background_job.status, BackgroundJob.STATUS_FAILED)
+        self.assertEqual(background_job.attempts, 2)
+        self.assertEqual(failures, [({"n": 1}, "boom")])
+
+    def test_expired_lease_is_reclaimed(self):
+        self.enqueue("tests.ok", {"value": 2})
+        jobs.claim_next("dead-worker")
+        BackgroundJob.objects.update(locked_at=timezone.now() - timedelta(seconds=120))
+        claimed = jobs.claim_next("worker-b")
+        self.assertEqual(claimed.locked_by, "worker-b")
+        self.assertEqual(claimed.attempts, 2)
+
+    def test_expired_lease_on_last_attempt_fails(self):
+        self.enqueue("tests.boom", {"n": 2})
+        BackgroundJob.objects.update(attempts=1)
+        jobs.claim_next("dead-worker")
+        BackgroundJob.objects.update(locked_at=timezone.now() - timedelta(seconds=120))
+        self.assertIsNone(jobs.claim_next("worker-b"))
+        background_job = BackgroundJob.objects.get()
+        self.assertEqual(background_job.status, BackgroundJob.STATUS_FAILED)
+        self.assertEqual(len(failures), 1)
+
+    def test_outcome_of_a_lost_lease_is_not_recorded(self):
+        self.enqueue("tests.ok", {"value": 3})
+        stale = jobs.claim_next("slow-worker")
+        BackgroundJob.objects.update(locked_at=timezone.now() - timedelta(seconds=120))
+        jobs.claim_next("worker-b")
+        jobs.run_job(stale)
+        self.assertEqual(BackgroundJob.objects.get().locked_by, "worker-b")
+
+    def test_idempotency_key_enqueues_once(self):
+        self.enqueue("tests.ok", {"value": 4}, idempotency_key="same")
+        self.enqueue("tests.ok", {"value": 4}, idempotency_key="same")
+        self.assertEqual(BackgroundJob.objects.count(), 1)
+        jobs.run_pending()
+        self.enqueue("tests.ok", {"value": 4}, idempotency_key="same")
+        self.assertEqual(BackgroundJob.objects.get().status, BackgroundJob.STATUS_DONE)
+        self.assertEqual(calls, [4])
+
+    def test_failed_job_is_requeued_by_its_idempotency_key(self):
+        self.enqueue("tests.boom", {"n": 5}, idempotency_key="retry-me")
+        BackgroundJob.objects.update(status=BackgroundJob.STATUS_FAILED, attempts=2)
+        self.enqueue("tests.boom", {"n": 5}, idempotency_key="retry-me")
+        background_job = BackgroundJob.objects.get()
+        self.assertEqual(background_job.status, BackgroundJob.STATUS_PENDING)
+        self.assertEqual(background_job.attempts, 0)
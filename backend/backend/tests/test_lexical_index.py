@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from backend.lexical_index import LexicalIndex, load_or_create, reciprocal_rank_fusion, tokenize
+
+
+class FakeCollection:
+    """The slice of a Chroma collection read by build_from_collection."""
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def get(self, include=None, limit=None, offset=0):
+        ids = list(self.documents)[offset:offset + limit]
+        return {"ids": ids, "documents": [self.documents[doc_id] for doc_id in ids]}
+
+
+class BM25Tests(TestCase):
+    def setUp(self):
+        self.index = LexicalIndex()
+        self.index.add(
+            ["thales", "pythagore", "fractions"],
+            [
+                "Le théorème de Thalès relie des longueurs proportionnelles.",
+                "Le théorème de Pythagore : dans un triangle rectangle, a² + b² = c².",
+                "Additionner des fractions : mettre au même dénominateur.",
+            ],
+        )
+
+    def test_tokenize_folds_accents_and_case(self):
+        self.assertEqual(tokenize("Théorème"), tokenize("theoreme"))
+
+    def test_rare_term_ranks_its_document_first(self):
+        results = self.index.search("triangle rectangle Pythagore")
+        self.assertEqual(results[0][0], "pythagore")
+        self.assertEqual([doc_id for doc_id, _ in results], ["pythagore"])
+
+    def test_common_term_scores_below_rare_term(self):
+        scores = dict(self.index.search("théorème Thalès"))
+        self.assertGreater(scores["thales"], scores["pythagore"])
+
+    def test_readding_an_id_replaces_its_document(self):
+        self.index.add(["thales"], ["Les vecteurs du plan."])
+        self.assertEqual(len(self.index), 3)
+        self.assertNotIn("thales", dict(self.index.search("Thalès")))
+        self.assertEqual(self.index.search("vecteurs")[0][0], "thales")
+
+    def test_removed_documents_are_not_returned(self):
+        self.index.remove(["fractions"])
+        self.assertEqual(self.index.search("fractions dénominateur"), [])
+
+    def test_save_and_load_keep_the_scores(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "index.json")
+        self.index.save(path)
+        self.assertEqual(LexicalIndex.load(path).search("théorème"), self.index.search("théorème"))
+
+    def test_unreadable_file_is_rebuilt_from_the_collection(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "index.json")
+        with open(path, "w") as f:
+            f.write("{truncated")
+        index = load_or_create(path, FakeCollection({"a": "Théorème de Thalès", "b": "Fractions"}))
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.search("Thalès")[0][0], "a")
+
+
+class ReciprocalRankFusionTests(TestCase):
+    def test_documents_ranked_by_both_lists_come_first(self):
+        fused = reciprocal_rank_fusion(["a", "b", "c"], ["c", "a", "d"])
+        self.assertEqual(fused[0], "a")
+        self.assertEqual(set(fused), {"a", "b", "c", "d"})
+
+    def test_scores_follow_the_rrf_formula(self):
+        # a: 1/(k+1) + 1/(k+3), c: 1/(k+3) + 1/(k+1) -> tie broken by first appearance
+        self.assertEqual(reciprocal_rank_fusion(["a", "b", "c"], ["c", "b", "a"], k=60)[:2], ["a", "c"])
+        self.assertEqual(reciprocal_rank_fusion(["a", "b"], ["b"], k=1), ["b", "a"])
+
+    def test_single_ranking_is_unchanged(self):
+        self.assertEqual(reciprocal_rank_fusion(["x", "y", "z"]), ["x", "y", "z"])
@@ -0,0 +1,87 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+
+from backend.throttling import AdmissionController, Overloaded, parse_rate, take_token
+
+
+@override_settings(LLM_THROTTLE={"ENABLED": True, "RATES": {"default": "6/min", "tutor": "2/min"}})
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate("10/min"), (10, 10 / 60))
+        with self.assertRaises(ValueError):
+            parse_rate("0/min")
+        with self.assertRaises(ValueError):
+            parse_rate("5/fortnight")
+
+    def test_burst_up_to_capacity_then_wait(self):
+        now = 1000.0
+        self.assertIsNone(take_token(1, "tutor", now=now))
+        self.assertIsNone(take_token(1, "tutor", now=now))
+        wait = take_token(1, "tutor", now=now)
+        self.assertAlmostEqual(wait, 30.0)
+
+    def test_tokens_refill_over_time(self):
+        now = 1000.0
+        take_token(1, "tutor", now=now)
+        take_token(1, "tutor", now=now)
+        self.assertIsNotNone(take_token(1, "tutor", now=now + 10))
+        self.assertIsNone(take_token(1, "tutor", now=now + 31))
+
+    def test_buckets_are_per_user_and_action(self):
+        now = 1000.0
+        take_token(1, "tutor", now=now)
+        take_token(1, "tutor", now=now)
+        self.assertIsNone(take_token(2, "tutor", now=now))
+        # Unknown actions share the default bucket
+        self.assertIsNone(take_token(1, "exercise", now=now))
+
+    @override_settings(LLM_THROTTLE={"ENABLED": False})
+    def test_disabled(self):
+        for _ in range(10):
+            self.assertIsNone(take_token(1, "tutor"))
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    def test_sheds_when_the_queue_is_full(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=0, max_wait=1)
+        with controller.slot():
+            with self.assertRaises(Overloaded) as raised:
+                controller.acquire()
+        self.assertGreaterEqual(raised.exception.wait, 1)
+        self.assertEqual(controller.metrics()["shed_queue_full"], 1)
+        self.assertEqual(controller.metrics()["active"], 0)
+
+    def test_sheds_after_max_wait(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=1, max_wait=0.05)
+        held = controller.acquire()
+        with self.assertRaises(Overloaded):
+            controller.acquire()
+        held.release()
+        self.assertEqual(controller.metrics()["shed_timeout"], 1)
+
+    def test_queued_request_gets_the_released_slot(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=1, max_wait=5)
+        held = controller.acquire()
+        admitted = []
+        waiter = threading.Thread(target=lambda: admitted.append(controller.acquire()))
+        waiter.start()
+        while not controller.metrics()["waiting"]:
+            time.sleep(0.01)
+        held.release()
+        waiter.join(5)
+        self.assertEqual(len(admitted), 1)
+        self.assertEqual(controller.metrics()["active"], 1)
+        self.assertEqual(controller.metrics()["queued"], 1)
+
+    def test_release_is_idempotent(self):
+        controller = AdmissionController(max_concurrent=2, max_queue=0)
+        slot = controller.acquire()
+        slot.release()
+        slot.release()
+        self.assertEqual(controller.metrics()["active"], 0)
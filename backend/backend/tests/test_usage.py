@@ -0,0 +1,48 @@
+from django.test import TestCase, override_settings
+
+from authentication.models import LLMUsageEvent, LLMUsageRollup, User
+from backend.llm import ReplyText
+from backend.usage import QuotaExceeded, UsageContext, check_quota, daily_usage, record_call
+
+
+class UsageRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="eleve", password=None, role=User.IS_STUDENT)
+        self.context = UsageContext(self.user)
+
+    def test_calls_of_a_day_are_rolled_up(self):
+        record_call("tutor", "stub", "prompt", "reply", 0.2, self.context, prompt_tokens=10, reply_tokens=5)
+        record_call("tutor", "stub", "prompt", "", 0.3, self.context, requests=3, prompt_tokens=10, reply_tokens=0)
+        rollup = LLMUsageRollup.objects.get()
+        self.assertEqual((rollup.calls, rollup.failures), (2, 1))
+        self.assertEqual((rollup.prompt_tokens, rollup.reply_tokens), (20, 5))
+        self.assertEqual(rollup.latency_ms, 500)
+        self.assertEqual(rollup.upstream_requests, 4)
+        self.assertEqual(LLMUsageEvent.objects.count(), 2)
+
+    def test_rollups_are_keyed_by_action_model_and_scope(self):
+        record_call("tutor", "stub", "p", "r", 0.1, self.context)
+        record_call("exercise", "stub", "p", "r", 0.1, self.context)
+        record_call("tutor", "gemini:flash", "p", "r", 0.1, self.context)
+        record_call("tutor", "stub", "p", "r", 0.1, None)
+        record_call("tutor", "stub", "p", "r", 0.1, None)
+        self.assertEqual(LLMUsageRollup.objects.count(), 4)
+        self.assertEqual(LLMUsageRollup.objects.get(user=None).calls, 2)
+        self.assertEqual(daily_usage(self.user.pk)["by_action"], {"tutor": 2, "exercise": 1})
+
+    def test_reported_tokens_win_over_the_estimate(self):
+        reply = ReplyText("Bonjour")
+        reply.prompt_tokens, reply.reply_tokens = 120, 3
+        record_call("chat", "gemini:flash", "prompt", reply, 0.1, self.context)
+        event = LLMUsageEvent.objects.get()
+        self.assertEqual((event.prompt_tokens, event.reply_tokens), (120, 3))
+
+    @override_settings(LLM_USAGE={"DAILY_CALLS": 2, "DAILY_TOKENS": 0})
+    def test_quota_is_enforced_from_the_rollup(self):
+        check_quota("tutor", self.context)
+        record_call("tutor", "stub", "p", "r", 0.1, self.context)
+        record_call("tutor", "stub", "p", "r", 0.1, self.context)
+        with self.assertRaises(QuotaExceeded):
+            check_quota("tutor", self.context)
+        # Background jobs are never refused
+        check_quota("tutor", UsageContext(self.user, enforce_quota=False))
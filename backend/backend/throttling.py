@@ -0,0 +1,281 @@
+"""
+Rate limiting and admission control for the LLM endpoints.
+
+Two layers, both answering HTTP 429 with Retry-After (DRF Throttled):
+
+- LLMRateThrottle: a token bucket per (user, action). Each bucket holds up
+  to N tokens and refills continuously at N per period (LLM_THROTTLE
+  RATES, "N/period"), so a student gets short bursts but not a sustained
+  flood. Buckets live in the Django cache, like DRF's own throttles:
+  per worker with the default local-memory cache, shared with Redis or
+  Memcached.
+
+- AdmissionController: a cap on concurrent upstream generations per
+  process (LLM_ADMISSION MAX_CONCURRENT) with a bounded wait queue. A
+  request waits at most MAX_WAIT_SECONDS for a slot; when the queue is
+  full or the wait expires, it is shed at once (Overloaded) instead of
+  piling up behind a saturated Gemini. Retry-After is estimated from
+  the recent slot hold time. Cache hits and single-flight followers never
+  take a slot.
+
+There is no school model in this tree, so limits apply per student and
+globally (per worker process).
+"""
+
+import math
+import threading
+import time
+
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+
+DEFAULT_THROTTLE_CONFIG = {
+    'ENABLED': True,
+    'RATES': {
+        'default': '6/min',
+    },
+}
+
+DEFAULT_ADMISSION_CONFIG = {
+    'ENABLED': True,
+    'MAX_CONCURRENT': 8,     # upstream generations at once per process
+    'MAX_QUEUE': 16,         # requests allowed to wait for a slot
+    'MAX_WAIT_SECONDS': 10.0,
+}
+
+_PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+
+def _config(name, defaults):
+    config = dict(defaults)
+    try:
+        from django.conf import settings
+        config.update(getattr(settings, name, {}) or {})
+    except Exception:
+        pass
+    return config
+
+
+def parse_rate(rate: str):
+    """'10/min' -> (capacity 10, refill 10/60 tokens per second)."""
+    count, _, period = rate.partition('/')
+    count = int(count)
+    seconds = _PERIODS.get(period.strip().lower())
+    if count <= 0 or seconds is None:
+        raise ValueError(f"Invalid rate: {rate!r}")
+    return count, count / seconds
+
+
+# ============================================================================
+# TOKEN BUCKETS
+# ============================================================================
+
+class RateLimited(Throttled):
+    default_detail = "Trop de demandes au tuteur."
+    extra_detail_singular = "Réessayez dans {wait} seconde."
+    extra_detail_plural = "Réessayez dans {wait} secondes."
+
+
+_bucket_lock = threading.Lock()
+
+
+def take_token(user_id, action: str, now: float = None):
+    """Spend one token of the (user, action) bucket.
+
+    Return None when allowed, else the seconds until a token is available.
+    """
+    config = _config('LLM_THROTTLE', DEFAULT_THROTTLE_CONFIG)
+    if not config['ENABLED']:
+        return None
+    rates = config['RATES']
+    key_action = action if action in rates else 'default'
+    capacity, refill = parse_rate(rates.get(key_action) or DEFAULT_THROTTLE_CONFIG['RATES']['default'])
+
+    from django.core.cache import cache
+
+    key = f"llm_throttle:{user_id}:{key_action}"
+    now = time.time() if now is None else now
+    # Atomic within a process; across processes a shared cache may let a
+    # concurrent request through, as with DRF's SimpleRateThrottle
+    with _bucket_lock:
+        tokens, updated = cache.get(key) or (float(capacity), now)
+        tokens = min(float(capacity), tokens + (now - updated) * refill)
+        if tokens < 1.0:
+            cache.set(key, (tokens, now), timeout=int(capacity / refill) + 1)
+            return (1.0 - tokens) / refill
+        cache.set(key, (tokens - 1.0, now), timeout=int(capacity / refill) + 1)
+    return None
+
+
+class LLMRateThrottle(BaseThrottle):
+    """DRF throttle: one token per LLM request, bucket keyed by user and action.
+
+    The action is the class's ``action`` (subclasses for single-action
+    endpoints) or the request's "action" field (TutorChatView).
+    """
+
+    action = None
+
+    def allow_request(self, request, view):
+        user = request.user
+        if not user or not user.is_authenticated:
+            return True
+        data = request.data if isinstance(request.data, dict) else {}
+        action = self.action or data.get('action') or 'tutor'
+        wait = take_token(user.pk, str(action))
+        if wait is not None:
+            # Raised here rather than through APIView.throttled() for the French detail
+            raise RateLimited(wait=wait)
+        return True
+
+
+class ChatRateThrottle(LLMRateThrottle):
+    action = 'chat'
+
+
+# ============================================================================
+# ADMISSION CONTROL
+# ============================================================================
+
+class Overloaded(Throttled):
+    default_detail = "Le tuteur est très sollicité en ce moment."
+    extra_detail_singular = "Réessayez dans {wait} seconde."
+    extra_detail_plural = "Réessayez dans {wait} secondes."
+
+
+class _Slot:
+    """Held slot; release() is idempotent."""
+
+    __slots__ = ("_controller", "_acquired_at", "_released")
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._acquired_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(time.monotonic() - self._acquired_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class AdmissionController:
+    """Counting semaphore with a bounded, time-limited wait queue."""
+
+    def __init__(self, max_concurrent=8, max_queue=16, max_wait=10.0):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self.max_wait = float(max_wait)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        # Smoothed slot hold time, for Retry-After
+        self._hold_seconds = 1.0
+        self._stats = {'admitted': 0, 'queued': 0, 'shed_queue_full': 0, 'shed_timeout': 0}
+
+    def retry_after(self) -> int:
+        """Rough time for the queue ahead to drain, in whole seconds."""
+        with self._cond:
+            return self._retry_after()
+
+    def _retry_after(self):
+        return max(1, math.ceil(self._hold_seconds * (self._waiting + 1) / self.max_concurrent))
+
+    def acquire(self) -> _Slot:
+        """Take a slot, waiting up to max_wait in the queue; raise Overloaded otherwise."""
+        with self._cond:
+            if self._active < self.max_concurrent and not self._waiting:
+                return self._admit()
+            if self._waiting >= self.max_queue:
+                self._stats['shed_queue_full'] += 1
+                raise Overloaded(wait=self._retry_after())
+            self._waiting += 1
+            self._stats['queued'] += 1
+            deadline = time.monotonic() + self.max_wait
+            try:
+                while self._active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        if self._active < self.max_concurrent:
+                            break
+                        self._stats['shed_timeout'] += 1
+                        raise Overloaded(wait=self._retry_after())
+            finally:
+                self._waiting -= 1
+            return self._admit()
+
+    def _admit(self):
+        self._active += 1
+        self._stats['admitted'] += 1
+        return _Slot(self)
+
+    def _release(self, held):
+        with self._cond:
+            self._active -= 1
+            self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * held
+            self._cond.notify()
+
+    def slot(self) -> _Slot:
+        """``with controller.slot(): ...``"""
+        return self.acquire()
+
+    def metrics(self) -> dict:
+        with self._cond:
+            return dict(
+                self._stats,
+                active=self._active,
+                waiting=self._waiting,
+                max_concurrent=self.max_concurrent,
+                max_queue=self.max_queue,
+            )
+
+
+class _Unlimited:
+    """Stand-in when admission control is disabled."""
+
+    def acquire(self):
+        return _Slot(self)
+
+    slot = acquire
+
+    def _release(self, held):
+        pass
+
+    def metrics(self):
+        return {}
+
+
+_admission = None
+_admission_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """Process-wide controller configured from settings.LLM_ADMISSION."""
+    global _admission
+    if _admission is None:
+        with _admission_lock:
+            if _admission is None:
+                config = _config('LLM_ADMISSION', DEFAULT_ADMISSION_CONFIG)
+                if not config['ENABLED']:
+                    _admission = _Unlimited()
+                else:
+                    _admission = AdmissionController(
+                        max_concurrent=config['MAX_CONCURRENT'],
+                        max_queue=config['MAX_QUEUE'],
+                        max_wait=config['MAX_WAIT_SECONDS'],
+                    )
+    return _admission
+
+
+def reset_admission_controller():
+    """Forget the controller so the next request reads LLM_ADMISSION again (tests, benchmarks)."""
+    global _admission
+    with _admission_lock:
+        _admission = None
@@ -0,0 +1,493 @@
+"""
+Per-request stage timing and Prometheus metrics.
+
+A trace is opened by TracingMiddleware for each request and kept in a
+context variable; code on the request path wraps its stages in spans:
+
+    with span("search.vector", n=5) as s:
+        results = collection.query(...)
+        s.set(hits=len(results["ids"][0]))
+
+Spans nest (``prompt`` includes ``retrieve``, which includes ``embed`` and
+``search.*``). When the request ends, the trace is exposed three ways:
+
+- a ``Server-Timing`` response header (total per span name, plus SQL time);
+- one structured JSON log line on the ``backend.tracing`` logger;
+- the ``rag_stage_duration_seconds`` and ``http_request_duration_seconds``
+  histograms served at ``/metrics`` in the Prometheus text format, next to
+  the counters of the response cache, single-flight, LLM provider,
+  admission control and circuit breakers.
+
+With TRACING['ENABLED'] off the middleware removes itself (MiddlewareNotUsed)
+and span() returns a shared no-op object: the cost is one context-variable
+lookup per span. /metrics is independent of tracing. Metrics are
+per-process, like the stats they are read from: scrape every worker.
+"""
+
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+logger = logging.getLogger("backend.tracing")
+
+DEFAULT_CONFIG = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 1.0,          # share of requests traced
+    'SERVER_TIMING': True,
+    'LOG': True,
+    'LOG_SLOW_MS': 0,            # only log requests slower than this (0 = all)
+    'EXCLUDE_PATHS': ('/metrics', '/static/'),
+    'METRICS_ENABLED': True,
+    'METRICS_TOKEN': '',         # /metrics requires "Authorization: Bearer <token>"; unset, it is served only with DEBUG
+}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def get_config() -> dict:
+    config = dict(DEFAULT_CONFIG)
+    try:
+        from django.conf import settings
+        config.update(getattr(settings, 'TRACING', {}) or {})
+    except Exception:
+        pass
+    return config
+
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, tuple(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(state) for key, state in self._values.items()}
+        for key, state in sorted(values.items()):
+            labels = tuple(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + (("le", _number(bound)),), cumulative
+            yield f"{self.name}_sum", labels, round(state[-1], 6)
+            yield f"{self.name}_count", labels, cumulative
+
+
+_metrics = []
+_collectors = []
+
+
+def register(metric):
+    _metrics.append(metric)
+    return metric
+
+
+def register_collector(collect):
+    """collect() returns [(name, kind, help, [(labels dict, value)])], read at scrape time."""
+    _collectors.append(collect)
+    return collect
+
+
+REQUEST_SECONDS = register(Histogram(
+    "http_request_duration_seconds", "Traced request duration.", ("route", "method", "status", "action"),
+))
+STAGE_SECONDS = register(Histogram(
+    "rag_stage_duration_seconds", "Duration of the traced stages of the RAG pipeline.", ("stage",),
+))
+LLM_TOKENS = register(Counter(
+    "llm_tokens_total", "Approximate prompt and reply tokens of traced generations.", ("action", "kind"),
+))
+
+
+def _events(stats, keys):
+    return [({"event": key}, stats.get(key, 0)) for key in keys]
+
+
+@register_collector
+def _collect_response_cache():
+    from backend.response_cache import get_response_cache
+    stats = get_response_cache().metrics()
+    return [
+        ("llm_response_cache_events_total", "counter", "Response cache lookups and writes by outcome.",
+         _events(stats, ('hits', 'semantic_hits', 'stale_hits', 'misses', 'stores', 'rejected', 'evictions', 'expirations'))),
+        ("llm_response_cache_entries", "gauge", "Replies held by the response cache.", [({}, stats['entries'])]),
+        ("llm_response_cache_size_bytes", "gauge", "Estimated size of the response cache.", [({}, stats['size_bytes'])]),
+    ]
+
+
+@register_collector
+def _collect_singleflight():
+    from backend.singleflight import get_generation_flight
+    stats = get_generation_flight().metrics()
+    return [
+        ("llm_singleflight_events_total", "counter", "Generations led, coalesced or abandoned by followers.",
+         _events(stats, ('leaders', 'coalesced', 'timeouts'))),
+        ("llm_singleflight_in_flight", "gauge", "Generations currently shared.", [({}, stats['in_flight'])]),
+    ]
+
+
+@register_collector
+def _collect_llm_provider():
+    from backend.llm import get_llm_provider
+    stats = get_llm_provider().metrics()
+    provider = stats.pop('provider')
+    return [
+        ("llm_provider_events_total", "counter", "Upstream generation calls by outcome.",
+         [({"provider": provider, "event": key}, value) for key, value in sorted(stats.items())]),
+    ]
+
+
+@register_collector
+def _collect_admission():
+    from backend.throttling import get_admission_controller
+    stats = get_admission_controller().metrics()
+    if not stats:
+        return []
+    return [
+        ("llm_admission_events_total", "counter", "Requests admitted, queued or shed by the global concurrency limit.",
+         _events(stats, ('admitted', 'queued', 'shed_queue_full', 'shed_timeout'))),
+        ("llm_admission_active", "gauge", "Upstream generations holding a slot.", [({}, stats['active'])]),
+        ("llm_admission_waiting", "gauge", "Requests waiting for a slot.", [({}, stats['waiting'])]),
+    ]
+
+
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+@register_collector
+def _collect_breakers():
+    from backend.circuit_breaker import all_breakers
+    events = []
+    states = []
+    failures = []
+    for name, breaker in sorted(all_breakers().items()):
+        stats = breaker.metrics()
+        events += [({"breaker": name, "event": key}, stats[key]) for key in ('successes', 'failures', 'rejected', 'opened')]
+        states.append(({"breaker": name}, BREAKER_STATES.get(stats['state'], -1)))
+        failures.append(({"breaker": name}, stats['consecutive_failures']))
+    return [
+        ("circuit_breaker_events_total", "counter", "Calls seen by each circuit breaker by outcome.", events),
+        ("circuit_breaker_state", "gauge", "0 = closed, 1 = half open, 2 = open.", states),
+        ("circuit_breaker_consecutive_failures", "gauge", "Failures since the last success.", failures),
+    ]
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name}{_labels(labels)} {_number(value)}" for name, labels, value in metric.samples())
+    for collect in _collectors:
+        try:
+            families = collect()
+        except Exception as e:
+            logger.warning("Metrics collector %s failed: %s", collect.__name__, e)
+            continue
+        for name, kind, help_text, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{_labels(sorted(labels.items()))} {_number(value)}" for labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """GET /metrics (Prometheus scrape endpoint).
+
+    Without METRICS_TOKEN the endpoint only exists with DEBUG on: the
+    counters expose cache, breaker and capacity internals.
+    """
+    from django.conf import settings
+    from django.http import Http404, HttpResponse
+
+    config = get_config()
+    token = config['METRICS_TOKEN']
+    if not config['METRICS_ENABLED'] or not (token or settings.DEBUG):
+        raise Http404()
+    if token:
+        supplied = request.META.get('HTTP_AUTHORIZATION', '')
+        if not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+            return HttpResponse("Unauthorized\n", status=401, content_type="text/plain")
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# ============================================================================
+# SPANS
+# ============================================================================
+
+_current = ContextVar("backend_trace", default=None)
+
+
+class Trace:
+    """Spans and attributes of one request."""
+
+    __slots__ = ("spans", "attrs", "started", "db_queries", "db_seconds")
+
+    def __init__(self):
+        self.spans = []
+        self.attrs = {}
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+
+    def record_query(self, execute, sql, params, many, context):
+        """connection.execute_wrapper hook: count SQL queries and their time."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_queries += 1
+            self.db_seconds += time.perf_counter() - started
+
+
+class Span:
+    __slots__ = ("trace", "name", "attrs", "start", "duration")
+
+    recording = True
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.start = 0.0
+        self.duration = 0.0
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.trace.spans.append(self)
+        STAGE_SECONDS.observe(self.duration, stage=self.name)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    recording = False
+
+    def set(self, **attrs) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attrs):
+    """Context manager timing one stage of the current trace (no-op outside one)."""
+    trace = _current.get()
+    if trace is None:
+        return _NOOP_SPAN
+    return Span(trace, name, attrs)
+
+
+def annotate(**attrs) -> None:
+    """Attach attributes (action, cache outcome...) to the current request's trace."""
+    trace = _current.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+def count_tokens(action, prompt_tokens, reply_tokens) -> None:
+    LLM_TOKENS.inc(prompt_tokens, action=action or "chat", kind="prompt")
+    LLM_TOKENS.inc(reply_tokens, action=action or "chat", kind="reply")
+
+
+# ============================================================================
+# MIDDLEWARE
+# ============================================================================
+
+def server_timing(trace, total) -> str:
+    """Server-Timing value: one entry per span name (durations summed), SQL and total."""
+    totals = {}
+    for item in trace.spans:
+        totals[item.name] = totals.get(item.name, 0.0) + item.duration
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items()]
+    if trace.db_queries:
+        entries.append(f'db;dur={trace.db_seconds * 1000:.1f};desc="{trace.db_queries} queries"')
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+class TracingMiddleware:
+    """Open a trace per request and report it (header, log line, histograms)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+        from django.core.exceptions import MiddlewareNotUsed
+
+        self.config = get_config()
+        if not self.config['ENABLED']:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def _should_trace(self, request) -> bool:
+        if request.path.startswith(tuple(self.config['EXCLUDE_PATHS'])):
+            return False
+        rate = float(self.config['SAMPLE_RATE'])
+        return rate >= 1.0 or random.random() < rate
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self._should_trace(request):
+            return self.get_response(request)
+        from django.db import connection
+
+        trace = Trace()
+        token = _current.set(trace)
+        try:
+            with connection.execute_wrapper(trace.record_query):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(trace, request, response)
+        return response
+
+    async def __acall__(self, request):
+        if not self._should_trace(request):
+            return await self.get_response(request)
+        # SQL runs in other threads here: only the spans are recorded
+        trace = Trace()
+        token = _current.set(trace)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        # A streamed body is produced later: its stages are not in this trace
+        self._finish(trace, request, response)
+        return response
+
+    @staticmethod
+    def _user_id(request):
+        """Id of the request's user if it is already loaded, else None.
+
+        Never triggers the lazy lookup (a query): on the ASGI path _finish
+        runs on the event loop, where the ORM raises SynchronousOnlyOperation.
+        DRF replaces request.user with the authenticated user; async views
+        that authenticate themselves annotate(user_id=...).
+        """
+        from django.utils.functional import LazyObject, empty
+
+        user = getattr(request, "user", None)
+        if isinstance(user, LazyObject):
+            if user._wrapped is empty:
+                return None
+            user = user._wrapped
+        return user.pk if user is not None and user.is_authenticated else None
+
+    def _finish(self, trace, request, response):
+        total = time.perf_counter() - trace.started
+        match = getattr(request, "resolver_match", None)
+        route = match.route if match is not None else "unmatched"
+        action = trace.attrs.get("action", "")
+        REQUEST_SECONDS.observe(total, route=route, method=request.method, status=response.status_code, action=action)
+
+        if self.config['SERVER_TIMING']:
+            response["Server-Timing"] = server_timing(trace, total)
+        if self.config['LOG'] and total * 1000 >= float(self.config['LOG_SLOW_MS']):
+            record = {
+                "event": "request",
+                "method": request.method,
+                "route": route,
+                "status": response.status_code,
+                "duration_ms": round(total * 1000, 1),
+                "user_id": self._user_id(request),
+                "db_queries": trace.db_queries,
+                "db_ms": round(trace.db_seconds * 1000, 1),
+                **trace.attrs,
+                "spans": [
+                    dict(item.attrs, name=item.name, ms=round(item.duration * 1000, 1))
+                    for item in trace.spans
+                ],
+            }
+            logger.info(json.dumps(record, ensure_ascii=False, default=str))
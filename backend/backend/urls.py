@@ -17,11 +17,14 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from backend.tracing import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/auth/', include('authentication.urls')),
     path('api/courses/', include('courses.urls')),
     path('api-auth/', include('rest_framework.urls')), 
+    path('metrics', metrics_view, name='metrics'),
 
 ]
 
@@ -0,0 +1,250 @@
+"""
+LLM usage ledger and per-user daily quotas.
+
+Every upstream generation (rag_service._generate_text and the streaming
+path) is recorded as an LLMUsageEvent (action, model, prompt/reply tokens,
+latency, outcome) and added to a daily LLMUsageRollup row per user,
+UserMatter, action and model. Cache hits and calls skipped by an open
+circuit breaker cost nothing and are not recorded.
+
+Who is calling is set by the views with ``usage_context(user, user_matter)``
+(a context variable, so nothing has to be threaded through rag_service).
+Before a generation, check_quota() compares today's rollups of that user
+against LLM_USAGE quotas and raises QuotaExceeded (HTTP 429 with
+Retry-After, a DRF Throttled) when one is spent. Background jobs record
+usage under the student they work for but are never refused.
+
+Token counts are the ones Gemini reports (usage_metadata, carried by
+llm.ReplyText); when a provider reports none they are estimated with
+chunking.approximate_token_count. They are counted once per generation;
+upstream_requests counts the requests actually billed (retries and hedged
+duplicates included), so billed tokens are roughly tokens x upstream_requests
+/ calls. Quotas only look at generations.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, time as dt_time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+
+from backend.chunking import approximate_token_count
+
+DEFAULT_CONFIG = {
+    'ENABLED': True,              # record events and rollups
+    'QUOTAS_ENABLED': True,
+    'DAILY_TOKENS': 200_000,      # prompt + reply tokens per user and day (0 = unlimited)
+    'DAILY_CALLS': 300,           # generations per user and day (0 = unlimited)
+    'ACTION_DAILY_CALLS': {},     # e.g. {'exercise': 60}: generations per user, action and day
+    'EXEMPT_STAFF': True,
+    'EVENT_RETENTION_DAYS': 30,   # events older than this are pruned (`manage.py usage_report --prune`)
+}
+
+
+def get_config() -> dict:
+    config = dict(DEFAULT_CONFIG)
+    try:
+        from django.conf import settings
+        config.update(getattr(settings, 'LLM_USAGE', {}) or {})
+    except Exception:
+        pass
+    return config
+
+
+class QuotaExceeded(Throttled):
+    default_detail = "Quota quotidien d'utilisation du tuteur atteint."
+    extra_detail_singular = "Réessayez dans {wait} seconde."
+    extra_detail_plural = "Réessayez dans {wait} secondes."
+
+
+# ============================================================================
+# CALLER CONTEXT
+# ============================================================================
+
+class UsageContext:
+    __slots__ = ("user_id", "user_matter_id", "exempt", "enforce_quota")
+
+    def __init__(self, user=None, user_matter=None, enforce_quota=True):
+        self.user_id = user.pk if user is not None else None
+        self.user_matter_id = user_matter.pk if user_matter is not None else None
+        self.exempt = bool(user is not None and user.is_staff and get_config()['EXEMPT_STAFF'])
+        self.enforce_quota = enforce_quota
+
+
+_current = ContextVar("llm_usage", default=None)
+
+
+@contextmanager
+def usage_context(user=None, user_matter=None, enforce_quota=True):
+    """Attribute the generations made inside the block to user / user_matter."""
+    token = _current.set(UsageContext(user, user_matter, enforce_quota))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def current_context():
+    return _current.get()
+
+
+# ============================================================================
+# QUOTAS
+# ============================================================================
+
+def seconds_until_tomorrow() -> int:
+    now = timezone.localtime()
+    midnight = timezone.make_aware(datetime.combine(now.date() + timedelta(days=1), dt_time.min))
+    return max(1, int((midnight - now).total_seconds()))
+
+
+def daily_usage(user_id, day=None) -> dict:
+    """{'calls', 'tokens', 'by_action': {action: calls}} of a user for one day (default today)."""
+    rows = (
+        _rollup_model().objects
+        .filter(user_id=user_id, day=day or timezone.localdate())
+        .values('action')
+        .annotate(calls=Sum('calls'), prompt=Sum('prompt_tokens'), reply=Sum('reply_tokens'))
+    )
+    usage = {'calls': 0, 'tokens': 0, 'by_action': {}}
+    for row in rows:
+        usage['calls'] += row['calls']
+        usage['tokens'] += row['prompt'] + row['reply']
+        usage['by_action'][row['action']] = usage['by_action'].get(row['action'], 0) + row['calls']
+    return usage
+
+
+def check_quota(action: str = None, context: UsageContext = None) -> None:
+    """Raise QuotaExceeded if the caller has spent one of today's quotas."""
+    context = context or _current.get()
+    if context is None or context.user_id is None or not context.enforce_quota or context.exempt:
+        return
+    config = get_config()
+    if not config['QUOTAS_ENABLED']:
+        return
+    usage = daily_usage(context.user_id)
+    action_limit = (config['ACTION_DAILY_CALLS'] or {}).get(action or 'chat')
+    if (
+        (config['DAILY_TOKENS'] and usage['tokens'] >= config['DAILY_TOKENS'])
+        or (config['DAILY_CALLS'] and usage['calls'] >= config['DAILY_CALLS'])
+        or (action_limit and usage['by_action'].get(action or 'chat', 0) >= action_limit)
+    ):
+        raise QuotaExceeded(wait=seconds_until_tomorrow())
+
+
+# ============================================================================
+# LEDGER
+# ============================================================================
+
+def _rollup_model():
+    from authentication.models import LLMUsageRollup
+    return LLMUsageRollup
+
+
+def model_label(provider) -> str:
+    model = getattr(provider, 'model', None)
+    return f"{provider.name}:{model}" if model else provider.name
+
+
+def reported_tokens(reply):
+    """(prompt_tokens, reply_tokens) reported upstream for a reply (llm.ReplyText), None when unknown."""
+    return getattr(reply, 'prompt_tokens', None), getattr(reply, 'reply_tokens', None)
+
+
+def record_call(action, model, prompt, reply, latency, context: UsageContext = None, requests: int = 1,
+                prompt_tokens: int = None, reply_tokens: int = None) -> None:
+    """Write one event and add it to today's rollup. Never raises: accounting must not fail a reply.
+
+    prompt_tokens / reply_tokens are the counts reported upstream (read from
+    reply when it is an llm.ReplyText); each is estimated from the text when
+    unknown.
+    """
+    config = get_config()
+    if not config['ENABLED']:
+        return
+    from authentication.models import LLMUsageEvent
+
+    context = context or _current.get()
+    user_id = context.user_id if context else None
+    user_matter_id = context.user_matter_id if context else None
+    action = action or 'chat'
+    reported_prompt, reported_reply = reported_tokens(reply)
+    prompt_tokens = reported_prompt if prompt_tokens is None else prompt_tokens
+    reply_tokens = reported_reply if reply_tokens is None else reply_tokens
+    if prompt_tokens is None:
+        prompt_tokens = approximate_token_count(prompt or "")
+    if reply_tokens is None:
+        reply_tokens = approximate_token_count(reply or "")
+    latency_ms = int(latency * 1000)
+    succeeded = bool(reply)
+    try:
+        LLMUsageEvent.objects.create(
+            user_id=user_id, user_matter_id=user_matter_id, action=action, model=model,
+            prompt_tokens=prompt_tokens, reply_tokens=reply_tokens, latency_ms=latency_ms,
+            upstream_requests=requests, succeeded=succeeded,
+        )
+        Rollup = _rollup_model()
+        # Keyed on scope, not on the nullable foreign keys (NULLs never collide in a unique index)
+        key = dict(day=timezone.localdate(), scope=Rollup.scope_for(user_id, user_matter_id), action=action, model=model)
+        increments = dict(
+            calls=F('calls') + 1,
+            failures=F('failures') + (0 if succeeded else 1),
+            prompt_tokens=F('prompt_tokens') + prompt_tokens,
+            reply_tokens=F('reply_tokens') + reply_tokens,
+            latency_ms=F('latency_ms') + latency_ms,
+            upstream_requests=F('upstream_requests') + requests,
+        )
+        if not Rollup.objects.filter(**key).update(**increments):
+            try:
+                with transaction.atomic():
+                    Rollup.objects.create(
+                        user_id=user_id, user_matter_id=user_matter_id,
+                        calls=1, failures=0 if succeeded else 1, prompt_tokens=prompt_tokens,
+                        reply_tokens=reply_tokens, latency_ms=latency_ms, upstream_requests=requests, **key,
+                    )
+            except IntegrityError:
+                # Created concurrently by another worker
+                Rollup.objects.filter(**key).update(**increments)
+    except Exception as e:
+        print(f"LLM usage not recorded: {e}")
+
+
+class CallTimer:
+    """Measure one generation and record it on exit.
+
+        with CallTimer(action, provider, prompt) as call:
+            call.reply = provider.generate(prompt, action=action)
+    """
+
+    def __init__(self, action, provider, prompt, context: UsageContext = None):
+        self.action = action
+        self.provider = provider
+        self.model = model_label(provider)
+        self.prompt = prompt
+        self.context = context
+        self.reply = None
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        requests = self.provider.requests_sent() if hasattr(self.provider, 'requests_sent') else 1
+        record_call(
+            self.action, self.model, self.prompt, self.reply, time.perf_counter() - self.started, self.context, requests,
+        )
+        return False
+
+
+def prune_events(days: int = None) -> int:
+    """Delete events older than EVENT_RETENTION_DAYS; rollups are kept."""
+    from authentication.models import LLMUsageEvent
+
+    days = get_config()['EVENT_RETENTION_DAYS'] if days is None else days
+    deleted, _ = LLMUsageEvent.objects.filter(created_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
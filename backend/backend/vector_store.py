@@ -0,0 +1,187 @@
+"""
+Long-lived ChromaDB connections.
+
+Opening a PersistentClient (SQLite + HNSW segments) on every request is
+expensive, so each worker keeps one client per database path, caches the
+collection handles it hands out and memoizes collection counts.
+
+Writers in another process (the PDF indexer) call ``mark_index_updated`` which
+touches a stamp file in the database directory; readers notice the new stamp
+on their next access and reopen the client, dropping every cached handle.
+"""
+
+import os
+import threading
+import time
+
+try:
+    import chromadb
+    CHROMA_AVAILABLE = True
+except Exception:
+    chromadb = None
+    CHROMA_AVAILABLE = False
+
+INDEX_STAMP_FILENAME = ".index_stamp"
+
+# Counts are re-read at most this often even without an index stamp change
+COUNT_TTL_SECONDS = 300
+
+
+def default_chroma_path() -> str:
+    try:
+        from django.conf import settings
+        return str(settings.CHROMA_DB_PATH)
+    except Exception:
+        return "./chroma_db"
+
+
+def mark_index_updated(path: str = None) -> None:
+    """Signal every worker that the database at ``path`` was rewritten."""
+    path = path or default_chroma_path()
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, INDEX_STAMP_FILENAME), "w") as f:
+        f.write(str(time.time()))
+
+
+class VectorStore:
+    """One Chroma client per path, with cached collection handles and counts."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._client = None
+        self._collections = {}
+        self._counts = {}
+        self._stamp = None
+        self._lock = threading.RLock()
+
+    # ------------------------------------------------------------------
+    # Client lifecycle
+    # ------------------------------------------------------------------
+
+    def _read_stamp(self):
+        try:
+            return os.stat(os.path.join(self.path, INDEX_STAMP_FILENAME)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _check_stamp(self) -> None:
+        stamp = self._read_stamp()
+        if stamp != self._stamp:
+            with self._lock:
+                if stamp != self._stamp:
+                    if self._client is not None:
+                        self._reset_client()
+                    self._stamp = stamp
+
+    def _reset_client(self) -> None:
+        """Drop this store's client and handles. Call with self._lock held."""
+        client = self._client
+        self._collections.clear()
+        self._counts.clear()
+        self._client = None
+        # PersistentClients on one path share a cached System: stop only the
+        # one of this path so segments written by the other process are
+        # reloaded (clear_system_cache() would stop every store's System).
+        identifier = getattr(client, "_identifier", None)
+        if identifier is None:
+            return
+        try:
+            from chromadb.api.client import SharedSystemClient
+            system = SharedSystemClient._identifier_to_system.pop(identifier, None)
+            if system is not None:
+                system.stop()
+        except Exception:
+            pass
+
+    @property
+    def client(self):
+        self._check_stamp()
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    if not CHROMA_AVAILABLE:
+                        raise RuntimeError("chromadb is not installed")
+                    os.makedirs(self.path, exist_ok=True)
+                    self._client = chromadb.PersistentClient(path=self.path)
+        return self._client
+
+    # ------------------------------------------------------------------
+    # Collections
+    # ------------------------------------------------------------------
+
+    def get_collection(self, name: str, create: bool = False, metadata: dict = None):
+        """Return a cached collection handle.
+
+        With ``create=False`` a missing collection raises like
+        ``client.get_collection``.
+        """
+        client = self.client
+        collection = self._collections.get(name)
+        if collection is not None:
+            return collection
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                if create:
+                    collection = client.get_or_create_collection(name=name, metadata=metadata)
+                else:
+                    collection = client.get_collection(name=name)
+                self._collections[name] = collection
+        return collection
+
+    def delete_collection(self, name: str) -> None:
+        with self._lock:
+            self.forget(name)
+            self.client.delete_collection(name=name)
+
+    def list_collections(self):
+        return self.client.list_collections()
+
+    def forget(self, name: str) -> None:
+        """Drop the cached handle and count of one collection."""
+        with self._lock:
+            self._collections.pop(name, None)
+            self._counts.pop(name, None)
+
+    # ------------------------------------------------------------------
+    # Counts
+    # ------------------------------------------------------------------
+
+    def count(self, name: str) -> int:
+        """Best-effort document count of a collection, memoized."""
+        collection = self.get_collection(name)
+        cached = self._counts.get(name)
+        now = time.monotonic()
+        if cached is not None and now - cached[1] < COUNT_TTL_SECONDS:
+            return cached[0]
+        try:
+            value = collection.count()
+        except Exception:
+            # fallback: attempt a query and see if results exist
+            try:
+                probe = collection.query(query_texts=["test"], n_results=1)
+                value = len(probe.get('ids', [[]])[0])
+            except Exception:
+                value = 0
+        self._counts[name] = (value, now)
+        return value
+
+    def invalidate_count(self, name: str) -> None:
+        """Called after an in-process write to ``name``."""
+        self._counts.pop(name, None)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_vector_store(path: str = None) -> VectorStore:
+    """Return the process-wide VectorStore for ``path`` (settings.CHROMA_DB_PATH by default)."""
+    key = os.path.abspath(path or default_chroma_path())
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = _stores[key] = VectorStore(key)
+    return store
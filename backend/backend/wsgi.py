@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# Load the shared embedding model once per worker at boot instead of on the
+# first chat request (see backend.embeddings).
+from django.conf import settings  # noqa: E402
+
+if getattr(settings, 'EMBEDDING_WARMUP', False):
+    from backend.embeddings import warm_up_embeddings  # noqa: E402
+    warm_up_embeddings()
@@ -260,6 +260,25 @@ Crée un PARCOURS D'APPRENTISSAGE STRUCTURÉ en JSON:
 }}"""
 
 
+# ============================================================================
+# 8. ROLLING SUMMARY PROMPT - Résumé glissant des échanges de tutorat
+# ============================================================================
+ROLLING_SUMMARY_PROMPT = """Tu tiens à jour le résumé d'une conversation de tutorat.
+
+Élève: {user_name}
+Matière: {matiere}
+
+RÉSUMÉ ACTUEL:
+{previous_summary}
+
+NOUVEAUX ÉCHANGES:
+{new_turns}
+
+Réécris le résumé en intégrant les nouveaux échanges : notions abordées,
+difficultés rencontrées, explications déjà données et questions en suspens.
+Maximum {max_words} mots, en texte simple (pas de JSON, pas de titre)."""
+
+
 # ============================================================================
 # Helper functions
 # ============================================================================
@@ -325,3 +344,20 @@ def get_summary_prompt(
         date=date,
         conversation_history=conversation_history
     )
+
+
+def get_rolling_summary_prompt(
+    user_name: str,
+    matiere: str,
+    previous_summary: str,
+    new_turns: str,
+    max_words: int = 150
+) -> str:
+    """Retourne le prompt de mise à jour du résumé glissant"""
+    return ROLLING_SUMMARY_PROMPT.format(
+        user_name=user_name,
+        matiere=matiere,
+        previous_summary=previous_summary or "Aucun (début de la conversation).",
+        new_turns=new_turns,
+        max_words=max_words
+    )
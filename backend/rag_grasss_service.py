@@ -2,13 +2,31 @@
 Service RAG amélioré pour le système GRASSS
 Gère la récupération et le stockage de données vectorielles
 par utilisateur et par matière
+
+Avec RAG_MEMORY_STORAGE='shared', la mémoire de tous les élèves vit dans
+deux collections partagées partitionnées par métadonnées. Le défaut reste
+'per_user' (ancien schéma) tant que `manage.py migrate_rag_collections` n'a
+pas copié les collections existantes.
+
+Sans chromadb, la mémoire vit dans un index en mémoire propre à chaque
+processus : ce qu'écrit un worker `run_jobs` serait perdu pour le serveur
+web. run_jobs refuse donc de démarrer dans ce mode ; utiliser
+BACKGROUND_JOBS_EAGER=True pour exécuter les tâches dans le processus web.
 """
 
 import os
 import json
+import threading
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 
+import numpy as np
+
+from backend.context_packing import Passage, pack
+from backend.embeddings import embed_texts
+from backend.tracing import span
+from backend.vector_store import get_vector_store
+
 # chromadb is optional during development; provide a lightweight in-memory
 # fallback client when chromadb is not available.
 try:
@@ -21,85 +39,478 @@ except Exception:
     CHROMA_AVAILABLE = False
 
 
+def _matches(metadata: Dict, where: Dict) -> bool:
+    """Évaluer un filtre `where` (syntaxe Chroma) sur les métadonnées d'un document"""
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, c) for c in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(_matches(metadata, c) for c in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, expected in condition.items():
+            if op == "$eq" and value != expected:
+                return False
+            if op == "$ne" and value == expected:
+                return False
+            if op == "$in" and value not in expected:
+                return False
+            if op == "$nin" and value in expected:
+                return False
+            if op in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                if op == "$gt" and not value > expected:
+                    return False
+                if op == "$gte" and not value >= expected:
+                    return False
+                if op == "$lt" and not value < expected:
+                    return False
+                if op == "$lte" and not value <= expected:
+                    return False
+    return True
+
+
+STORAGE_SHARED = "shared"
+STORAGE_PER_USER = "per_user"
+SHARED_USER_COLLECTION = "grasss_user_memory"
+SHARED_MATTER_COLLECTION = "grasss_matter_memory"
+
+
+def _default_storage_mode() -> str:
+    try:
+        from django.conf import settings
+        return getattr(settings, 'RAG_MEMORY_STORAGE', STORAGE_PER_USER)
+    except Exception:
+        return STORAGE_PER_USER
+
+
+def _combine_where(*conditions: Optional[Dict]) -> Optional[Dict]:
+    """Combiner des filtres `where` Chroma avec $and (None ignorés)"""
+    clauses = []
+    for condition in conditions:
+        if not condition:
+            continue
+        clauses.extend(condition["$and"] if "$and" in condition else [condition])
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def _flatten_documents(results: Dict) -> List[str]:
+    """Documents d'un résultat `query` (listes imbriquées) ou `get` (liste plate)"""
+    documents = results.get("documents") or []
+    if documents and isinstance(documents[0], list):
+        documents = [doc for batch in documents for doc in batch]
+    return [doc for doc in documents if doc]
+
+
 class _InMemoryCollection:
-    def __init__(self, name: str):
+    """Index vectoriel en mémoire (NumPy) compatible avec l'API Chroma utilisée ici.
+
+    Les vecteurs normalisés sont rangés dans une matrice float32 contiguë
+    (capacité doublée à la demande) : une requête est un produit matrice-vecteur
+    suivi d'un top-k par argpartition. Les filtres d'égalité / $in passent par
+    un index inversé des métadonnées ; les autres opérateurs sont évalués ligne
+    à ligne sur les seuls candidats.
+
+    Sous ASGI chaque requête tourne dans son propre thread : écritures et
+    lectures passent par un verrou (les embeddings sont calculés hors verrou).
+    """
+
+    def __init__(self, name: str, metadata=None):
         self.name = name
-        self._docs = []
+        self.metadata = metadata or {}
         self._ids = []
+        self._docs = []
         self._metadatas = []
+        self._rows = {}
+        self._matrix = None
+        self._has_vector = np.zeros(0, dtype=bool)
+        self._meta_index = {}  # clé -> valeur -> set(lignes)
+        self._lock = threading.RLock()
+
+    # ------------------------------------------------------------------
+    # Stockage
+    # ------------------------------------------------------------------
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._ids)
+
+    def _ensure_capacity(self, dim: int, needed: int) -> None:
+        if self._matrix is None:
+            capacity = max(64, needed)
+            self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+            self._has_vector = np.zeros(capacity, dtype=bool)
+            return
+        if self._matrix.shape[1] != dim:
+            raise ValueError(
+                f"Embedding dimension {dim} does not match collection dimensionality {self._matrix.shape[1]}"
+            )
+        if needed > self._matrix.shape[0]:
+            capacity = max(needed, self._matrix.shape[0] * 2)
+            matrix = np.zeros((capacity, dim), dtype=np.float32)
+            matrix[:self._matrix.shape[0]] = self._matrix
+            has_vector = np.zeros(capacity, dtype=bool)
+            has_vector[:self._has_vector.shape[0]] = self._has_vector
+            self._matrix, self._has_vector = matrix, has_vector
 
-    def add(self, documents=None, ids=None, metadatas=None, **kwargs):
-        documents = documents or []
-        ids = ids or []
-        metadatas = metadatas or []
-        for d, i, m in zip(documents, ids, metadatas):
-            self._docs.append(d)
-            self._ids.append(i)
-            self._metadatas.append(m)
+    @staticmethod
+    def _normalize(vectors):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
 
-    def get(self):
-        return {"documents": list(self._docs), "metadatas": list(self._metadatas), "ids": list(self._ids)}
+    @staticmethod
+    def _embed_documents(documents):
+        try:
+            return embed_texts(documents)
+        except Exception:
+            return None
+
+    def _index_metadata(self, row: int, metadata: Dict) -> None:
+        for key, value in (metadata or {}).items():
+            try:
+                self._meta_index.setdefault(key, {}).setdefault(value, set()).add(row)
+            except TypeError:  # valeur non hashable : filtrée ligne à ligne
+                pass
+
+    def _unindex_metadata(self, row: int, metadata: Dict) -> None:
+        for key, value in (metadata or {}).items():
+            try:
+                rows = self._meta_index.get(key, {}).get(value)
+            except TypeError:
+                continue
+            if rows is not None:
+                rows.discard(row)
+
+    def upsert(self, ids=None, documents=None, metadatas=None, embeddings=None, **kwargs):
+        ids = list(ids or [])
+        if not ids:
+            return
+        documents = list(documents) if documents is not None else [None] * len(ids)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in ids]
+        if embeddings is None and any(d is not None for d in documents):
+            embeddings = self._embed_documents([d or "" for d in documents])
+        vectors = self._normalize(embeddings) if embeddings is not None and len(embeddings) else None
+        with self._lock:
+            self._upsert_rows(ids, documents, metadatas, vectors)
+
+    def _upsert_rows(self, ids, documents, metadatas, vectors):
+        for position, doc_id in enumerate(ids):
+            row = self._rows.get(doc_id)
+            if row is None:
+                row = len(self._ids)
+                self._ids.append(doc_id)
+                self._docs.append(documents[position])
+                self._metadatas.append(metadatas[position] or {})
+                self._rows[doc_id] = row
+            else:
+                self._unindex_metadata(row, self._metadatas[row])
+                self._docs[row] = documents[position]
+                self._metadatas[row] = metadatas[position] or {}
+            self._index_metadata(row, self._metadatas[row])
+            if vectors is not None:
+                self._ensure_capacity(vectors.shape[1], row + 1)
+                self._matrix[row] = vectors[position]
+                self._has_vector[row] = True
+            elif self._matrix is not None:
+                self._ensure_capacity(self._matrix.shape[1], row + 1)
+                self._has_vector[row] = False
+
+    def add(self, documents=None, ids=None, metadatas=None, embeddings=None, **kwargs):
+        if embeddings is None and documents is not None and any(d is not None for d in documents):
+            # Hors verrou : le calcul des embeddings est le plus long
+            embeddings = self._embed_documents([d or "" for d in documents])
+        with self._lock:
+            duplicates = [i for i in (ids or []) if i in self._rows]
+            if duplicates:
+                # Chroma ignore les ids déjà présents lors d'un add
+                keep = [k for k, i in enumerate(ids) if i not in self._rows]
+                ids = [ids[k] for k in keep]
+                documents = [documents[k] for k in keep] if documents is not None else None
+                metadatas = [metadatas[k] for k in keep] if metadatas is not None else None
+                embeddings = [embeddings[k] for k in keep] if embeddings is not None else None
+            # Verrou réentrant : aucun add concurrent ne peut insérer ces ids entre-temps
+            self.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+
+    def delete(self, ids=None, where=None, **kwargs):
+        with self._lock:
+            self._delete_rows(ids, where)
+
+    def _delete_rows(self, ids, where):
+        rows = set()
+        if ids:
+            rows.update(self._rows[i] for i in ids if i in self._rows)
+        if where:
+            rows.update(int(r) for r in np.flatnonzero(self._where_mask(where)))
+        # Suppression par échange avec la dernière ligne : la matrice reste contiguë
+        for row in sorted(rows, reverse=True):
+            last = len(self._ids) - 1
+            self._unindex_metadata(row, self._metadatas[row])
+            del self._rows[self._ids[row]]
+            if row != last:
+                self._unindex_metadata(last, self._metadatas[last])
+                self._ids[row] = self._ids[last]
+                self._docs[row] = self._docs[last]
+                self._metadatas[row] = self._metadatas[last]
+                self._rows[self._ids[row]] = row
+                self._index_metadata(row, self._metadatas[row])
+                if self._matrix is not None:
+                    self._matrix[row] = self._matrix[last]
+                    self._has_vector[row] = self._has_vector[last]
+            self._ids.pop()
+            self._docs.pop()
+            self._metadatas.pop()
+            if self._matrix is not None:
+                self._has_vector[last] = False
+
+    # ------------------------------------------------------------------
+    # Filtres
+    # ------------------------------------------------------------------
+
+    def _where_mask(self, where: Optional[Dict]):
+        n = len(self._ids)
+        mask = np.ones(n, dtype=bool)
+        if not where:
+            return mask
+        residual = {}
+        for key, condition in where.items():
+            if key.startswith("$"):
+                residual[key] = condition
+                continue
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            values = None
+            if set(condition) == {"$eq"}:
+                values = [condition["$eq"]]
+            elif set(condition) == {"$in"}:
+                values = list(condition["$in"])
+            if values is None:
+                residual[key] = condition
+                continue
+            index = self._meta_index.get(key, {})
+            rows = set()
+            for value in values:
+                try:
+                    rows |= index.get(value, set())
+                except TypeError:
+                    pass
+            key_mask = np.zeros(n, dtype=bool)
+            if rows:
+                key_mask[np.fromiter(rows, dtype=np.int64, count=len(rows))] = True
+            mask &= key_mask
+        if residual:
+            for row in np.flatnonzero(mask):
+                if not _matches(self._metadatas[row], residual):
+                    mask[row] = False
+        return mask
+
+    # ------------------------------------------------------------------
+    # Lecture
+    # ------------------------------------------------------------------
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None, **kwargs):
+        with self._lock:
+            return self._get_rows(ids, where, limit, offset)
+
+    def _get_rows(self, ids, where, limit, offset):
+        if ids is not None:
+            rows = [self._rows[i] for i in ids if i in self._rows]
+            if where:
+                mask = self._where_mask(where)
+                rows = [r for r in rows if mask[r]]
+        elif where:
+            rows = np.flatnonzero(self._where_mask(where)).tolist()
+        else:
+            rows = range(len(self._ids))
+        rows = list(rows)[offset or 0:]
+        if limit is not None:
+            rows = rows[:limit]
+        return {
+            "ids": [self._ids[r] for r in rows],
+            "documents": [self._docs[r] for r in rows],
+            "metadatas": [self._metadatas[r] for r in rows],
+        }
+
+    def query(self, query_embeddings=None, query_texts=None, n_results=5, where=None, include=None, **kwargs):
+        """Top-k cosinus ; même format imbriqué que Chroma (une liste par requête)."""
+        if query_embeddings is None and query_texts is not None:
+            query_embeddings = self._embed_documents(list(query_texts))
+        n_queries = len(query_embeddings) if query_embeddings is not None else len(query_texts or [None])
+        with self._lock:
+            return self._query_rows(query_embeddings, n_queries, n_results, where)
+
+    def _query_rows(self, query_embeddings, n_queries, n_results, where):
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+
+        candidates = np.flatnonzero(self._where_mask(where))
+        if self._matrix is not None and len(candidates):
+            candidates = candidates[self._has_vector[candidates]] if query_embeddings is not None else candidates
+        k = min(n_results, len(candidates))
+
+        if query_embeddings is None or self._matrix is None:
+            # Pas d'embedding disponible : documents les plus récents
+            top = candidates[::-1][:k]
+            for _ in range(n_queries):
+                self._append_result(result, top, [None] * len(top))
+            return result
+
+        queries = self._normalize(query_embeddings)
+        if len(candidates) == len(self._ids):
+            block = self._matrix[:len(self._ids)]  # vue, sans copie
+        else:
+            block = self._matrix[candidates]
+        # (n, d) @ (d, q) : parcours de la matrice ligne à ligne, plus rapide que queries @ block.T
+        scores = (block @ queries.T).T
+        for q_scores in scores:
+            if k < len(candidates):
+                part = np.argpartition(-q_scores, k - 1)[:k]
+            else:
+                part = np.arange(len(candidates))
+            order = part[np.argsort(-q_scores[part])]
+            self._append_result(result, candidates[order], (1.0 - q_scores[order]).tolist())
+        return result
 
-    def query(self, query_texts=None, n_results=5, **kwargs):
-        # naive implementation: return last n_results documents
-        docs = list(self._docs)[-n_results:]
-        return {"documents": docs, "metadatas": list(self._metadatas)[-n_results:], "ids": list(self._ids)[-n_results:]}
+    def _append_result(self, result, rows, distances):
+        result["ids"].append([self._ids[r] for r in rows])
+        result["documents"].append([self._docs[r] for r in rows])
+        result["metadatas"].append([self._metadatas[r] for r in rows])
+        result["distances"].append(list(distances))
 
 
 class _InMemoryClient:
     def __init__(self):
         self._collections = {}
+        self._lock = threading.Lock()
 
     def get_collection(self, name: str):
-        if name not in self._collections:
-            raise KeyError("Collection not found")
-        return self._collections[name]
+        with self._lock:
+            if name not in self._collections:
+                raise KeyError("Collection not found")
+            return self._collections[name]
 
     def create_collection(self, name: str, metadata=None):
-        col = _InMemoryCollection(name)
-        self._collections[name] = col
+        col = _InMemoryCollection(name, metadata)
+        with self._lock:
+            self._collections[name] = col
         return col
 
+    def get_or_create_collection(self, name: str, metadata=None):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = _InMemoryCollection(name, metadata)
+            return self._collections[name]
+
     def list_collections(self):
-        return [type('C', (), {'name': n}) for n in self._collections.keys()]
+        with self._lock:
+            return [type('C', (), {'name': n}) for n in list(self._collections)]
 
     def delete_collection(self, name: str):
-        if name in self._collections:
-            del self._collections[name]
+        with self._lock:
+            self._collections.pop(name, None)
 
 
 class RAGGRASSService:
     """Service RAG pour le système GRASSS d'apprentissage adaptatif"""
     
-    def __init__(self, chroma_db_path: str = None):
-        """Initialiser le service RAG"""
+    def __init__(self, chroma_db_path: str = None, storage_mode: str = None):
+        """Initialiser le service RAG
+
+        storage_mode:
+            "shared"   -> toute la mémoire dans deux collections partagées,
+                          partitionnées par les métadonnées user_id / matiere_key
+            "per_user" -> ancien schéma, une collection par utilisateur et
+                          par couple utilisateur × matière
+        """
         if chroma_db_path is None:
             chroma_db_path = os.path.join(os.path.dirname(__file__), 'chroma_db')
+        if storage_mode is None:
+            storage_mode = _default_storage_mode()
         
         self.chroma_db_path = chroma_db_path
+        self.shared_storage = storage_mode == STORAGE_SHARED
         os.makedirs(chroma_db_path, exist_ok=True)
         
-        # Initialiser Chroma (ou fallback mémoire si indisponible)
+        # Initialiser Chroma (ou fallback mémoire si indisponible).
+        # Le client persistant est partagé avec rag_service via backend.vector_store.
+        self.store = None
         if CHROMA_AVAILABLE:
             try:
-                # Use persistent client when available
-                self.client = chromadb.PersistentClient(path=chroma_db_path)
+                self.store = get_vector_store(chroma_db_path)
+                self.client = self.store.client
             except Exception:
                 # Fallback to in-memory client if persistent init fails
+                self.store = None
                 self.client = _InMemoryClient()
         else:
             self.client = _InMemoryClient()
     
+    @property
+    def persistent(self) -> bool:
+        """False avec l'index en mémoire de secours (propre au processus)"""
+        return self.store is not None
+
+    def reopen(self, chroma_db_path: str, storage_mode: str = None) -> None:
+        """Repointer le service vers une autre base (benchmarks, scripts de maintenance)"""
+        self.__init__(chroma_db_path=chroma_db_path, storage_mode=storage_mode)
+
     def get_or_create_collection(self, collection_name: str) -> any:
-        """Obtenir ou créer une collection Chroma"""
-        try:
-            collection = self.client.get_collection(name=collection_name)
-        except:
-            collection = self.client.create_collection(
-                name=collection_name,
+        """Obtenir ou créer une collection Chroma (handle mis en cache par processus)"""
+        if self.store is not None:
+            return self.store.get_collection(
+                collection_name,
+                create=True,
                 metadata={"hnsw:space": "cosine"}
             )
-        return collection
+        # Client mémoire : création atomique, deux requêtes ne peuvent pas se la disputer
+        return self.client.get_or_create_collection(
+            name=collection_name,
+            metadata={"hnsw:space": "cosine"}
+        )
+
+    def _embed(self, texts: List[str]) -> Optional[List[List[float]]]:
+        """Calculer les embeddings avec le modèle partagé du processus.
+
+        Retourne None si le modèle local est indisponible : Chroma utilise
+        alors la fonction d'embedding de la collection.
+        """
+        try:
+            return embed_texts(texts)
+        except Exception as e:
+            print(f"Embeddings locaux indisponibles: {e}")
+            return None
+
+    def _add_document(self, collection, doc_text: str, doc_id: str, metadata: Dict[str, Any]) -> None:
+        """Ajouter un document en fournissant l'embedding pré-calculé"""
+        kwargs = {"documents": [doc_text], "ids": [doc_id], "metadatas": [metadata]}
+        embeddings = self._embed([doc_text])
+        if embeddings is not None:
+            kwargs["embeddings"] = embeddings
+        collection.add(**kwargs)
+        if self.store is not None:
+            self.store.invalidate_count(collection.name)
+
+    def _query(self, collection, query: str, n_results: int, where: Optional[Dict] = None):
+        """Interroger une collection par embedding (texte brut en dernier recours)"""
+        kwargs = {"n_results": n_results}
+        if where:
+            kwargs["where"] = where
+        embeddings = self._embed([query])
+        if embeddings is not None:
+            kwargs["query_embeddings"] = embeddings
+        else:
+            kwargs["query_texts"] = [query]
+        return collection.query(**kwargs)
     
     # ========================================================================
     # MÉTHODÉ UTILISATEURS
@@ -111,45 +522,63 @@ class RAGGRASSService:
     
     def get_matter_collection_name(self, user_id: int, matiere: str) -> str:
         """Générer le nom de collection pour une matière d'un utilisateur"""
-        sanitized_matiere = matiere.lower().replace(' ', '_').replace('/', '_')
-        return f"user_{user_id}_matter_{sanitized_matiere}"
+        return f"user_{user_id}_matter_{self.get_matter_key(matiere)}"
+
+    @staticmethod
+    def get_matter_key(matiere: str) -> str:
+        """Clé normalisée d'une matière (suffixe de collection / métadonnée matiere_key)"""
+        return matiere.lower().replace(' ', '_').replace('/', '_')
+
+    def _user_memory(self, user_id: int):
+        """(collection, filtre where) de la mémoire profil/diagnostic d'un utilisateur"""
+        if self.shared_storage:
+            return self.get_or_create_collection(SHARED_USER_COLLECTION), {"user_id": user_id}
+        return self.get_or_create_collection(self.get_user_collection_name(user_id)), None
+
+    def _matter_memory(self, user_id: int, matiere: str):
+        """(collection, filtre where) de l'historique d'une matière d'un utilisateur"""
+        if self.shared_storage:
+            return self.get_or_create_collection(SHARED_MATTER_COLLECTION), {
+                "$and": [{"user_id": user_id}, {"matiere_key": self.get_matter_key(matiere)}]
+            }
+        return self.get_or_create_collection(self.get_matter_collection_name(user_id, matiere)), None
     
     def store_user_profile(self, user_id: int, profile_data: Dict[str, Any]) -> str:
         """Stocker le profil utilisateur dans la BD vectorielle"""
-        collection = self.get_or_create_collection(self.get_user_collection_name(user_id))
+        collection, _ = self._user_memory(user_id)
         
         doc_text = self._format_user_profile(profile_data)
         doc_id = f"profile_{user_id}_{datetime.now().timestamp()}"
         
-        collection.add(
-            documents=[doc_text],
-            ids=[doc_id],
-            metadatas=[{
-                "type": "profile",
-                "user_id": user_id,
-                "created_at": datetime.now().isoformat()
-            }]
-        )
+        self._add_document(collection, doc_text, doc_id, {
+            "type": "profile",
+            "user_id": user_id,
+            "created_at": datetime.now().isoformat()
+        })
         
         return doc_id
     
-    def store_user_diagnostic(self, user_id: int, diagnostic_data: Dict[str, Any]) -> str:
-        """Stocker les résultats du diagnostic utilisateur"""
-        collection = self.get_or_create_collection(self.get_user_collection_name(user_id))
+    def store_user_diagnostic(
+        self,
+        user_id: int,
+        diagnostic_data: Dict[str, Any],
+        doc_id: Optional[str] = None
+    ) -> str:
+        """Stocker les résultats du diagnostic utilisateur
+
+        Un doc_id fixe rend l'écriture idempotente (tâche rejouée).
+        """
+        collection, _ = self._user_memory(user_id)
         
         doc_text = self._format_diagnostic(diagnostic_data)
-        doc_id = f"diagnostic_{user_id}_{datetime.now().timestamp()}"
+        doc_id = doc_id or f"diagnostic_{user_id}_{datetime.now().timestamp()}"
         
-        collection.add(
-            documents=[doc_text],
-            ids=[doc_id],
-            metadatas=[{
-                "type": "diagnostic",
-                "user_id": user_id,
-                "niveau": diagnostic_data.get('niveau_diagnostique'),
-                "created_at": datetime.now().isoformat()
-            }]
-        )
+        self._add_document(collection, doc_text, doc_id, {
+            "type": "diagnostic",
+            "user_id": user_id,
+            "niveau": diagnostic_data.get('niveau_diagnostique'),
+            "created_at": datetime.now().isoformat()
+        })
         
         return doc_id
     
@@ -157,27 +586,23 @@ class RAGGRASSService:
         self, 
         user_id: int, 
         matiere: str, 
-        summary_data: Dict[str, Any]
+        summary_data: Dict[str, Any],
+        doc_id: Optional[str] = None
     ) -> str:
         """Stocker un résumé de conversation dans la BD vectorielle"""
-        collection = self.get_or_create_collection(
-            self.get_matter_collection_name(user_id, matiere)
-        )
+        collection, _ = self._matter_memory(user_id, matiere)
         
         doc_text = self._format_conversation_summary(summary_data)
-        doc_id = f"summary_{user_id}_{matiere}_{datetime.now().timestamp()}"
+        doc_id = doc_id or f"summary_{user_id}_{matiere}_{datetime.now().timestamp()}"
         
-        collection.add(
-            documents=[doc_text],
-            ids=[doc_id],
-            metadatas=[{
-                "type": "conversation_summary",
-                "user_id": user_id,
-                "matiere": matiere,
-                "concepts": ",".join(summary_data.get('key_concepts', [])),
-                "created_at": datetime.now().isoformat()
-            }]
-        )
+        self._add_document(collection, doc_text, doc_id, {
+            "type": "conversation_summary",
+            "user_id": user_id,
+            "matiere": matiere,
+            "matiere_key": self.get_matter_key(matiere),
+            "concepts": ",".join(summary_data.get('key_concepts', [])),
+            "created_at": datetime.now().isoformat()
+        })
         
         return doc_id
     
@@ -187,27 +612,27 @@ class RAGGRASSService:
     
     def get_user_context(self, user_id: int, query: str = None) -> str:
         """Récupérer le contexte utilisateur pour les prompts"""
-        collection = self.get_or_create_collection(self.get_user_collection_name(user_id))
+        collection, partition = self._user_memory(user_id)
         
         try:
             if query:
-                results = collection.query(
-                    query_texts=[query],
+                results = self._query(
+                    collection,
+                    query,
                     n_results=3,
-                    where={"type": {"$in": ["profile", "diagnostic"]}}
+                    where=_combine_where(partition, {"type": {"$in": ["profile", "diagnostic"]}})
                 )
             else:
                 # Récupérer les documents les plus récents
-                all_results = collection.get()
+                all_results = collection.get(where=partition) if partition else collection.get()
                 results = {
                     "documents": all_results.get("documents", [])[-3:],
                     "metadatas": all_results.get("metadatas", [])[-3:]
                 }
             
             context_text = ""
-            if results.get("documents"):
-                for doc in results["documents"]:
-                    context_text += doc + "\n\n"
+            for doc in _flatten_documents(results):
+                context_text += doc + "\n\n"
             
             return context_text if context_text else "Pas de contexte disponible."
         
@@ -215,43 +640,65 @@ class RAGGRASSService:
             print(f"Erreur lors de la récupération du contexte utilisateur: {e}")
             return "Contexte non disponible."
     
+    def get_matter_passages(
+        self,
+        user_id: int,
+        matiere: str,
+        query: str = None,
+        n_results: int = 5
+    ) -> List[Passage]:
+        """Souvenirs d'une matière avec un score (similarité, ou récence sans requête)"""
+        collection, partition = self._matter_memory(user_id, matiere)
+
+        if query:
+            results = self._query(collection, query, n_results=n_results, where=partition)
+            documents = (results.get("documents") or [[]])[0]
+            distances = (results.get("distances") or [[]])[0] or [None] * len(documents)
+            ids = (results.get("ids") or [[]])[0] or [None] * len(documents)
+            return [
+                Passage(doc, score=1.0 - distance if distance is not None else 1.0 / rank, source=doc_id, kind="memory")
+                for rank, (doc, distance, doc_id) in enumerate(zip(documents, distances, ids), start=1)
+                if doc
+            ]
+
+        # Documents les plus récents, le dernier en premier
+        all_results = collection.get(where=partition) if partition else collection.get()
+        documents = (all_results.get("documents") or [])[-n_results:]
+        ids = (all_results.get("ids") or [])[-n_results:] or [None] * len(documents)
+        return [
+            Passage(doc, score=float(position), source=doc_id, kind="memory")
+            for position, (doc, doc_id) in enumerate(zip(documents, ids), start=1)
+            if doc
+        ]
+
     def get_matter_context(
         self, 
         user_id: int, 
         matiere: str, 
         query: str = None,
-        n_results: int = 5
+        n_results: int = 5,
+        max_tokens: int = None
     ) -> str:
-        """Récupérer le contexte d'apprentissage pour une matière"""
-        collection_name = self.get_matter_collection_name(user_id, matiere)
-        
+        """Récupérer le contexte d'apprentissage pour une matière
+
+        Avec max_tokens, les souvenirs sont dédoublonnés, classés par score et
+        tronqués à ce budget (voir backend.context_packing).
+        """
         try:
-            collection = self.get_or_create_collection(collection_name)
-            
-            if query:
-                results = collection.query(
-                    query_texts=[query],
-                    n_results=n_results
-                )
-            else:
-                # Récupérer les documents les plus récents
-                all_results = collection.get()
-                documents = all_results.get("documents", [])
-                results = {
-                    "documents": documents[-n_results:] if documents else [],
-                    "metadatas": all_results.get("metadatas", [])[-n_results:] if all_results.get("metadatas") else []
-                }
-            
-            context_text = ""
-            if results.get("documents"):
-                for doc in results["documents"]:
-                    context_text += doc + "\n\n"
-            
-            return context_text if context_text else "Pas d'historique d'apprentissage pour cette matière."
-        
+            with span("memory.retrieve", n=n_results):
+                passages = self.get_matter_passages(user_id, matiere, query=query, n_results=n_results)
         except Exception as e:
             print(f"Erreur lors de la récupération du contexte matière: {e}")
             return "Contexte matière non disponible."
+
+        if max_tokens is not None:
+            with span("memory.pack", budget=max_tokens):
+                passages = pack(passages, max_tokens)
+        context_text = ""
+        for passage in passages:
+            context_text += passage.text + "\n\n"
+
+        return context_text if context_text else "Pas d'historique d'apprentissage pour cette matière."
     
     # ========================================================================
     # FORMATAGE DES DOCUMENTS
@@ -314,8 +761,17 @@ Recommandations: {summary_data.get('recommandations', 'N/A')}
     def clear_user_data(self, user_id: int) -> bool:
         """Effacer toutes les données d'un utilisateur (utile pour reset)"""
         try:
+            if self.shared_storage:
+                collection, partition = self._user_memory(user_id)
+                collection.delete(where=partition)
+                if self.store is not None:
+                    self.store.invalidate_count(collection.name)
+                return True
             collection_name = self.get_user_collection_name(user_id)
-            self.client.delete_collection(name=collection_name)
+            if self.store is not None:
+                self.store.delete_collection(collection_name)
+            else:
+                self.client.delete_collection(name=collection_name)
             return True
         except:
             return False
@@ -324,13 +780,23 @@ Recommandations: {summary_data.get('recommandations', 'N/A')}
         """Obtenir toutes les matières étudiées par un utilisateur"""
         matters = []
         try:
+            if self.shared_storage:
+                # Filtre sur les métadonnées : pas de parcours des collections
+                collection = self.get_or_create_collection(SHARED_MATTER_COLLECTION)
+                results = collection.get(where={"user_id": user_id}, include=["metadatas"])
+                for metadata in results.get("metadatas") or []:
+                    matter = (metadata or {}).get("matiere")
+                    if matter and matter not in matters:
+                        matters.append(matter)
+                return matters
             # Parcourir toutes les collections
-            collections = self.client.list_collections()
+            collections = (self.store or self.client).list_collections()
             prefix = f"user_{user_id}_matter_"
             for collection in collections:
-                if collection.name.startswith(prefix):
+                name = getattr(collection, "name", collection)
+                if name.startswith(prefix):
                     # Extraire le nom de la matière
-                    matter = collection.name.replace(prefix, "").replace("_", " ")
+                    matter = name.replace(prefix, "").replace("_", " ")
                     matters.append(matter)
         except:
             pass